@@ -0,0 +1,191 @@
+import time
+import threading
+from collections import OrderedDict, deque
+import metrics
+from settings import settings
+from slots import SlotGate
+from tracing import current_span, get_logger
+
+logger = get_logger('admission')
+
+# Drop idle (full) token buckets once this many teachers are tracked
+MAX_TRACKED_TEACHERS = 10000
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a generation request is turned away; answered with 429
+    """
+    def __init__(self, message, retry_after, reason):
+        self.retry_after = retry_after
+        self.reason = reason
+        super().__init__(message)
+
+
+class TokenBucket:
+    """
+    Allows `burst` requests at once, refilled at `rate` requests per second
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def take(self, now):
+        """
+        Spend a token. Returns 0 on success, otherwise seconds until one is available.
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class AdmissionController(SlotGate):
+    """
+    Gate in front of AI test generation.
+
+    Each teacher has a token bucket limiting how often they can start a
+    generation, and at most `max_in_flight` generations run at once. Requests
+    beyond that wait in a bounded queue with one line per teacher; freed slots
+    go round-robin across teachers, so a teacher with many queued requests
+    cannot starve one with a single request. A full queue, an empty bucket or
+    a wait longer than `max_wait_seconds` is answered with AdmissionRejected.
+    """
+    def __init__(self, max_in_flight=4, max_queue=16, teacher_rate_per_minute=2, teacher_burst=3,
+                 max_wait_seconds=60):
+        super().__init__(max_in_flight, max_wait_seconds)
+        self.max_queue = max_queue
+        self.teacher_rate = teacher_rate_per_minute / 60
+        self.teacher_burst = teacher_burst
+
+        self._buckets = {}
+        self._queues = OrderedDict()   # teacher_id -> deque of waiters, in dispatch order
+        self._avg_run_seconds = 60.0   # moving average, for Retry-After estimates
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_in_flight=settings.generation_max_in_flight,
+            max_queue=settings.generation_max_queue,
+            teacher_rate_per_minute=settings.generation_teacher_rate_per_minute,
+            teacher_burst=settings.generation_teacher_burst,
+            max_wait_seconds=settings.generation_max_wait_seconds,
+        )
+
+    def _on_arrival(self, teacher_id):
+        now = time.monotonic()
+        bucket = self._buckets.get(teacher_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_TEACHERS:
+                self._prune_buckets(now)
+            bucket = self._buckets[teacher_id] = TokenBucket(self.teacher_rate, self.teacher_burst)
+        wait = bucket.take(now)
+        if wait:
+            self._reject('rate_limited', "Too many test generation requests; please wait before trying again", wait)
+
+    def _on_queue(self, teacher_id):
+        if self._queued >= self.max_queue:
+            self._buckets[teacher_id].refund()
+            retry_after = self._avg_run_seconds * (self._queued + 1) / max(1, self.max_in_flight)
+            self._reject('queue_full', "The test generation queue is full; please try again later", retry_after)
+
+    def _enqueue(self, waiter):
+        self._queues.setdefault(waiter.key, deque()).append(waiter)
+
+    def _dequeue(self):
+        """
+        Next waiter, one teacher at a time in rotation
+        """
+        if not self._queues:
+            return None
+        teacher_id, line = next(iter(self._queues.items()))
+        waiter = line.popleft()
+        if line:
+            self._queues.move_to_end(teacher_id)
+        else:
+            del self._queues[teacher_id]
+        return waiter
+
+    def _remove(self, waiter):
+        line = self._queues.get(waiter.key)
+        if line is None or waiter not in line:
+            return False
+        line.remove(waiter)
+        if not line:
+            del self._queues[waiter.key]
+        return True
+
+    def _on_abandoned(self, waiter):
+        # The teacher got nothing for this request, so don't charge for it
+        bucket = self._buckets.get(waiter.key)
+        if bucket is not None:
+            bucket.refund()
+
+    def _on_timeout(self, waiter):
+        self._reject('wait_timeout', "Timed out waiting for a test generation slot",
+                     self._avg_run_seconds / max(1, self.max_in_flight))
+
+    def _on_granted(self, teacher_id, waited):
+        metrics.GENERATION_QUEUE_WAIT_SECONDS.observe(waited)
+
+    def _on_released(self, held):
+        self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * held
+
+    def _reject(self, reason, message, retry_after):
+        metrics.GENERATION_REJECTIONS.labels(reason).inc()
+        current_span().set(admission=reason)
+        logger.info("Generation request rejected: %s", reason)
+        raise AdmissionRejected(message, retry_after, reason)
+
+    def _prune_buckets(self, now):
+        for teacher_id in [t for t, bucket in self._buckets.items() if bucket.full(now)]:
+            del self._buckets[teacher_id]
+
+    def _publish(self):
+        metrics.GENERATION_IN_FLIGHT.set(self._in_flight)
+        metrics.GENERATION_QUEUE_DEPTH.set(self._queued)
+
+    def snapshot(self):
+        """
+        Current load, for the admin status endpoint
+        """
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queued": self._queued,
+                "max_queue": self.max_queue,
+                "queued_by_teacher": {teacher_id: len(line) for teacher_id, line in self._queues.items()},
+                "avg_run_seconds": round(self._avg_run_seconds, 1),
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """
+    The process-wide admission controller for AI test generation
+    """
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController.from_settings()
+    return _controller
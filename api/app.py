@@ -1,15 +1,85 @@
-from flask import Flask, jsonify, request
+import time
+import threading
+from flask import Flask, Blueprint, jsonify, request, g, Response
 from flask_cors import CORS
-from mistral_wrapper import MistralAPI
+from mistral_wrapper import MistralAPI, CircuitOpenError
+from admission import get_admission_controller
+from llm_pool import get_endpoint_pool
+from llm_scheduler import get_llm_scheduler
+from surge import get_surge_cache
+from sweeper import get_attempt_sweeper
+from archiver import archive_attempts
+import deadline
+import metrics
+import profiling
+import serialization
+import tracing
+from settings import settings
+from deadline import DeadlineExceeded
 from controllers import AuthController, AdminController, TeacherController, StudentController
 from models import User, Test
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+logger = tracing.get_logger('app')
 
-# Initialize Mistral API
-mistral_api = MistralAPI(timeout=300)  # 5 minute timeout for API requests
+api = Blueprint('api', __name__)
+
+# Created on first use, so that a pre-forking server (gunicorn --preload)
+# builds it in each worker rather than once in the master
+_mistral_api = None
+_mistral_api_lock = threading.Lock()
+
+def get_mistral_api():
+    global _mistral_api
+    if _mistral_api is None:
+        with _mistral_api_lock:
+            if _mistral_api is None:
+                _mistral_api = MistralAPI(timeout=300, call_site='ask')  # 5 minute timeout for API requests
+    return _mistral_api
+
+# Time budget (seconds) for the LLM-bound endpoints. Clients can ask for less
+# with an X-Request-Timeout header; every LLM call is cut to what is left.
+ENDPOINT_DEADLINES = {
+    'api.ask_mistral': 60,
+    'api.generate_ai_test': 900,
+    'api.resume_generation_job': 900,
+    'api.submit_test': 180,
+    'api.grade_pending': 180,
+}
+
+def start_timer():
+    g.request_started = time.perf_counter()
+    # Label by route pattern, not raw path, to keep the number of series bounded
+    g.route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_id = tracing.start_trace(
+        f"{request.method} {g.route}",
+        request_id=request.headers.get('X-Request-ID'),
+        force_sample=request.headers.get('X-Trace') == '1'
+    )
+
+def record_request_metrics(response):
+    route = g.get('route', 'unmatched')
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    metrics.HTTP_REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(elapsed)
+    if response.content_length is not None:
+        metrics.HTTP_RESPONSE_BYTES.labels(request.method, route).observe(response.content_length)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    tracing.finish_trace(status=response.status_code)
+    return response
+
+def start_deadline():
+    deadline.set_deadline(deadline.budget(ENDPOINT_DEADLINES.get(request.endpoint),
+                                          request.headers.get('X-Request-Timeout')))
+
+def start_background_threads():
+    # On the first request rather than at import, so each forked worker runs its own
+    get_attempt_sweeper().start()
+    get_surge_cache().start()
+
+def clear_deadline(exc=None):
+    deadline.clear_deadline()
+    # Normally finished in after_request; this covers requests that errored out
+    tracing.finish_trace(error=type(exc).__name__ if exc else None)
 
 # Create admin user on startup
 def create_admin():
@@ -25,15 +95,30 @@ def create_admin():
             first_name='Admin',
             last_name='User'
         )
-        print("Admin user created successfully!")
+        logger.info("Admin user created successfully!")
+
+# Prometheus scrape endpoint
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
 
 # Health check endpoint
-@app.route('/api/hello', methods=['GET'])
+@api.route('/api/hello', methods=['GET'])
 def hello():
     return jsonify({"message": "Hello, World!"})
 
+# LLM backend health, as seen by the circuit breaker, the call scheduler and the endpoint pool
+@api.route('/api/health/llm', methods=['GET'])
+def llm_health():
+    return jsonify({
+        "circuit_breaker": get_mistral_api().circuit_state(),
+        "scheduler": get_llm_scheduler().snapshot(),
+        "endpoints": get_endpoint_pool().snapshot()
+    })
+
 # Mistral API endpoint
-@app.route('/api/ask', methods=['POST'])
+@api.route('/api/ask', methods=['POST'])
 def ask_mistral():
     data = request.get_json()
     
@@ -42,64 +127,108 @@ def ask_mistral():
     
     try:
         prompt = data['prompt']
-        response = mistral_api.get_response(prompt)
+        response = get_mistral_api().get_response(prompt)
         return jsonify({"response": response})
+    except CircuitOpenError as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(int(e.retry_after) + 1)}
+    except DeadlineExceeded as e:
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # Auth routes
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
 def register():
     return AuthController.register()
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login():
     return AuthController.login()
 
 # Admin routes
-@app.route('/api/admin/teachers/pending', methods=['GET'])
+@api.route('/api/admin/teachers/pending', methods=['GET'])
 def get_pending_teachers():
     # In a real app, check if user is admin first
     return AdminController.get_pending_teachers()
 
-@app.route('/api/admin/teachers/<teacher_id>/approve', methods=['POST'])
+@api.route('/api/admin/teachers/<teacher_id>/approve', methods=['POST'])
 def approve_teacher(teacher_id):
     # In a real app, check if user is admin first
     return AdminController.approve_teacher(teacher_id)
 
+@api.route('/api/admin/generation-queue', methods=['GET'])
+def generation_queue():
+    # In a real app, check if user is admin first
+    return jsonify({"generation": get_admission_controller().snapshot()})
+
 # Teacher routes
-@app.route('/api/tests', methods=['POST'])
+@api.route('/api/tests', methods=['POST'])
 def create_test():
     # In a real app, check if user is teacher first
     return TeacherController.create_test()
 
-@app.route('/api/tests/generate', methods=['POST'])
+@api.route('/api/tests/generate', methods=['POST'])
 def generate_ai_test():
     # In a real app, check if user is an approved teacher first
     return TeacherController.generate_ai_test()
 
-@app.route('/api/teachers/<teacher_id>/tests', methods=['GET'])
+@api.route('/api/generation-jobs/<job_id>', methods=['GET'])
+def get_generation_job(job_id):
+    # In a real app, check if user is the teacher who started the job
+    return TeacherController.get_generation_job(job_id)
+
+@api.route('/api/generation-jobs/<job_id>/resume', methods=['POST'])
+def resume_generation_job(job_id):
+    # In a real app, check if user is the teacher who started the job
+    return TeacherController.resume_generation_job(job_id)
+
+@api.route('/api/tests/<test_id>/questions', methods=['POST'])
+def add_question(test_id):
+    # In a real app, check if user is the teacher who created the test
+    return TeacherController.add_question(test_id)
+
+@api.route('/api/tests/<test_id>/questions/<int:index>', methods=['PATCH'])
+def update_question(test_id, index):
+    # In a real app, check if user is the teacher who created the test
+    return TeacherController.update_question(test_id, index)
+
+@api.route('/api/tests/<test_id>/questions/<int:index>', methods=['DELETE'])
+def delete_question(test_id, index):
+    # In a real app, check if user is the teacher who created the test
+    return TeacherController.delete_question(test_id, index)
+
+@api.route('/api/tests/<test_id>/questions/order', methods=['PUT'])
+def reorder_questions(test_id):
+    # In a real app, check if user is the teacher who created the test
+    return TeacherController.reorder_questions(test_id)
+
+@api.route('/api/teachers/<teacher_id>/tests', methods=['GET'])
 def get_teacher_tests(teacher_id):
     # In a real app, check if user is authorized first
     return TeacherController.get_tests(teacher_id)
 
-@app.route('/api/tests/<test_id>', methods=['GET'])
+@api.route('/api/tests/<test_id>', methods=['GET'])
 def get_test(test_id):
     # In a real app, check permissions based on user role
     return TeacherController.get_test(test_id)
 
-@app.route('/api/tests/<test_id>', methods=['PUT'])
+@api.route('/api/tests/<test_id>', methods=['PUT'])
 def update_test(test_id):
     # In a real app, check if user is the test creator
     return TeacherController.update_test(test_id)
 
-@app.route('/api/tests/<test_id>', methods=['DELETE'])
+@api.route('/api/tests/<test_id>/exam', methods=['PUT'])
+def schedule_exam(test_id):
+    # In a real app, check if user is the test creator
+    return TeacherController.schedule_exam(test_id)
+
+@api.route('/api/tests/<test_id>', methods=['DELETE'])
 def delete_test(test_id):
     # In a real app, check if user is the test creator
     return TeacherController.delete_test(test_id)
 
 # Student routes
-@app.route('/api/tests/available', methods=['GET'])
+@api.route('/api/tests/available', methods=['GET'])
 def get_available_tests():
     # In a real app, check if user is student first
     
@@ -114,7 +243,7 @@ def get_available_tests():
             
     return jsonify({"tests": tests}), 200
 
-@app.route('/api/tests/<test_id>/start', methods=['POST'])
+@api.route('/api/tests/<test_id>/start', methods=['POST'])
 def start_test(test_id):
     # In a real app, get student_id from authenticated user
     data = request.get_json()
@@ -124,24 +253,86 @@ def start_test(test_id):
         
     return StudentController.start_test(test_id, student_id)
 
-@app.route('/api/attempts/<attempt_id>/submit', methods=['POST'])
+@api.route('/api/attempts/<attempt_id>', methods=['GET'])
+def get_attempt(attempt_id):
+    # In a real app, check if user is the one who started the attempt
+    return StudentController.get_attempt(attempt_id)
+
+@api.route('/api/attempts/<attempt_id>/answers', methods=['PATCH'])
+def autosave_answers(attempt_id):
+    # In a real app, check if user is the one who started the attempt
+    return StudentController.autosave_answers(attempt_id)
+
+@api.route('/api/attempts/<attempt_id>/submit', methods=['POST'])
 def submit_test(attempt_id):
     # In a real app, check if user is the one who started the attempt
     return StudentController.submit_test(attempt_id)
 
-@app.route('/api/students/<student_id>/attempts', methods=['GET'])
+@api.route('/api/attempts/<attempt_id>/grade-pending', methods=['POST'])
+def grade_pending(attempt_id):
+    # Finish grading answers deferred when a submission ran out of time
+    return StudentController.grade_pending(attempt_id)
+
+@api.route('/api/students/<student_id>/attempts', methods=['GET'])
 def get_student_attempts(student_id):
     # In a real app, check if user is authorized
     return StudentController.get_attempts(student_id)
 
 # Add missing method to Test model
-@app.route('/api/tests/all', methods=['GET'])
+@api.route('/api/tests/all', methods=['GET'])
 def get_all_tests():
     """Get all tests (admin/teacher view)"""
     tests = Test.get_all_tests()
     return jsonify({"tests": tests}), 200
 
+def create_app():
+    """
+    Build the Flask application.
+
+    Nothing here opens a connection: MongoDB and the LLM client are created
+    lazily on first use in whichever process serves the request, which keeps
+    pre-fork servers such as gunicorn safe (see gunicorn.conf.py).
+    """
+    # Fail at boot, not on the first request, if the configuration is unusable
+    settings.validate()
+    tracing.configure_logging()
+    
+    app = Flask(__name__)
+    app.json = serialization.OrjsonProvider(app)
+    CORS(app)  # Enable CORS for all routes
+    
+    app.before_request(start_timer)
+    app.before_request(start_deadline)
+    app.before_request(start_background_threads)
+    app.after_request(record_request_metrics)
+    app.teardown_request(clear_deadline)
+    
+    app.register_blueprint(api)
+    
+    # Opt-in request profiling and the admin endpoints to fetch profiles
+    profiling.register(app)
+    
+    @app.cli.command('create-admin')
+    def create_admin_command():
+        """Create the default admin user if it does not exist."""
+        create_admin()
+    
+    @app.cli.command('sweep-attempts')
+    def sweep_attempts_command():
+        """Close attempts past their time limit, e.g. from cron."""
+        print(get_attempt_sweeper().sweep())
+    
+    @app.cli.command('archive-attempts')
+    def archive_attempts_command():
+        """Move old completed attempts to the archive collection."""
+        print(archive_attempts())
+    
+    return app
+
+# WSGI entry point: `gunicorn -c gunicorn.conf.py app:app`
+app = create_app()
+
 if __name__ == '__main__':
-    # Create admin user before starting the app
+    # Development server only; use gunicorn in production
     create_admin()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=True, host='0.0.0.0', port=settings.port)
@@ -0,0 +1,42 @@
+"""
+Hot/cold archival of completed attempts, run as a periodic job:
+`flask --app app archive-attempts` (e.g. nightly from cron).
+"""
+import metrics
+from models import TestAttempt
+from settings import settings
+from tracing import get_logger
+
+logger = get_logger('archiver')
+
+
+def archive_attempts(older_than_days=None, batch_size=None):
+    """
+    Archive every attempt completed more than `older_than_days` ago
+    (ARCHIVE_AFTER_DAYS by default)
+
+    Returns:
+        dict: Attempts archived and failed, and the compressed bytes written
+    """
+    older_than_days = settings.archive_after_days if older_than_days is None else older_than_days
+    batch_size = batch_size or settings.archive_batch_size
+    totals = {'archived': 0, 'failed': 0, 'bytes': 0}
+    while True:
+        attempts = TestAttempt.find_archivable(older_than_days, batch_size)
+        failed = 0
+        for attempt in attempts:
+            try:
+                size = TestAttempt.archive(attempt)
+            except Exception as e:
+                logger.warning("Archiving attempt %s failed: %s", attempt['_id'], e)
+                failed += 1
+                continue
+            if size:
+                totals['archived'] += 1
+                totals['bytes'] += size
+                metrics.ATTEMPTS_ARCHIVED.inc()
+        totals['failed'] += failed
+        # Attempts that failed are still unarchived; leave them to the next run
+        if len(attempts) < batch_size or failed:
+            logger.info("Archived attempts: %s", totals)
+            return totals
@@ -0,0 +1,198 @@
+"""
+ASGI entry point: `gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app`
+
+The LLM-bound endpoints are served by coroutines on one event loop per worker
+process, so an upstream wait costs a socket rather than a thread. Every other
+route (and CORS preflight) falls through to the unchanged Flask app, which
+runs in a small thread pool.
+"""
+import time
+import functools
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+import deadline
+import metrics
+import serialization
+import tracing
+from admission import AdmissionRejected, get_admission_controller
+from app import app as flask_app, ENDPOINT_DEADLINES
+from async_models import AsyncGenerationJob, AsyncTestAttempt, adb
+from controllers import TeacherController, StudentController
+from deadline import DeadlineExceeded
+from mistral_wrapper import AsyncMistralAPI, CircuitOpenError, close_async_client
+from models import AttemptOutdated
+from settings import settings
+
+logger = tracing.get_logger('asgi')
+
+_mistral_api = None
+
+
+def get_mistral_api():
+    global _mistral_api
+    if _mistral_api is None:
+        _mistral_api = AsyncMistralAPI(timeout=300, call_site='ask')  # 5 minute timeout for API requests
+    return _mistral_api
+
+
+class FlaskJSONResponse(JSONResponse):
+    """
+    JSON rendered by the same codec as the Flask app, so both paths serialize alike
+    """
+    def render(self, content):
+        return serialization.dumps(content)
+
+
+def json_response(content, status=200, headers=None):
+    # Same CORS policy as flask_cors on the sync routes
+    return FlaskJSONResponse(content, status, {"Access-Control-Allow-Origin": "*", **(headers or {})})
+
+
+def endpoint(rule, name):
+    """
+    Give an async route what the Flask request hooks give sync ones: a trace,
+    a deadline, HTTP metrics and the X-Request-ID header. `rule` and `name`
+    match the Flask route, so metrics and deadlines line up across both paths.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            started = time.perf_counter()
+            request_id = tracing.start_trace(
+                f"{request.method} {rule}",
+                request_id=request.headers.get('X-Request-ID'),
+                force_sample=request.headers.get('X-Trace') == '1'
+            )
+            deadline.set_deadline(deadline.budget(ENDPOINT_DEADLINES.get(name),
+                                                  request.headers.get('X-Request-Timeout')))
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                response.headers['X-Request-ID'] = request_id
+                metrics.HTTP_RESPONSE_BYTES.labels(request.method, rule).observe(len(response.body))
+                return response
+            finally:
+                metrics.HTTP_REQUEST_SECONDS.labels(request.method, rule, status).observe(time.perf_counter() - started)
+                deadline.clear_deadline()
+                tracing.finish_trace(status=status)
+        return wrapper
+    return decorator
+
+
+async def get_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+@endpoint('/api/ask', 'api.ask_mistral')
+async def ask_mistral(request):
+    data = await get_json(request)
+
+    if not data or 'prompt' not in data:
+        return json_response({"error": "Prompt is required"}, 400)
+
+    try:
+        response = await get_mistral_api().get_response(data['prompt'])
+        return json_response({"response": response})
+    except CircuitOpenError as e:
+        return json_response({"error": str(e)}, 503, {"Retry-After": str(int(e.retry_after) + 1)})
+    except DeadlineExceeded as e:
+        return json_response({"error": str(e)}, 504)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+@endpoint('/api/tests/generate', 'api.generate_ai_test')
+async def generate_ai_test(request):
+    # In a real app, check if user is an approved teacher first
+    data = await get_json(request)
+    if data is None:
+        return json_response({"error": "Request body must be JSON"}, 400)
+
+    params, error = TeacherController.generation_params(data)
+    if error:
+        return json_response({"error": error}, 400)
+
+    job = None
+    try:
+        async with get_admission_controller().async_slot(params['created_by']):
+            job = await AsyncGenerationJob.create(**params)
+            test = await AsyncGenerationJob.run(job)
+        return json_response({
+            "message": TeacherController.generation_message(test, params['num_questions'], job['from_bank']),
+            "test": test,
+            "job_id": job['_id']
+        }, 201)
+    except AdmissionRejected as e:
+        return json_response({"error": str(e)}, 429, {"Retry-After": str(int(e.retry_after) + 1)})
+    except CircuitOpenError as e:
+        return json_response(TeacherController.generation_error(e, job), 503, {"Retry-After": str(int(e.retry_after) + 1)})
+    except DeadlineExceeded as e:
+        return json_response(TeacherController.generation_error(e, job), 504)
+    except Exception as e:
+        return json_response(TeacherController.generation_error(e, job), 500)
+
+
+@endpoint('/api/attempts/<attempt_id>/submit', 'api.submit_test')
+async def submit_test(request):
+    # In a real app, check if user is the one who started the attempt
+    attempt_id = request.path_params['attempt_id']
+    data = await get_json(request)
+
+    if not data or 'answers' not in data:
+        return json_response({"error": "Answers are required"}, 400)
+
+    key = StudentController.idempotency_key(request.headers, data)
+
+    # Claim the attempt for grading, so only one submission grades it
+    attempt = await AsyncTestAttempt.claim_submission(attempt_id, key, settings.attempt_grace_seconds)
+    if not attempt:
+        attempt = await AsyncTestAttempt.get_by_id(attempt_id)
+        waited = bool(attempt) and attempt.get('status') == 'grading'
+        if waited:
+            attempt = await AsyncTestAttempt.wait_for_grading(attempt_id)
+        body, status = StudentController.duplicate_submission(attempt, key, waited)
+        return json_response(body, status)
+
+    try:
+        updated_attempt = await AsyncTestAttempt.submit_with_evaluation(attempt_id, data['answers'], attempt)
+        return json_response({
+            "message": StudentController.submission_message(updated_attempt),
+            "attempt": updated_attempt
+        })
+    except AttemptOutdated as e:
+        await AsyncTestAttempt.release_submission(attempt_id, attempt['submission_token'])
+        return json_response({"error": str(e)}, 409)
+    except Exception as e:
+        await AsyncTestAttempt.release_submission(attempt_id, attempt['submission_token'])
+        return json_response({"error": f"Error submitting test: {str(e)}"}, 500)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await close_async_client()
+    adb.close()
+
+
+def create_asgi_app():
+    """
+    Async routes first; anything they don't fully match (other paths, or
+    OPTIONS preflight on these paths) is handled by the Flask app
+    """
+    routes = [
+        Route('/api/ask', ask_mistral, methods=['POST']),
+        Route('/api/tests/generate', generate_ai_test, methods=['POST']),
+        Route('/api/attempts/{attempt_id}/submit', submit_test, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app, workers=settings.asgi_wsgi_threads)),
+    ]
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+app = create_asgi_app()
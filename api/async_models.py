@@ -0,0 +1,377 @@
+"""
+Asyncio versions of the model operations behind the LLM-bound endpoints.
+
+Prompts, parsing, scoring and the shape of every read and write live in
+models.py and are called from here; these classes only do the I/O, awaiting
+Motor and the LLM so thousands of calls can be in flight on one event loop.
+"""
+import os
+import asyncio
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+import deadline
+from database import AsyncDatabase
+from deadline import DeadlineExceeded
+from mistral_wrapper import AsyncMistralAPI, CircuitOpenError
+from models import GenerationJob, QuestionBank, Test, TestAttempt
+from settings import settings
+from tracing import get_logger, trace_class
+
+logger = get_logger('async_models')
+
+# Motor client, connected lazily on first use in each worker process
+adb = AsyncDatabase()
+
+
+@trace_class
+class AsyncTest:
+    @staticmethod
+    async def create(title, description, created_by, questions, time_limit=60, generation_status=None):
+        """
+        Create a new test
+        """
+        test = Test.new_document(title, description, created_by, questions, time_limit, generation_status)
+        result = await adb.insert_one('tests', test)
+        test['_id'] = str(result.inserted_id)
+        return test
+
+    @staticmethod
+    async def get_by_id(test_id):
+        """
+        Get test by ID
+        """
+        try:
+            return Test.from_document(await adb.find_one('tests', {'_id': ObjectId(test_id)}))
+        except Exception:
+            return None
+
+    @staticmethod
+    async def update(test_id, update_data):
+        """
+        Update test information
+        """
+        update_data = Test.updatable(update_data)
+        await adb.update_one('tests', {'_id': ObjectId(test_id)}, Test.versioned({'$set': update_data}))
+        return await AsyncTest.get_by_id(test_id)
+
+    @staticmethod
+    async def generate_ai_test(title, description, num_questions, question_types, subject_area=None, created_by=None, time_limit=60, job=None,
+                               use_question_bank=True):
+        """
+        Async version of Test.generate_ai_test
+        """
+        if job is None:
+            job = await AsyncGenerationJob.create(title, description, num_questions, question_types, subject_area, created_by, time_limit,
+                                                  use_question_bank)
+
+        if Test.generates_staged(question_types):
+            logger.debug("Using staged approach for %s paragraph questions", num_questions)
+            return await AsyncTest._generate_paragraph_questions_staged(
+                title, description, num_questions, subject_area, created_by, time_limit, job
+            )
+
+        counts = Test.missing_counts(num_questions, question_types, job['questions'])
+        remaining = sum(counts.values())
+        if remaining <= 0:
+            return await AsyncGenerationJob.complete(job, job['questions'])
+
+        mistral = AsyncMistralAPI(debug=True, timeout=Test.generation_timeout(question_types), call_site='generation')
+        prompt, instructions = Test.generation_prompt(title, description, counts, subject_area)
+
+        try:
+            response = await mistral.get_response(prompt, instructions)
+            generated = Test.generated_questions(response, question_types, remaining)
+
+            await AsyncGenerationJob.checkpoint(job['_id'], generated)
+            await AsyncGenerationJob.bank(job, generated)
+            return await AsyncGenerationJob.complete(job, job['questions'] + generated)
+
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            await AsyncGenerationJob.fail(job['_id'], e)
+            raise
+        except Exception as e:
+            await AsyncGenerationJob.fail(job['_id'], e)
+            raise Test.generation_failure(e)
+
+    @staticmethod
+    async def _generate_paragraph_questions_staged(title, description, num_questions, subject_area, created_by, time_limit, job):
+        """
+        Generate paragraph questions one by one to avoid timeouts, checkpointing
+        each into the job and starting after the ones it already holds
+        """
+        questions = Test.staged_start(job, num_questions)
+        mistral = AsyncMistralAPI(debug=True, timeout=120, call_site='generation_staged')
+
+        partial = False
+        for i in range(len(questions), num_questions):
+            # Stop once the request is out of time and keep what we have so far
+            if deadline.expired():
+                partial = True
+                break
+
+            logger.debug("Generating paragraph question %s/%s", i+1, num_questions)
+
+            prompt, instructions = Test.staged_question_prompt(i, title, description, num_questions, subject_area)
+
+            try:
+                response = await mistral.get_response(prompt, instructions)
+            except CircuitOpenError as e:
+                # Don't pad the test with placeholder questions while the LLM is down
+                await AsyncGenerationJob.fail(job['_id'], e)
+                raise
+            except DeadlineExceeded:
+                partial = True
+                break
+            except Exception as e:
+                response = e
+            question, placeholder = Test.staged_question(response, i, title)
+
+            questions.append(question)
+            await AsyncGenerationJob.checkpoint(job['_id'], [question])
+            if not placeholder:
+                await AsyncGenerationJob.bank(job, [question])
+
+            # Brief pause between questions
+            await asyncio.sleep(1)
+
+        error = Test.staged_deadline_error(questions, num_questions) if partial else None
+        if error:
+            await AsyncGenerationJob.fail(job['_id'], error)
+            raise error
+
+        return await AsyncGenerationJob.complete(job, questions, partial)
+
+
+@trace_class
+class AsyncGenerationJob:
+    """
+    Async version of GenerationJob, for the generations asgi.py starts
+    """
+    @staticmethod
+    async def create(title, description, num_questions, question_types, subject_area=None, created_by=None, time_limit=60,
+                     use_question_bank=True):
+        bank_questions = []
+        if use_question_bank and settings.question_bank_enabled:
+            bank_questions = await AsyncQuestionBank.draw(subject_area, title, Test.type_counts(num_questions, question_types),
+                                                          created_by)
+        job = GenerationJob.new_document(title, description, num_questions, question_types, subject_area, created_by, time_limit,
+                                         bank_questions)
+        result = await adb.insert_one('generation_jobs', job)
+        job['_id'] = str(result.inserted_id)
+        return job
+
+    @staticmethod
+    async def checkpoint(job_id, questions):
+        await adb.update_one('generation_jobs', {'_id': ObjectId(job_id)}, GenerationJob.checkpoint_update(questions))
+
+    @staticmethod
+    async def fail(job_id, error):
+        await adb.update_one('generation_jobs', {'_id': ObjectId(job_id)}, GenerationJob.fail_update(error))
+
+    @staticmethod
+    async def complete(job, questions, partial=False):
+        test = None
+        if job.get('test_id'):
+            test = await AsyncTest.update(job['test_id'], GenerationJob.test_update(questions, partial))
+        if test is None:
+            test = await AsyncTest.create(**GenerationJob.new_test(job, questions, partial))
+        await adb.update_one('generation_jobs', {'_id': ObjectId(job['_id'])}, GenerationJob.finish_update(test['_id'], partial))
+        try:
+            await AsyncQuestionBank.mark_used(questions, job['created_by'])
+        except Exception as e:
+            logger.warning("Could not mark bank questions as used: %s", e)
+        return test
+
+    @staticmethod
+    async def bank(job, questions):
+        try:
+            await AsyncQuestionBank.add(*GenerationJob.bank_args(job, questions))
+        except Exception as e:
+            logger.warning("Could not add generated questions to the question bank: %s", e)
+
+    @staticmethod
+    async def run(job):
+        return await AsyncTest.generate_ai_test(**GenerationJob.run_args(job))
+
+
+@trace_class
+class AsyncQuestionBank:
+    """
+    Async version of QuestionBank; matching and deduplication rules are shared
+    """
+    _indexed_pid = None
+
+    @staticmethod
+    async def ensure_indexes():
+        if AsyncQuestionBank._indexed_pid == os.getpid():
+            return
+        for keys, options in QuestionBank.INDEXES:
+            await adb.create_index(QuestionBank.COLLECTION, keys, **options)
+        AsyncQuestionBank._indexed_pid = os.getpid()
+
+    @staticmethod
+    async def add(questions, subject_area, title, created_by, source):
+        await AsyncQuestionBank.ensure_indexes()
+        added = 0
+        for query, update in QuestionBank.upserts(questions, subject_area, title, created_by, source):
+            try:
+                result = await adb.update_one(QuestionBank.COLLECTION, query, update, upsert=True)
+            except DuplicateKeyError:
+                continue
+            if result.upserted_id is not None:
+                added += 1
+        return added
+
+    @staticmethod
+    async def draw(subject_area, title, counts, teacher_id=None):
+        query = QuestionBank.match_query(subject_area, title, [t for t, n in counts.items() if n > 0], teacher_id)
+        if query is None or not sum(counts.values()):
+            return []
+        await AsyncQuestionBank.ensure_indexes()
+        candidates = await adb.find(QuestionBank.COLLECTION, query, QuestionBank.CANDIDATE_FIELDS,
+                                    limit=settings.question_bank_candidates)
+        return QuestionBank.pick(candidates, title, counts)
+
+    @staticmethod
+    async def mark_used(questions, teacher_id):
+        if not teacher_id or not questions:
+            return
+        query, update = QuestionBank.used_update(questions, teacher_id)
+        await adb.update_many(QuestionBank.COLLECTION, query, update)
+
+
+@trace_class
+class AsyncTestAttempt:
+    @staticmethod
+    async def get_by_id(attempt_id):
+        """
+        Get attempt by ID
+        """
+        try:
+            attempt = await adb.find_one('test_attempts', {'_id': ObjectId(attempt_id)})
+            if attempt:
+                if attempt.get('archived'):
+                    archived = await adb.find_one(TestAttempt.ARCHIVE_COLLECTION, {'_id': attempt['_id']})
+                    TestAttempt.rehydrate(attempt, archived)
+                attempt['_id'] = str(attempt['_id'])
+            return attempt
+        except Exception:
+            return None
+
+    @staticmethod
+    async def update(attempt_id, update_data):
+        """
+        Update attempt information
+        """
+        await adb.update_one('test_attempts', {'_id': ObjectId(attempt_id)}, {'$set': TestAttempt.stamped(update_data)})
+        return await AsyncTestAttempt.get_by_id(attempt_id)
+
+    @staticmethod
+    async def claim_submission(attempt_id, idempotency_key=None, grace_seconds=None):
+        """
+        Async version of TestAttempt.claim_submission
+        """
+        now = datetime.utcnow()
+        try:
+            query = TestAttempt.claim_query(attempt_id, now, grace_seconds)
+        except Exception:
+            return None
+        attempt = await adb.find_one_and_update('test_attempts', query, TestAttempt.claim_update(now, idempotency_key))
+        if attempt:
+            attempt['_id'] = str(attempt['_id'])
+        return attempt
+
+    @staticmethod
+    async def release_submission(attempt_id, token):
+        """
+        Async version of TestAttempt.release_submission
+        """
+        await adb.update_one('test_attempts', {'_id': ObjectId(attempt_id), 'submission_token': token},
+                             TestAttempt.release_update())
+
+    @staticmethod
+    async def wait_for_grading(attempt_id, poll_seconds=0.5, max_wait_seconds=30):
+        """
+        Async version of TestAttempt.wait_for_grading
+        """
+        give_up = TestAttempt.wait_until(max_wait_seconds)
+        while True:
+            attempt = await AsyncTestAttempt.get_by_id(attempt_id)
+            if TestAttempt.done_waiting(attempt, give_up, poll_seconds):
+                return attempt
+            await asyncio.sleep(poll_seconds)
+
+    @staticmethod
+    async def finish_submission(attempt_id, update_data, token=None):
+        """
+        Async version of TestAttempt.finish_submission
+        """
+        result = await adb.update_one('test_attempts', TestAttempt.finish_query(attempt_id, token), {'$set': update_data})
+        TestAttempt.check_finished(result, attempt_id)
+        return await AsyncTestAttempt.get_by_id(attempt_id)
+
+    @staticmethod
+    async def evaluate_paragraph_answer(student_answer, question, priority='grading'):
+        """
+        Async version of TestAttempt.evaluate_paragraph_answer
+        """
+        if TestAttempt.is_blank(student_answer):
+            return dict(TestAttempt.BLANK_EVALUATION)
+
+        prompt, instructions = TestAttempt.grading_prompt(student_answer, question)
+
+        try:
+            mistral = AsyncMistralAPI(call_site='grading', priority=priority)
+            response = await mistral.get_response(prompt, instructions)
+            return TestAttempt.parse_evaluation(response, question)
+
+        except DeadlineExceeded:
+            raise
+        except CircuitOpenError as e:
+            return TestAttempt.unavailable_evaluation(student_answer, question, e)
+        except Exception as e:
+            return TestAttempt.failed_evaluation(e)
+
+    @staticmethod
+    async def _evaluate_or_defer(answer, question):
+        """
+        Grade one paragraph answer, or None if the request ran out of time first
+        """
+        try:
+            deadline.check()
+            return await AsyncTestAttempt.evaluate_paragraph_answer(answer, question)
+        except DeadlineExceeded:
+            return None
+
+    @staticmethod
+    async def submit_with_evaluation(attempt_id, answers, attempt=None):
+        """
+        Async version of TestAttempt.submit_with_evaluation. Paragraph answers
+        are graded concurrently rather than one after another.
+
+        Args:
+            attempt_id (str): The test attempt ID
+            answers (list): List of student answers
+            attempt (dict): The attempt as returned by claim_submission; read if omitted
+
+        Returns:
+            dict: Updated attempt with scores and feedback
+        """
+        token = attempt and attempt.get('submission_token')  # Only a claimed submission holds one
+        if attempt is None:
+            attempt = await AsyncTestAttempt.get_by_id(attempt_id)
+        if not attempt:
+            raise Exception("Test attempt not found")
+
+        test = await AsyncTest.get_by_id(attempt['test_id'])
+        TestAttempt.check_test_version(attempt, test)
+
+        questions = test['questions']
+        answers = TestAttempt.unshuffled_answers(answers, questions, attempt.get('shuffle_seed'))
+        evaluations, to_grade = TestAttempt.grading_plan(attempt, answers, questions)
+        graded = await asyncio.gather(*(AsyncTestAttempt._evaluate_or_defer(answer, question)
+                                        for _, _, answer, question in to_grade))
+        update_data = TestAttempt.graded_update(answers, questions, evaluations, to_grade, graded)
+
+        return await AsyncTestAttempt.finish_submission(attempt_id, update_data, token)
@@ -0,0 +1,65 @@
+import threading
+from bson import ObjectId
+import metrics
+
+
+class _Batch:
+    def __init__(self):
+        self.documents = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+
+
+class InsertBatcher:
+    """
+    Coalesces inserts that arrive within `window_seconds` of each other into
+    one `insert_many`.
+
+    The first caller of a batch leads it: it waits out the window (or until
+    `max_batch` documents have joined), writes the batch and wakes the
+    others. Every document gets its `_id` up front, so each caller gets its
+    own id back once the shared write is acknowledged. If the write fails,
+    every caller in the batch gets the error.
+    """
+    def __init__(self, write, window_seconds=0.005, max_batch=200):
+        self.write = write   # write(documents), e.g. a Database.insert_many call
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def insert(self, document):
+        """
+        Insert `document` as part of the current batch; returns its _id
+        """
+        document.setdefault('_id', ObjectId())
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            batch.documents.append(document)
+            if len(batch.documents) >= self.max_batch:
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window_seconds)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            metrics.INSERT_BATCH_SIZE.observe(len(batch.documents))
+            try:
+                self.write(batch.documents)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return document['_id']
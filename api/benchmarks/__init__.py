@@ -0,0 +1,6 @@
+"""
+Benchmark and load-testing tools for the AI Evaluator API.
+
+Everything in this package runs against local stand-ins (an in-memory
+MongoDB and a stubbed Mistral LLM), so no external services are needed.
+"""
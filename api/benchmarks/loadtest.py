@@ -0,0 +1,350 @@
+"""
+End-to-end load test: how many concurrent students can one worker handle?
+
+Drives the real Flask app through its HTTP routes with the phases of an
+exam: students register, log in at once, list the available tests, start
+the exam and submit within seconds of each other. MongoDB is replaced by an
+in-memory database and the LLM by a local HTTP server with configurable
+latency, so the numbers cover the application (routing, models, grading
+scheduler, JSON) rather than the backing services. Use --url to run the same
+scenario against a deployed server instead.
+
+Reports throughput, p50/p95/p99 latency and error rate per route, writes them
+as JSON and compares against a saved baseline.
+
+Usage (from the api/ directory):
+
+    python -m benchmarks.loadtest                              # 200 students, 32 at a time
+    python -m benchmarks.loadtest --students 500 --concurrency 64 --paragraph 3
+    python -m benchmarks.loadtest --llm-latency-ms 2000 --surge
+    python -m benchmarks.loadtest --save-baseline              # record a baseline
+    python -m benchmarks.loadtest --url http://localhost:5000  # against a running server
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from benchmarks import stubs
+from benchmarks.micro import write_json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(HERE, "results", "loadtest-latest.json")
+DEFAULT_BASELINE = os.path.join(HERE, "loadtest-baseline.json")
+
+# A route regressed if its p95 grew by more than this, or its error rate by more than a point
+REGRESSION_THRESHOLD = 0.10
+ERROR_RATE_THRESHOLD = 0.01
+
+
+class InProcessClient:
+    """
+    Requests through the Flask app in this process, one test client per thread
+    """
+    def __init__(self):
+        from app import app
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """
+    Requests to a running server, one connection pool per thread
+    """
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        import requests
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.request(method, self.url + path, json=body, timeout=600)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+class Recorder:
+    """
+    Latency samples and status codes per route, and wall time per phase
+    """
+    def __init__(self):
+        self.samples = {}   # route -> list of (seconds, ok)
+        self.phases = {}    # phase -> (requests, seconds)
+        self._lock = threading.Lock()
+
+    def call(self, client, route, method, path, body=None, expect=(200, 201)):
+        started = time.perf_counter()
+        try:
+            status, data = client.request(method, path, body)
+        except Exception:
+            status, data = None, None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples.setdefault(route, []).append((elapsed, status in expect))
+        return status, data
+
+    def phase(self, name, tasks, concurrency):
+        """
+        Run the zero-argument `tasks` `concurrency` at a time, timing the whole phase
+        """
+        print(f"  {name}: {len(tasks)} requests...", flush=True)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda task: task(), tasks))
+        self.phases[name] = (len(tasks), time.perf_counter() - started)
+        return results
+
+    def report(self):
+        routes = {}
+        for route, samples in self.samples.items():
+            latencies = sorted(seconds * 1000 for seconds, _ in samples)
+            errors = sum(1 for _, ok in samples if not ok)
+            routes[route] = {
+                "requests": len(samples),
+                "error_rate": round(errors / len(samples), 4),
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+                "max_ms": round(latencies[-1], 2),
+            }
+        phases = {name: {"requests": count, "seconds": round(seconds, 3),
+                         "throughput_rps": round(count / seconds, 1) if seconds else 0.0}
+                  for name, (count, seconds) in self.phases.items()}
+        return {"routes": routes, "phases": phases}
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def answer_for(question, rng):
+    if question.get("type", "mcq") == "mcq":
+        return rng.randrange(len(question.get("options") or [0]))
+    return stubs.lorem(rng.randint(150, 400), rng)
+
+
+def run_scenario(client, args):
+    """
+    One exam, phase by phase; returns the recorder with everything measured
+    """
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    run_id = f"{int(time.time())}{rng.randrange(10000)}"
+    students = [f"lt{run_id}_{i}" for i in range(args.students)]
+
+    # Setup requests aren't measured
+    status, data = client.request("POST", "/api/tests", {
+        "title": "Load test exam",
+        "description": "Created by benchmarks.loadtest",
+        "created_by": f"lt{run_id}_teacher",
+        "questions": stubs.make_questions(args.mcq, args.paragraph, rng),
+        "time_limit": 60,
+    })
+    if status != 201:
+        raise SystemExit(f"Could not create the exam (status {status}): {data}")
+    test_id = data["test"]["_id"]
+
+    if args.surge:
+        starts_at = (datetime.utcnow() + timedelta(seconds=30)).isoformat()
+        client.request("PUT", f"/api/tests/{test_id}/exam", {"starts_at": starts_at})
+        if isinstance(client, InProcessClient):
+            from surge import get_surge_cache
+            get_surge_cache().refresh()
+        else:
+            print("  (--surge: waiting for the server's surge cache to refresh)")
+            time.sleep(args.surge_wait)
+
+    recorder.phase("register", [
+        lambda username=username: recorder.call(client, "POST /api/auth/register", "POST", "/api/auth/register", {
+            "username": username, "email": f"{username}@example.com", "password": "load-test", "role": "student",
+        }) for username in students
+    ], args.concurrency)
+
+    logins = recorder.phase("login", [
+        lambda username=username: recorder.call(client, "POST /api/auth/login", "POST", "/api/auth/login", {
+            "username": username, "password": "load-test",
+        }) for username in students
+    ], args.concurrency)
+    student_ids = [data["user"]["_id"] for status, data in logins if status == 200 and data]
+
+    recorder.phase("available", [
+        lambda: recorder.call(client, "GET /api/tests/available", "GET", "/api/tests/available")
+        for _ in student_ids
+    ], args.concurrency)
+
+    starts = recorder.phase("start", [
+        lambda student_id=student_id: recorder.call(client, "POST /api/tests/<id>/start", "POST",
+                                                    f"/api/tests/{test_id}/start", {"student_id": student_id})
+        for student_id in student_ids
+    ], args.concurrency)
+
+    submissions = []
+    for status, data in starts:
+        if status == 201 and data:
+            answers = [answer_for(question, rng) for question in data["test"]["questions"]]
+            submissions.append((data["attempt"]["_id"], answers))
+
+    recorder.phase("submit", [
+        lambda attempt_id=attempt_id, answers=answers: recorder.call(
+            client, "POST /api/attempts/<id>/submit", "POST", f"/api/attempts/{attempt_id}/submit",
+            {"answers": answers, "idempotency_key": attempt_id})
+        for attempt_id, answers in submissions
+    ], args.concurrency)
+
+    return recorder
+
+
+def print_report(results):
+    meta = results["meta"]
+    if meta.get("llm_calls"):
+        print(f"\nLLM calls: {meta['llm_calls']}, mean prompt ~{meta['llm_mean_prompt_tokens']} tokens")
+    print(f"\n{'route':<34}{'requests':>9}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, stats in results["routes"].items():
+        print(f"{route:<34}{stats['requests']:>9}{stats['error_rate']:>9.1%}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    print(f"\n{'phase':<34}{'requests':>9}{'seconds':>10}{'req/s':>10}")
+    for phase, stats in results["phases"].items():
+        print(f"{phase:<34}{stats['requests']:>9}{stats['seconds']:>10.2f}{stats['throughput_rps']:>10.1f}")
+
+
+def compare(results, baseline):
+    """
+    Print p95 and throughput against the baseline and return the names of regressed routes
+    """
+    regressions = []
+    print(f"\n{'route':<34}{'base p95':>10}{'p95':>10}{'change':>9}{'base err':>10}{'err':>8}")
+    for route, stats in results["routes"].items():
+        base = baseline.get("routes", {}).get(route)
+        if not base:
+            print(f"{route:<34}{'-':>10}{stats['p95_ms']:>10.1f}{'new':>9}")
+            continue
+        change = (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        flag = ""
+        if change > REGRESSION_THRESHOLD or stats["error_rate"] - base["error_rate"] > ERROR_RATE_THRESHOLD:
+            flag = "  <-- worse"
+            regressions.append(route)
+        print(f"{route:<34}{base['p95_ms']:>10.1f}{stats['p95_ms']:>10.1f}{change:>+9.1%}"
+              f"{base['error_rate']:>10.1%}{stats['error_rate']:>8.1%}{flag}")
+    print(f"\n{'phase':<34}{'base req/s':>12}{'req/s':>10}")
+    for phase, stats in results["phases"].items():
+        base = baseline.get("phases", {}).get(phase, {}).get("throughput_rps")
+        print(f"{phase:<34}{base if base is not None else '-':>12}{stats['throughput_rps']:>10.1f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an end-to-end exam load test")
+    parser.add_argument("--students", type=int, default=200, help="students sitting the exam")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight at once")
+    parser.add_argument("--mcq", type=int, default=10, help="multiple choice questions in the exam")
+    parser.add_argument("--paragraph", type=int, default=2, help="paragraph questions in the exam")
+    parser.add_argument("--llm-latency-ms", type=float, default=500, help="stand-in LLM response time")
+    parser.add_argument("--llm-jitter-ms", type=float, default=100, help="random variation of the LLM response time")
+    parser.add_argument("--llm-ms-per-1k-tokens", type=float, default=0,
+                        help="extra stand-in LLM response time per 1000 prompt tokens")
+    parser.add_argument("--llm-stall-rate", type=float, default=0,
+                        help="fraction of stand-in LLM calls that stall, for a latency tail")
+    parser.add_argument("--llm-stall-ms", type=float, default=0, help="how long a stalled call takes extra")
+    parser.add_argument("--llm-endpoints", type=int, default=1, help="stand-in LLM backends to spread calls over")
+    parser.add_argument("--llm-capacity", type=int, default=0,
+                        help="prompts each stand-in works on at once (0: no limit)")
+    parser.add_argument("--hedge-percentile", type=float, default=0,
+                        help="hedge LLM calls slower than this latency percentile (0: off)")
+    parser.add_argument("--surge", action="store_true", help="schedule the exam first, so starts use surge mode")
+    parser.add_argument("--surge-wait", type=float, default=35, help="with --url, seconds to wait for the surge cache")
+    parser.add_argument("--url", help="load a running server instead of the app in this process")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="where to write the results JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="also store these results as the baseline")
+    args = parser.parse_args(argv)
+
+    print(f"Load test: {args.students} students, {args.concurrency} concurrent, "
+          f"{args.mcq} MCQ + {args.paragraph} paragraph questions", flush=True)
+    with contextlib.ExitStack() as stack:
+        if args.url:
+            client = HttpClient(args.url)
+        else:
+            from settings import settings
+            servers = [stack.enter_context(stubs.llm_server(latency_ms=args.llm_latency_ms,
+                                                            jitter_ms=args.llm_jitter_ms, seed=args.seed + i,
+                                                            ms_per_1k_tokens=args.llm_ms_per_1k_tokens,
+                                                            capacity=args.llm_capacity or None,
+                                                            stall_rate=args.llm_stall_rate,
+                                                            stall_ms=args.llm_stall_ms))
+                       for i in range(args.llm_endpoints)]
+            settings.mistral_api_url = ",".join(server.url for server in servers)
+            settings.mistral_hedge_percentile = args.hedge_percentile
+            stack.enter_context(stubs.in_memory_db())
+            client = InProcessClient()
+            # Slow-request traces would drown the report
+            logging.getLogger('ai_evaluator').setLevel(logging.WARNING)
+        recorder = run_scenario(client, args)
+        llm_calls = None if args.url else sum(server.calls for server in servers)
+        llm_prompt_tokens = None if args.url else sum(server.prompt_tokens for server in servers)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.url or "in-process",
+            "students": args.students,
+            "concurrency": args.concurrency,
+            "mcq": args.mcq,
+            "paragraph": args.paragraph,
+            "llm_latency_ms": None if args.url else args.llm_latency_ms,
+            "llm_endpoints": None if args.url else args.llm_endpoints,
+            "llm_capacity": None if args.url else args.llm_capacity,
+            "hedge_percentile": None if args.url else args.hedge_percentile,
+            "surge": args.surge,
+            "llm_calls": llm_calls,
+            "llm_mean_prompt_tokens": round(llm_prompt_tokens / llm_calls) if llm_calls else None,
+        },
+        **recorder.report(),
+    }
+    print_report(results)
+
+    write_json(args.output, results)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        write_json(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    return 1 if compare(results, baseline) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+Micro-benchmarks for the model and controller hot paths.
+
+Runs entirely against an in-memory MongoDB and a stubbed LLM. Results are
+written as JSON and compared against a saved baseline so the numbers before
+and after a performance change can be put side by side.
+
+Usage (from the api/ directory):
+
+    python -m benchmarks.micro                    # run and compare to baseline
+    python -m benchmarks.micro --save-baseline    # record a new baseline
+    python -m benchmarks.micro --only submit      # run matching cases only
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+from benchmarks import stubs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(HERE, "results", "latest.json")
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+
+# Cases are compared on their fastest sample, which is the least sensitive to
+# noise from other processes; a case regressed if it moved by more than this
+COMPARE_ON = "min_ms"
+REGRESSION_THRESHOLD = 0.10
+
+
+class Case:
+    def __init__(self, name, setup, repeat=20, warmup=2):
+        """
+        `setup` prepares the data and returns the zero-argument callable to time
+        """
+        self.name = name
+        self.setup = setup
+        self.repeat = repeat
+        self.warmup = warmup
+
+
+def _seed_tests(db, count, num_mcq=10, num_paragraph=0):
+    rng = random.Random(count)
+    docs = [stubs.make_test_document(num_mcq, num_paragraph, rng) for _ in range(count)]
+    db.insert_many('tests', docs)
+
+
+def setup_get_all_tests(count):
+    def setup(db):
+        from models import Test
+        _seed_tests(db, count)
+        return Test.get_all_tests
+    return setup
+
+
+def setup_submit(num_mcq, num_paragraph):
+    def setup(db):
+        from models import Test, TestAttempt
+        rng = random.Random(42)
+        test = Test.create(
+            title="Benchmark test",
+            description="",
+            created_by="teacher",
+            questions=stubs.make_questions(num_mcq, num_paragraph, rng),
+        )
+        attempt = TestAttempt.create(test['_id'], "student")
+        # Answer in the order this attempt is served the questions
+        served = TestAttempt.shuffled_questions(test['questions'], attempt['shuffle_seed'])
+        answers = [rng.randrange(4) if question['type'] == 'mcq' else stubs.lorem(400, rng) for question in served]
+        return lambda: TestAttempt.submit_with_evaluation(attempt['_id'], answers)
+    return setup
+
+
+def setup_login(db):
+    from app import app
+    from controllers import AuthController
+    from models import User
+    User.create("bench_student", "bench@example.com", "correct horse", "student")
+
+    def run():
+        with app.test_request_context(
+            "/api/auth/login", method="POST",
+            json={"username": "bench_student", "password": "correct horse"},
+        ):
+            return AuthController.login()
+    return run
+
+
+def setup_grading_extraction(db):
+    from models import TestAttempt
+    rng = random.Random(7)
+    question = stubs.make_paragraph_question(rng)
+    answer = stubs.lorem(400, rng)
+    return lambda: TestAttempt.evaluate_paragraph_answer(answer, question)
+
+
+def setup_generation_extraction(db):
+    from models import Test
+    return lambda: Test.generate_ai_test(
+        title="Photosynthesis",
+        description="",
+        num_questions=50,
+        question_types=['mcq', 'paragraph'],
+        created_by="teacher",
+        use_question_bank=False,  # every iteration must parse an LLM reply
+    )
+
+
+def setup_jsonify(num_tests, num_paragraph):
+    def setup(db):
+        from flask import jsonify
+        from app import app
+        rng = random.Random(num_tests)
+        tests = [stubs.make_test_document(10, num_paragraph, rng, answer_words=500) for _ in range(num_tests)]
+        # As read from MongoDB: ObjectId and datetime values are left to the JSON provider
+        for test in tests:
+            test.update(_id=ObjectId(), created_at=datetime.utcnow())
+
+        def run():
+            with app.app_context():
+                return jsonify({"tests": tests})
+        return run
+    return setup
+
+
+def setup_jsonify_attempts(num_attempts, num_paragraph):
+    def setup(db):
+        from flask import jsonify
+        from app import app
+        rng = random.Random(num_attempts)
+        attempts = [stubs.make_attempt_document(10, num_paragraph, rng) for _ in range(num_attempts)]
+
+        def run():
+            with app.app_context():
+                return jsonify({"attempts": attempts})
+        return run
+    return setup
+
+
+def setup_cold_import(db):
+    # A fresh interpreter importing the WSGI module, i.e. a worker's cold start
+    command = [sys.executable, "-c", "import app"]
+    api_dir = os.path.dirname(HERE)
+    return lambda: subprocess.run(command, cwd=api_dir, check=True, capture_output=True)
+
+
+def setup_create_app(db):
+    from app import create_app
+    return create_app
+
+
+# Stubbed LLM replies for the cases that need one
+LLM_REPLIES = {
+    "json_extract_grading_large": stubs.grading_response(padding_words=5000, rng=random.Random(7)),
+    "json_extract_generation_50q": stubs.generation_response(50, random.Random(11)),
+}
+DEFAULT_GRADING_REPLY = stubs.grading_response(rng=random.Random(3))
+
+CASES = [
+    Case("get_all_tests_1k", setup_get_all_tests(1000), repeat=10),
+    Case("get_all_tests_10k", setup_get_all_tests(10000), repeat=3, warmup=1),
+    Case("submit_mcq_only_50q", setup_submit(50, 0)),
+    Case("submit_mixed_10mcq_5para", setup_submit(10, 5)),
+    Case("auth_login", setup_login, repeat=10),
+    Case("json_extract_grading_large", setup_grading_extraction, repeat=50),
+    Case("json_extract_generation_50q", setup_generation_extraction, repeat=10),
+    Case("jsonify_test_50_paragraph", setup_jsonify(1, 50), repeat=50),
+    Case("jsonify_tests_200", setup_jsonify(200, 5), repeat=10),
+    Case("jsonify_attempt_50_paragraph", setup_jsonify_attempts(1, 50), repeat=50),
+    Case("jsonify_attempts_200", setup_jsonify_attempts(200, 5), repeat=10),
+    Case("startup_cold_import_app", setup_cold_import, repeat=5, warmup=1),
+    Case("startup_create_app", setup_create_app, repeat=20),
+]
+
+
+def run_case(case):
+    reply = LLM_REPLIES.get(case.name, DEFAULT_GRADING_REPLY)
+    with stubs.in_memory_db() as db, stubs.stub_llm(lambda prompt, instructions=None: reply):
+        fn = case.setup(db)
+        # The models print progress; keep it out of the report but still pay for it
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(case.warmup):
+                fn()
+            # Like timeit, keep the collector from landing in random samples
+            gc.collect()
+            gc.disable()
+            try:
+                samples = []
+                for _ in range(case.repeat):
+                    start = time.perf_counter()
+                    fn()
+                    samples.append((time.perf_counter() - start) * 1000)
+            finally:
+                gc.enable()
+
+    samples.sort()
+    return {
+        "repeat": case.repeat,
+        "min_ms": round(samples[0], 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def compare(results, baseline):
+    """
+    Print a side-by-side comparison and return the names of regressed cases
+    """
+    regressions = []
+    print(f"\n{'case':<32}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name, result in results["cases"].items():
+        current = result[COMPARE_ON]
+        base = baseline.get("cases", {}).get(name)
+        if not base:
+            print(f"{name:<32}{'-':>14}{current:>14.3f}{'new':>10}")
+            continue
+        change = (current - base[COMPARE_ON]) / base[COMPARE_ON] if base[COMPARE_ON] else 0.0
+        flag = ""
+        if change > REGRESSION_THRESHOLD:
+            flag = "  <-- slower"
+            regressions.append(name)
+        print(f"{name:<32}{base[COMPARE_ON]:>14.3f}{current:>14.3f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the API micro-benchmarks")
+    parser.add_argument("--only", help="run only cases whose name contains this string")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="where to write the results JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="also store these results as the baseline")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in CASES if not args.only or args.only in case.name]
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "cases": {},
+    }
+    for case in cases:
+        print(f"Running {case.name}...", flush=True)
+        results["cases"][case.name] = run_case(case)
+
+    write_json(args.output, results)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        write_json(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        print("No baseline found; run with --save-baseline to record one.")
+    regressions = compare(results, baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
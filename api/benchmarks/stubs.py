@@ -0,0 +1,239 @@
+"""
+Local stand-ins for MongoDB and the Mistral LLM used by the benchmarks.
+"""
+import gzip
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Never fall through to whatever database .env configures
+os.environ["MONGODB_URI"] = "mongodb://localhost:27017/"
+os.environ.setdefault("MISTRAL_API_URL", "http://localhost:8000")
+
+import mongomock
+from bson import ObjectId
+
+import models
+from database import Database
+from mistral_wrapper import MistralAPI
+
+
+class InMemoryDatabase(Database):
+    """
+    Database backed by mongomock instead of a real MongoDB server
+    """
+    def _create_client(self):
+        return mongomock.MongoClient()
+
+
+@contextmanager
+def in_memory_db():
+    """
+    Swap the models' database for a fresh in-memory one
+    """
+    original = models.db
+    models.db = InMemoryDatabase()
+    try:
+        yield models.db
+    finally:
+        models.db = original
+
+
+@contextmanager
+def stub_llm(responder):
+    """
+    Route every MistralAPI.get_response call to `responder(prompt, instructions)`
+    """
+    original = MistralAPI.get_response
+
+    def get_response(self, prompt, instructions=None):
+        return responder(prompt, instructions)
+
+    MistralAPI.get_response = get_response
+    try:
+        yield
+    finally:
+        MistralAPI.get_response = original
+
+
+class _LLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if len(body) < length:
+            # The client hung up mid-request (a cancelled hedge)
+            self.close_connection = True
+            return
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        payload = json.loads(body)
+        self._reply(payload.get("prompt", ""), payload.get("instructions"))
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        self._reply(query.get("prompt", [""])[0], query.get("instructions", [None])[0])
+
+    def _reply(self, prompt, instructions):
+        server = self.server
+        # Rough token count of what was sent; slower for longer prompts, like the real thing
+        tokens = (len(prompt) + len(instructions or "")) // 4
+        with server.lock:
+            server.calls += 1
+            server.prompt_tokens += tokens
+        delay = (server.latency + tokens * server.per_token
+                 + server.rng.uniform(-server.jitter, server.jitter))
+        if server.rng.random() < server.stall_rate:
+            delay += server.stall
+        # A node works on at most `capacity` prompts at once; the rest queue
+        with server.capacity:
+            time.sleep(max(0.0, delay))
+        body = json.dumps({"response": server.responder(prompt, instructions)}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _LLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose, e.g. when a hedged call is cancelled
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+@contextmanager
+def llm_server(responder=None, latency_ms=0, jitter_ms=0, seed=0, ms_per_1k_tokens=0, capacity=None,
+               stall_rate=0, stall_ms=0):
+    """
+    Serve a stand-in LLM backend over HTTP on localhost, answering after
+    `latency_ms` plus `ms_per_1k_tokens` of prompt (give or take `jitter_ms`),
+    working on at most `capacity` prompts at once (None: no limit). A
+    `stall_rate` fraction of prompts takes another `stall_ms`, for a tail.
+    Yields the server; its `url` goes in MISTRAL_API_URL, `calls` counts the
+    requests it answered and `prompt_tokens` their estimated prompt tokens.
+    """
+    server = _LLMServer(("127.0.0.1", 0), _LLMHandler)
+    server.responder = responder or (lambda prompt, instructions=None: grading_response())
+    server.latency = latency_ms / 1000
+    server.jitter = jitter_ms / 1000
+    server.per_token = ms_per_1k_tokens / 1e6
+    server.stall_rate = stall_rate
+    server.stall = stall_ms / 1000
+    server.lock = threading.Lock()
+    server.capacity = threading.BoundedSemaphore(capacity) if capacity else nullcontext()
+    server.prompt_tokens = 0
+    server.rng = random.Random(seed)
+    server.calls = 0
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+WORDS = (
+    "photosynthesis chlorophyll energy glucose oxygen carbon dioxide light "
+    "reaction cycle enzyme membrane cell structure function process system "
+    "analysis evaluation theory concept evidence example argument"
+).split()
+
+
+def lorem(num_words, rng=random):
+    """
+    Random filler text of roughly `num_words` words
+    """
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def make_mcq_question(rng=random):
+    return {
+        "text": lorem(20, rng) + "?",
+        "type": "mcq",
+        "options": [lorem(4, rng) for _ in range(4)],
+        "correct_answer": rng.randrange(4),
+    }
+
+
+def make_paragraph_question(rng=random, answer_words=300):
+    return {
+        "text": lorem(30, rng) + "?",
+        "type": "paragraph",
+        "model_answer": lorem(answer_words, rng),
+        "keywords": rng.sample(WORDS, 6),
+        "max_score": 10,
+    }
+
+
+def make_questions(num_mcq, num_paragraph, rng=random, answer_words=300):
+    questions = [make_mcq_question(rng) for _ in range(num_mcq)]
+    questions += [make_paragraph_question(rng, answer_words) for _ in range(num_paragraph)]
+    return questions
+
+
+def make_test_document(num_mcq=10, num_paragraph=0, rng=random, answer_words=300):
+    """
+    Build a test document shaped like the ones Test.create stores
+    """
+    return {
+        "title": lorem(5, rng),
+        "description": lorem(25, rng),
+        "created_by": str(ObjectId()),
+        "questions": make_questions(num_mcq, num_paragraph, rng, answer_words),
+        "time_limit": 60,
+    }
+
+
+def make_attempt_document(num_mcq=10, num_paragraph=0, rng=random, answer_words=400):
+    """
+    Build a completed attempt shaped like the ones TestAttempt stores, as read back from MongoDB
+    """
+    num_questions = num_mcq + num_paragraph
+    return {
+        "_id": ObjectId(),
+        "test_id": str(ObjectId()),
+        "student_id": str(ObjectId()),
+        "answers": [rng.randrange(4) for _ in range(num_mcq)] + [lorem(answer_words, rng) for _ in range(num_paragraph)],
+        "question_scores": [rng.randrange(11) for _ in range(num_questions)],
+        "feedback": [lorem(60, rng) for _ in range(num_questions)],
+        "score": rng.uniform(0, 100),
+        "status": "completed",
+        "is_completed": True,
+        "started_at": datetime.utcnow(),
+        "completed_at": datetime.utcnow(),
+    }
+
+
+def grading_response(score=7, padding_words=0, rng=random):
+    """
+    A grading reply the way the LLM tends to send it: JSON wrapped in prose
+    """
+    evaluation = json.dumps({"score": score, "feedback": lorem(60, rng)})
+    padding = lorem(padding_words, rng)
+    return f"Here is my evaluation of the answer. {padding}\n{evaluation}\nLet me know if you need more detail."
+
+
+def generation_response(num_questions, rng=random, answer_words=300):
+    """
+    A generation reply with a question array embedded in surrounding text
+    """
+    half = num_questions // 2
+    questions = make_questions(half, num_questions - half, rng, answer_words)
+    return f"Sure! Here are the questions you asked for:\n{json.dumps(questions, indent=2)}\nGood luck with the test."
@@ -1,6 +1,21 @@
+import re
+from datetime import datetime, timedelta, timezone
 from flask import jsonify, request
-from models import User, Test, TestAttempt
+from admission import AdmissionRejected, get_admission_controller
+from mistral_wrapper import CircuitOpenError
+from deadline import DeadlineExceeded
+from pregrader import get_pregrader
+from settings import settings
+from surge import get_surge_cache
+from models import User, Test, TestAttempt, TestVersionConflict, AttemptOutdated, GenerationJob, GenerationJobBusy, QuestionBank
+from tracing import get_logger, trace_class
 
+logger = get_logger('controllers')
+
+# Question fields a partial update may touch: plain names, so they can't reach into other paths
+QUESTION_FIELD_PATTERN = re.compile(r'^\w+$')
+
+@trace_class
 class AuthController:
     @staticmethod
     def register():
@@ -80,6 +95,7 @@ class AuthController:
         }), 200
 
 
+@trace_class
 class AdminController:
     @staticmethod
     def get_pending_teachers():
@@ -110,6 +126,7 @@ class AdminController:
         return jsonify({"message": "Teacher approved successfully"}), 200
 
 
+@trace_class
 class TeacherController:
     @staticmethod
     def create_test():
@@ -128,24 +145,9 @@ class TeacherController:
         
         # Check that each question has required fields
         for i, question in enumerate(data['questions']):
-            if not isinstance(question, dict):
-                return jsonify({"error": f"Question at index {i} is not a valid object"}), 400
-                
-            if 'text' not in question:
-                return jsonify({"error": f"Question at index {i} is missing 'text' field"}), 400
-            
-            question_type = question.get('type', 'mcq')  # Default to mcq for backward compatibility
-            
-            if question_type == 'mcq':
-                if 'options' not in question or not isinstance(question['options'], list):
-                    return jsonify({"error": f"Question at index {i} is missing 'options' field or it's not a list"}), 400
-                    
-                if 'correct_answer' not in question:
-                    return jsonify({"error": f"Question at index {i} is missing 'correct_answer' field"}), 400
-            
-            elif question_type == 'paragraph':
-                if 'model_answer' not in question:
-                    return jsonify({"error": f"Paragraph question at index {i} is missing 'model_answer' field"}), 400
+            error = TeacherController.question_error(question, i)
+            if error:
+                return jsonify({"error": error}), 400
         
         # Create test
         test = Test.create(
@@ -156,57 +158,168 @@ class TeacherController:
             time_limit=data.get('time_limit', 60)
         )
         
+        # Share the questions with colleagues generating tests on the same topic
+        try:
+            QuestionBank.add(data['questions'], data.get('subject_area'), data['title'], data['created_by'], 'teacher')
+            QuestionBank.mark_used(data['questions'], data['created_by'])
+        except Exception as e:
+            logger.warning("Could not add questions to the question bank: %s", e)
+        
         return jsonify({
             "message": "Test created successfully", 
             "test": test
         }), 201
     
+    @staticmethod
+    def question_error(question, i=None):
+        """Why a question can't be stored as question `i` (None: a new question), or None if it is valid"""
+        name = f"Question at index {i}" if i is not None else "Question"
+        if not isinstance(question, dict):
+            return f"{name} is not a valid object"
+            
+        if 'text' not in question:
+            return f"{name} is missing 'text' field"
+        
+        question_type = question.get('type', 'mcq')  # Default to mcq for backward compatibility
+        
+        if question_type == 'mcq':
+            if 'options' not in question or not isinstance(question['options'], list):
+                return f"{name} is missing 'options' field or it's not a list"
+                
+            if 'correct_answer' not in question:
+                return f"{name} is missing 'correct_answer' field"
+        
+        elif question_type == 'paragraph':
+            if 'model_answer' not in question:
+                return f"Paragraph {name.lower()} is missing 'model_answer' field"
+        
+        return None
+    
     @staticmethod
     def generate_ai_test():
         """Generate a test using AI"""
         data = request.get_json()
         
+        params, error = TeacherController.generation_params(data)
+        if error:
+            return jsonify({"error": error}), 400
+        
+        return TeacherController.run_generation(params['created_by'], lambda: GenerationJob.create(**params), 201)
+    
+    @staticmethod
+    def get_generation_job(job_id):
+        """Report how far an AI generation job got"""
+        job = GenerationJob.get_by_id(job_id)
+        if not job:
+            return jsonify({"error": "Generation job not found"}), 404
+        
+        return jsonify({"job": GenerationJob.summary(job)}), 200
+    
+    @staticmethod
+    def resume_generation_job(job_id):
+        """Finish an AI generation job from its last checkpoint"""
+        job = GenerationJob.get_by_id(job_id)
+        if not job:
+            return jsonify({"error": "Generation job not found"}), 404
+        
+        if job['status'] == 'completed':
+            return jsonify({"error": "Generation job already completed", "test_id": job['test_id']}), 409
+        
+        def claim():
+            claimed = GenerationJob.claim(job_id)
+            if claimed is None:
+                raise GenerationJobBusy()
+            return claimed
+        
+        return TeacherController.run_generation(job['created_by'], claim, 200)
+    
+    @staticmethod
+    def run_generation(teacher_id, get_job, status):
+        """
+        Run a generation job once the teacher gets an admission slot. The job
+        id goes into every response so a failed or partial run can be resumed.
+        """
+        job = None
+        try:
+            # Wait for a generation slot, taking turns with other teachers
+            with get_admission_controller().slot(teacher_id):
+                job = get_job()
+                # Generate test with AI
+                test = GenerationJob.run(job)
+            
+            return jsonify({
+                "message": TeacherController.generation_message(test, job['num_questions'], job.get('from_bank', 0)), 
+                "test": test,
+                "job_id": job['_id']
+            }), status
+            
+        except AdmissionRejected as e:
+            return jsonify({"error": str(e)}), 429, {"Retry-After": str(int(e.retry_after) + 1)}
+        except GenerationJobBusy:
+            return jsonify({"error": "Generation job is already running"}), 409
+        except CircuitOpenError as e:
+            return jsonify(TeacherController.generation_error(e, job)), 503, {"Retry-After": str(int(e.retry_after) + 1)}
+        except DeadlineExceeded as e:
+            return jsonify(TeacherController.generation_error(e, job)), 504
+        except Exception as e:
+            return jsonify(TeacherController.generation_error(e, job)), 500
+    
+    @staticmethod
+    def generation_error(error, job):
+        """Error body for a failed generation, pointing at the job to resume"""
+        body = {"error": str(error)}
+        if job:
+            body["job_id"] = job['_id']
+        return body
+    
+    @staticmethod
+    def generation_params(data):
+        """
+        Validate an AI generation request body
+        
+        Returns:
+            tuple: (keyword arguments for generate_ai_test, None) or (None, error message)
+        """
         # Validate required fields
         required_fields = ['title', 'created_by', 'num_questions', 'question_types']
         for field in required_fields:
             if field not in data:
-                return jsonify({"error": f"{field} is required"}), 400
+                return None, f"{field} is required"
         
         # Validate number of questions
         try:
             num_questions = int(data['num_questions'])
             if num_questions <= 0 or num_questions > 50:
-                return jsonify({"error": "Number of questions must be between 1 and 50"}), 400
+                return None, "Number of questions must be between 1 and 50"
         except ValueError:
-            return jsonify({"error": "num_questions must be a valid integer"}), 400
+            return None, "num_questions must be a valid integer"
         
         # Validate question types
         question_types = data['question_types']
         if not isinstance(question_types, list) or not question_types:
-            return jsonify({"error": "question_types must be a non-empty list"}), 400
+            return None, "question_types must be a non-empty list"
             
         if not all(qtype in ['mcq', 'paragraph'] for qtype in question_types):
-            return jsonify({"error": "question_types must contain only 'mcq' and/or 'paragraph'"}), 400
-        
-        try:
-            # Generate test with AI
-            test = Test.generate_ai_test(
-                title=data['title'],
-                description=data.get('description', ''),
-                num_questions=num_questions,
-                question_types=question_types,
-                subject_area=data.get('subject_area'),
-                created_by=data['created_by'],
-                time_limit=data.get('time_limit', 60)
-            )
-            
-            return jsonify({
-                "message": "AI test generated successfully", 
-                "test": test
-            }), 201
-            
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            return None, "question_types must contain only 'mcq' and/or 'paragraph'"
+        
+        return {
+            "title": data['title'],
+            "description": data.get('description', ''),
+            "num_questions": num_questions,
+            "question_types": question_types,
+            "subject_area": data.get('subject_area'),
+            "created_by": data['created_by'],
+            "time_limit": data.get('time_limit', 60),
+            "use_question_bank": bool(data.get('use_question_bank', True))
+        }, None
+    
+    @staticmethod
+    def generation_message(test, num_questions, from_bank=0):
+        if test.get('generation_status') == 'partial':
+            return f"Time ran out; generated {len(test['questions'])} of {num_questions} questions"
+        if from_bank:
+            return f"AI test generated successfully ({from_bank} of {num_questions} questions reused from the question bank)"
+        return "AI test generated successfully"
     
     @staticmethod
     def get_tests(teacher_id):
@@ -232,15 +345,234 @@ class TeacherController:
         test = Test.get_by_id(test_id)
         if not test:
             return jsonify({"error": "Test not found"}), 404
+        if TestAttempt.has_open_attempts(test_id):
+            return TeacherController.test_in_use()
+        
+        # Only check the version if the client sent one, for older clients
+        version = None
+        if 'version' in data:
+            version, error = TeacherController.requested_version(data)
+            if error:
+                return jsonify({"error": error}), 400
         
         # Update test
-        updated_test = Test.update(test_id, data)
+        try:
+            updated_test = Test.update(test_id, data, version)
+        except TestVersionConflict as e:
+            return TeacherController.version_conflict(e)
+        if not updated_test:
+            return jsonify({"error": "Test not found"}), 404
         
         return jsonify({
             "message": "Test updated successfully",
             "test": updated_test
         }), 200
     
+    @staticmethod
+    def schedule_exam(test_id):
+        """Schedule when a test is sat as an exam, or clear the schedule with starts_at null"""
+        data = request.get_json() or {}
+        
+        if 'starts_at' not in data:
+            return jsonify({"error": "starts_at is required"}), 400
+        
+        starts_at = surge_until = None
+        if data['starts_at'] is not None:
+            try:
+                starts_at = datetime.fromisoformat(str(data['starts_at']))
+            except ValueError:
+                return jsonify({"error": "starts_at must be an ISO 8601 date and time"}), 400
+            if starts_at.tzinfo is not None:
+                starts_at = starts_at.astimezone(timezone.utc).replace(tzinfo=None)
+            
+            surge_minutes = data.get('surge_minutes', settings.surge_duration_seconds / 60)
+            if not isinstance(surge_minutes, (int, float)) or isinstance(surge_minutes, bool) or surge_minutes <= 0:
+                return jsonify({"error": "surge_minutes must be a positive number"}), 400
+            surge_until = starts_at + timedelta(minutes=surge_minutes)
+        
+        if not Test.schedule_exam(test_id, starts_at, surge_until):
+            return jsonify({"error": "Test not found"}), 404
+        
+        return jsonify({
+            "message": "Exam scheduled" if starts_at else "Exam schedule cleared",
+            "starts_at": starts_at,
+            "surge_until": surge_until
+        }), 200
+    
+    @staticmethod
+    def add_question(test_id):
+        """Add one question to a test"""
+        data = request.get_json() or {}
+        
+        version, error = TeacherController.requested_version(data)
+        if error:
+            return jsonify({"error": error}), 400
+        
+        position = data.get('position')
+        if position is not None and (not isinstance(position, int) or position < 0):
+            return jsonify({"error": "position must be a non-negative integer"}), 400
+        
+        question = data.get('question')
+        error = TeacherController.question_error(question, position)
+        if error:
+            return jsonify({"error": error}), 400
+        if TestAttempt.has_open_attempts(test_id):
+            return TeacherController.test_in_use()
+        
+        try:
+            new_version = Test.add_question(test_id, version, question, position)
+        except TestVersionConflict as e:
+            return TeacherController.version_conflict(e)
+        if new_version is None:
+            return jsonify({"error": "Test not found"}), 404
+        
+        return jsonify({
+            "message": "Question added successfully",
+            "question": question,
+            "version": new_version
+        }), 201
+    
+    @staticmethod
+    def update_question(test_id, index):
+        """Change some fields of one question; fields set to null are removed"""
+        data = request.get_json() or {}
+        
+        version, error = TeacherController.requested_version(data)
+        if error:
+            return jsonify({"error": error}), 400
+        
+        changes = data.get('question')
+        if not isinstance(changes, dict) or not changes:
+            return jsonify({"error": "question must be an object with the fields to change"}), 400
+        if not all(QUESTION_FIELD_PATTERN.match(field) for field in changes):
+            return jsonify({"error": "Question field names may only contain letters, digits and underscores"}), 400
+        
+        test, response = TeacherController.test_at_version(test_id, version)
+        if response:
+            return response
+        if TestAttempt.has_open_attempts(test_id):
+            return TeacherController.test_in_use()
+        if index >= len(test['questions']):
+            return jsonify({"error": "Question not found"}), 404
+        
+        # Validate the question as it will be after the change
+        question = {**test['questions'][index], **changes}
+        question = {field: value for field, value in question.items() if value is not None}
+        error = TeacherController.question_error(question, index)
+        if error:
+            return jsonify({"error": error}), 400
+        
+        try:
+            new_version = Test.update_question(test_id, version, index, changes)
+        except TestVersionConflict as e:
+            return TeacherController.version_conflict(e)
+        if new_version is None:
+            return jsonify({"error": "Test not found"}), 404
+        
+        return jsonify({
+            "message": "Question updated successfully",
+            "question": question,
+            "version": new_version
+        }), 200
+    
+    @staticmethod
+    def delete_question(test_id, index):
+        """Remove one question from a test"""
+        version, error = TeacherController.requested_version(request.get_json(silent=True))
+        if error:
+            return jsonify({"error": error}), 400
+        
+        # The question and the one after it are enough to tell whether it
+        # exists and isn't the last one left
+        window = Test.questions_at(test_id, index, 2)
+        if window is None:
+            return jsonify({"error": "Test not found"}), 404
+        current_version, questions = window
+        if current_version != version:
+            return TeacherController.version_conflict(TestVersionConflict(current_version))
+        if TestAttempt.has_open_attempts(test_id):
+            return TeacherController.test_in_use()
+        if not questions:
+            return jsonify({"error": "Question not found"}), 404
+        if index == 0 and len(questions) == 1:
+            return jsonify({"error": "A test must have at least one question"}), 400
+        
+        try:
+            new_version = Test.delete_question(test_id, version, index)
+        except TestVersionConflict as e:
+            return TeacherController.version_conflict(e)
+        if new_version is None:
+            return jsonify({"error": "Test not found"}), 404
+        
+        return jsonify({"message": "Question deleted successfully", "version": new_version}), 200
+    
+    @staticmethod
+    def reorder_questions(test_id):
+        """Reorder a test's questions"""
+        data = request.get_json() or {}
+        
+        version, error = TeacherController.requested_version(data)
+        if error:
+            return jsonify({"error": error}), 400
+        
+        test, response = TeacherController.test_at_version(test_id, version)
+        if response:
+            return response
+        if TestAttempt.has_open_attempts(test_id):
+            return TeacherController.test_in_use()
+        
+        # order[i] is the current index of the question that becomes question i
+        order = data.get('order')
+        if not isinstance(order, list) or sorted(order) != list(range(len(test['questions']))):
+            return jsonify({"error": "order must list every current question index exactly once"}), 400
+        
+        try:
+            new_version = Test.reorder_questions(test_id, version, test['questions'], order)
+        except TestVersionConflict as e:
+            return TeacherController.version_conflict(e)
+        if new_version is None:
+            return jsonify({"error": "Test not found"}), 404
+        
+        return jsonify({"message": "Questions reordered successfully", "version": new_version}), 200
+    
+    @staticmethod
+    def requested_version(data):
+        """
+        The test version the client last saw, from the body or ?version=
+        
+        Returns:
+            tuple: (version, None) or (None, error message)
+        """
+        raw = (data or {}).get('version', request.args.get('version'))
+        if raw is None:
+            return None, "version is required"
+        try:
+            return int(raw), None
+        except (TypeError, ValueError):
+            return None, "version must be an integer"
+    
+    @staticmethod
+    def test_at_version(test_id, version):
+        """
+        (test, None) if the test exists at `version`, otherwise (None, error response)
+        """
+        test = Test.get_by_id(test_id)
+        if not test:
+            return None, (jsonify({"error": "Test not found"}), 404)
+        if test['version'] != version:
+            return None, TeacherController.version_conflict(TestVersionConflict(test['version']))
+        return test, None
+    
+    @staticmethod
+    def version_conflict(error):
+        return jsonify({"error": str(error), "version": error.current_version}), 409
+    
+    @staticmethod
+    def test_in_use():
+        # Answers are mapped back to questions by position, so the questions
+        # of a test can't change under the students taking it
+        return jsonify({"error": "Students are taking this test; it can be changed once their attempts are over"}), 409
+    
     @staticmethod
     def delete_test(test_id):
         """Delete a test"""
@@ -248,6 +580,8 @@ class TeacherController:
         test = Test.get_by_id(test_id)
         if not test:
             return jsonify({"error": "Test not found"}), 404
+        if TestAttempt.has_open_attempts(test_id):
+            return TeacherController.test_in_use()
         
         # Delete test
         Test.delete(test_id)
@@ -255,6 +589,7 @@ class TeacherController:
         return jsonify({"message": "Test deleted successfully"}), 200
 
 
+@trace_class
 class StudentController:
     @staticmethod
     def get_available_tests():
@@ -272,17 +607,28 @@ class StudentController:
     @staticmethod
     def start_test(test_id, student_id):
         """Start a test attempt"""
-        # Check if test exists
-        test = Test.get_by_id(test_id)
-        if not test:
-            return jsonify({"error": "Test not found"}), 404
-        
-        # Create test attempt
-        attempt = TestAttempt.create(test_id, student_id)
-        
-        # Return test without correct answers
-        for question in test.get('questions', []):
-            question.pop('correct_answer', None)
+        # During an exam-start surge the students' copy is already in memory
+        cache = get_surge_cache()
+        test = cache.get(test_id)
+        # The cache is refreshed every SURGE_POLL_SECONDS; an edit since then
+        # must not start attempts on the old questions and version. Reading
+        # the version alone is a cheap primary key lookup.
+        if test is not None and Test.current_version(test_id) != test.get('version', 0):
+            test = cache.reload(test_id)
+        surging = test is not None
+        if not surging:
+            # Check if test exists
+            test = Test.get_by_id(test_id)
+            if not test:
+                return jsonify({"error": "Test not found"}), 404
+            test = Test.without_answers(test)
+        
+        # Create test attempt; the sweeper closes it once the time limit runs out
+        attempt = TestAttempt.create(test_id, student_id, time_limit=test.get('time_limit'), batched=surging,
+                                     test_version=test.get('version', 0))
+        
+        # Return test without correct answers, in this attempt's order
+        test = dict(test, questions=TestAttempt.shuffled_questions(test['questions'], attempt['shuffle_seed']))
             
         return jsonify({
             "message": "Test started successfully",
@@ -292,33 +638,174 @@ class StudentController:
     
     @staticmethod
     def submit_test(attempt_id):
-        """Submit a test attempt"""
+        """Submit a test attempt; retries and double submits get the first submission's result"""
         data = request.get_json()
         
         # Validate data
         if 'answers' not in data:
             return jsonify({"error": "Answers are required"}), 400
         
-        # Get attempt
-        attempt = TestAttempt.get_by_id(attempt_id)
+        key = StudentController.idempotency_key(request.headers, data)
+        
+        # Claim the attempt for grading, so only one submission grades it
+        attempt = TestAttempt.claim_submission(attempt_id, key, settings.attempt_grace_seconds)
+        if not attempt:
+            attempt = TestAttempt.get_by_id(attempt_id)
+            waited = bool(attempt) and attempt.get('status') == 'grading'
+            if waited:
+                attempt = TestAttempt.wait_for_grading(attempt_id)
+            body, status = StudentController.duplicate_submission(attempt, key, waited)
+            return jsonify(body), status
+        
+        try:
+            # Use the new submit_with_evaluation method for AI-powered grading
+            updated_attempt = TestAttempt.submit_with_evaluation(attempt_id, data['answers'], attempt)
+            
+            return jsonify({
+                "message": StudentController.submission_message(updated_attempt),
+                "attempt": updated_attempt
+            }), 200
+            
+        except AttemptOutdated as e:
+            TestAttempt.release_submission(attempt_id, attempt['submission_token'])
+            return jsonify({"error": str(e)}), 409
+        except Exception as e:
+            TestAttempt.release_submission(attempt_id, attempt['submission_token'])
+            return jsonify({"error": f"Error submitting test: {str(e)}"}), 500
+    
+    @staticmethod
+    def idempotency_key(headers, data):
+        """The client's key for this submission, from the Idempotency-Key header or the body"""
+        key = headers.get('Idempotency-Key') or data.get('idempotency_key')
+        return str(key)[:128] if key else None
+    
+    @staticmethod
+    def duplicate_submission(attempt, key, waited):
+        """
+        Response for a submission that couldn't claim the attempt: the result
+        of the submission that did, if it is the same one (same idempotency key)
+        or ran concurrently with this one
+        
+        Returns:
+            tuple: (response body, status code)
+        """
+        if not attempt:
+            return {"error": "Test attempt not found"}, 404
+        
+        if attempt.get('status') == 'grading':
+            return {"message": "Test is still being graded", "attempt_id": attempt['_id']}, 202
+        
+        if attempt.get('status') == 'abandoned':
+            return {"error": "Test attempt expired without any saved answers"}, 400
+        
+        if attempt['is_completed']:
+            if waited or (key and key == attempt.get('submission_key')):
+                return {"message": StudentController.submission_message(attempt), "attempt": attempt}, 200
+            return {"error": "Test attempt already completed"}, 400
+        
+        if TestAttempt.out_of_time(attempt, settings.attempt_grace_seconds):
+            return StudentController.out_of_time_error(), 400
+        
+        # Another submission failed and released the attempt meanwhile
+        return {"error": "Test attempt was being submitted concurrently; please try again"}, 409
+    
+    @staticmethod
+    def out_of_time_error():
+        # The sweeper submits whatever was autosaved in time
+        return {"error": "The time limit for this attempt has run out"}
+    
+    @staticmethod
+    def autosave_answers(attempt_id):
+        """Save answers of an attempt in progress; paragraph answers get pre-graded once they settle"""
+        data = request.get_json() or {}
+        
+        answers = data.get('answers')
+        if not isinstance(answers, dict) or not answers:
+            return jsonify({"error": "answers must be an object mapping question index to answer"}), 400
+        
+        attempt = TestAttempt.get_by_id(attempt_id, {'test_id': 1, 'is_completed': 1, 'shuffle_seed': 1,
+                                                     'test_version': 1, 'due_at': 1})
         if not attempt:
             return jsonify({"error": "Test attempt not found"}), 404
         
-        # Check if attempt is already completed
         if attempt['is_completed']:
             return jsonify({"error": "Test attempt already completed"}), 400
         
+        if TestAttempt.out_of_time(attempt, settings.attempt_grace_seconds):
+            return jsonify(StudentController.out_of_time_error()), 400
+        
+        version, questions = Test.question_outline(attempt['test_id']) or (None, [])
+        if version is not None:
+            try:
+                TestAttempt.check_test_version(attempt, {'version': version})
+            except AttemptOutdated as e:
+                return jsonify({"error": str(e)}), 409
         try:
-            # Use the new submit_with_evaluation method for AI-powered grading
-            updated_attempt = TestAttempt.submit_with_evaluation(attempt_id, data['answers'])
+            answers = {int(index): answer for index, answer in answers.items()}
+        except ValueError:
+            return jsonify({"error": "Answer keys must be question indexes"}), 400
+        if not all(0 <= index < len(questions) for index in answers):
+            return jsonify({"error": "Answer for a question the test doesn't have"}), 400
+        
+        saved = sorted(answers)
+        
+        # Indexes and options are as served to this attempt; store them in the test's order
+        permutation = TestAttempt.permutation(attempt.get('shuffle_seed'), questions)
+        if permutation is not None:
+            answers = dict(TestAttempt.original_answer(permutation, index, answer) for index, answer in answers.items())
+        question_types = [question.get('type', 'mcq') for question in questions]
+        
+        if not TestAttempt.autosave(attempt_id, answers, settings.attempt_grace_seconds):
+            return jsonify({"error": "Test attempt already completed or out of time"}), 400
+        
+        if settings.pregrade_enabled:
+            for index, answer in answers.items():
+                if question_types[index] == 'paragraph' and isinstance(answer, str) and answer.strip():
+                    get_pregrader().schedule(attempt_id, index, answer)
+        
+        return jsonify({"message": "Answers saved", "saved": saved}), 200
+    
+    @staticmethod
+    def submission_message(attempt):
+        if attempt.get('grading_status') == 'partial':
+            return "Test submitted; some answers are still awaiting grading"
+        return "Test submitted successfully"
+    
+    @staticmethod
+    def grade_pending(attempt_id):
+        """Grade the answers that were deferred at submit time"""
+        attempt = TestAttempt.get_by_id(attempt_id)
+        if not attempt:
+            return jsonify({"error": "Test attempt not found"}), 404
+        
+        if not attempt.get('pending_questions'):
+            return jsonify({"message": "Nothing left to grade", "attempt": attempt}), 200
+        
+        try:
+            updated_attempt = TestAttempt.grade_pending(attempt_id)
+            if updated_attempt is None:
+                # Another request is grading them, or just finished
+                attempt = TestAttempt.get_by_id(attempt_id)
+                if attempt and attempt.get('grading_status') == 'partial':
+                    return jsonify({"message": "Pending answers are already being graded", "attempt_id": attempt_id}), 202
+                return jsonify({"message": "Nothing left to grade", "attempt": attempt}), 200
             
             return jsonify({
-                "message": "Test submitted successfully",
+                "message": "Pending answers graded",
                 "attempt": updated_attempt
             }), 200
             
         except Exception as e:
-            return jsonify({"error": f"Error submitting test: {str(e)}"}), 500
+            return jsonify({"error": f"Error grading answers: {str(e)}"}), 500
+    
+    @staticmethod
+    def get_attempt(attempt_id):
+        """Get one test attempt in full, archived or not"""
+        attempt = TestAttempt.get_by_id(attempt_id)
+        if not attempt:
+            return jsonify({"error": "Test attempt not found"}), 404
+        
+        return jsonify({"attempt": attempt}), 200
     
     @staticmethod
     def get_attempts(student_id):
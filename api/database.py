@@ -1,120 +1,246 @@
 import os
 import pymongo
-from pymongo import MongoClient
-from dotenv import load_dotenv
+from pymongo import MongoClient, ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorClient
 from bson.objectid import ObjectId
+import threading
+from contextlib import contextmanager
+from metrics import time_db
+from settings import settings
+from tracing import get_logger, span
+
+logger = get_logger('database')
+
+
+@contextmanager
+def _instrument(collection_name, operation):
+    """
+    Trace span plus latency metric around one database call
+    """
+    with span(f"db.{operation}", collection=collection_name), time_db(collection_name, operation):
+        yield
+
 
 class Database:
-    def __init__(self, debug=False):
-        # Load environment variables
-        load_dotenv()
-        
-        # Get MongoDB connection string from environment or use default
-        self.uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
-        self.client = None
-        self.db = None
+    def __init__(self, debug=False, uri=None, max_pool_size=None, min_pool_size=None,
+                 connect_timeout_ms=None, socket_timeout_ms=None,
+                 server_selection_timeout_ms=None, wait_queue_timeout_ms=None):
+        # Get MongoDB connection string from settings or use default
+        self.uri = uri or settings.mongodb_uri
         self.debug = debug
         
-        # Automatically connect when initializing
+        # Connection pool and timeout settings, per process; unset values fall
+        # back to the MONGODB_* settings and then to pymongo's defaults
+        options = {
+            "maxPoolSize": (max_pool_size, settings.mongodb_max_pool_size),
+            "minPoolSize": (min_pool_size, settings.mongodb_min_pool_size),
+            "connectTimeoutMS": (connect_timeout_ms, settings.mongodb_connect_timeout_ms),
+            "socketTimeoutMS": (socket_timeout_ms, settings.mongodb_socket_timeout_ms),
+            "serverSelectionTimeoutMS": (server_selection_timeout_ms, settings.mongodb_server_selection_timeout_ms),
+            "waitQueueTimeoutMS": (wait_queue_timeout_ms, settings.mongodb_wait_queue_timeout_ms),
+        }
+        self.client_options = {}
+        for option, (value, configured) in options.items():
+            value = value if value is not None else configured
+            if value is not None:
+                self.client_options[option] = value
+        
+        # The client is created lazily, once per process: MongoClient is not
+        # fork-safe, so a client inherited from a parent process is never reused
+        self._client = None
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    @property
+    def client(self):
         self.connect()
+        return self._client
+    
+    @property
+    def db(self):
+        self.connect()
+        return self._db
+    
+    def _create_client(self):
+        return MongoClient(self.uri, **self.client_options)
         
     def connect(self):
         """
-        Connect to MongoDB database
+        Connect to MongoDB database (a no-op if this process is already connected)
         """
-        try:
-            if self.debug:
-                print(f"Connecting to MongoDB at: {self.uri}")
-            
-            self.client = MongoClient(self.uri)
-            self.db = self.client.ai_evaluator
-            
-            if self.debug:
-                print(f"Successfully connected to MongoDB")
-                print(f"Available databases: {self.client.list_database_names()}")
+        if self._client is not None and self._pid == os.getpid():
             return True
-        except Exception as e:
-            if self.debug:
-                print(f"Failed to connect to MongoDB: {str(e)}")
-            raise e
+        
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                return True
+            try:
+                if self.debug:
+                    logger.debug("Connecting to MongoDB at: %s", self.uri)
+                
+                # Any client left in self._client belongs to the parent process;
+                # drop it without closing, since its sockets are shared with the parent
+                client = self._create_client()
+                self._db = client.ai_evaluator
+                self._client = client
+                self._pid = os.getpid()
+                
+                if self.debug:
+                    logger.debug("Successfully connected to MongoDB")
+                    logger.debug("Available databases: %s", self._client.list_database_names())
+                return True
+            except Exception as e:
+                logger.error("Failed to connect to MongoDB: %s", e)
+                raise e
             
     def close(self):
         """
         Close the database connection
         """
-        if self.client:
-            self.client.close()
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+            self._client = None
+            self._db = None
             if self.debug:
-                print("MongoDB connection closed")
+                logger.debug("MongoDB connection closed")
     
     def insert_one(self, collection_name, document):
         """
         Insert a single document into a collection
         """
-        if self.db is None:
-            raise Exception("Database not connected. Call connect() first.")
-        return self.db[collection_name].insert_one(document)
+        with _instrument(collection_name, 'insert_one'):
+            return self.db[collection_name].insert_one(document)
         
     def insert_many(self, collection_name, documents):
         """
         Insert multiple documents into a collection
         """
-        if self.db is None:
-            raise Exception("Database not connected. Call connect() first.")
-        return self.db[collection_name].insert_many(documents)
+        with _instrument(collection_name, 'insert_many'):
+            return self.db[collection_name].insert_many(documents)
     
     def find_one(self, collection_name, query, projection=None):
         """
         Find a single document matching the query
         """
-        if self.db is None:
-            raise Exception("Database not connected. Call connect() first.")
-        return self.db[collection_name].find_one(query, projection)
+        with _instrument(collection_name, 'find_one'):
+            return self.db[collection_name].find_one(query, projection)
     
     def find(self, collection_name, query, projection=None, sort=None, limit=0):
         """
         Find all documents matching the query
         """
-        if self.db is None:
-            raise Exception("Database not connected. Call connect() first.")
-        cursor = self.db[collection_name].find(query, projection)
-        
-        if sort:
-            cursor = cursor.sort(sort)
-        
-        if limit > 0:
-            cursor = cursor.limit(limit)
+        with _instrument(collection_name, 'find'):
+            cursor = self.db[collection_name].find(query, projection)
             
-        return list(cursor)
+            if sort:
+                cursor = cursor.sort(sort)
+            
+            if limit > 0:
+                cursor = cursor.limit(limit)
+                
+            return list(cursor)
     
     def update_one(self, collection_name, query, update, upsert=False):
         """
         Update a single document matching the query
         """
-        if self.db is None:
-            raise Exception("Database not connected. Call connect() first.")
-        return self.db[collection_name].update_one(query, update, upsert=upsert)
+        with _instrument(collection_name, 'update_one'):
+            return self.db[collection_name].update_one(query, update, upsert=upsert)
+    
+    def find_one_and_update(self, collection_name, query, update, projection=None, return_updated=True):
+        """
+        Atomically update a single document matching the query and return it,
+        as it is after the update unless return_updated is False; None if nothing matched
+        """
+        with _instrument(collection_name, 'find_one_and_update'):
+            return self.db[collection_name].find_one_and_update(
+                query, update, projection,
+                return_document=ReturnDocument.AFTER if return_updated else ReturnDocument.BEFORE)
     
     def update_many(self, collection_name, query, update, upsert=False):
         """
         Update multiple documents matching the query
         """
-        if self.db is None:
-            raise Exception("Database not connected. Call connect() first.")
-        return self.db[collection_name].update_many(query, update, upsert=upsert)
+        with _instrument(collection_name, 'update_many'):
+            return self.db[collection_name].update_many(query, update, upsert=upsert)
     
     def delete_one(self, collection_name, query):
         """
         Delete a single document matching the query
         """
-        if self.db is None:
-            raise Exception("Database not connected. Call connect() first.")
-        return self.db[collection_name].delete_one(query)
+        with _instrument(collection_name, 'delete_one'):
+            return self.db[collection_name].delete_one(query)
     
     def delete_many(self, collection_name, query):
         """
         Delete multiple documents matching the query
         """
-        if self.db is None:
-            raise Exception("Database not connected. Call connect() first.")
-        return self.db[collection_name].delete_many(query)
\ No newline at end of file
+        with _instrument(collection_name, 'delete_many'):
+            return self.db[collection_name].delete_many(query)
+    
+    def create_index(self, collection_name, keys, **options):
+        """
+        Create an index on a collection (a no-op if it already exists)
+        """
+        with _instrument(collection_name, 'create_index'):
+            return self.db[collection_name].create_index(keys, **options)
+
+
+class AsyncDatabase(Database):
+    """
+    Database for asyncio code, backed by Motor: the same collections, pool
+    settings and instrumentation, but every operation is a coroutine
+    """
+    def _create_client(self):
+        return AsyncIOMotorClient(self.uri, **self.client_options)
+    
+    async def insert_one(self, collection_name, document):
+        with _instrument(collection_name, 'insert_one'):
+            return await self.db[collection_name].insert_one(document)
+    
+    async def insert_many(self, collection_name, documents):
+        with _instrument(collection_name, 'insert_many'):
+            return await self.db[collection_name].insert_many(documents)
+    
+    async def find_one(self, collection_name, query, projection=None):
+        with _instrument(collection_name, 'find_one'):
+            return await self.db[collection_name].find_one(query, projection)
+    
+    async def find(self, collection_name, query, projection=None, sort=None, limit=0):
+        with _instrument(collection_name, 'find'):
+            cursor = self.db[collection_name].find(query, projection)
+            
+            if sort:
+                cursor = cursor.sort(sort)
+            
+            if limit > 0:
+                cursor = cursor.limit(limit)
+                
+            return await cursor.to_list(length=None)
+    
+    async def update_one(self, collection_name, query, update, upsert=False):
+        with _instrument(collection_name, 'update_one'):
+            return await self.db[collection_name].update_one(query, update, upsert=upsert)
+    
+    async def find_one_and_update(self, collection_name, query, update, projection=None, return_updated=True):
+        with _instrument(collection_name, 'find_one_and_update'):
+            return await self.db[collection_name].find_one_and_update(
+                query, update, projection,
+                return_document=ReturnDocument.AFTER if return_updated else ReturnDocument.BEFORE)
+    
+    async def update_many(self, collection_name, query, update, upsert=False):
+        with _instrument(collection_name, 'update_many'):
+            return await self.db[collection_name].update_many(query, update, upsert=upsert)
+    
+    async def delete_one(self, collection_name, query):
+        with _instrument(collection_name, 'delete_one'):
+            return await self.db[collection_name].delete_one(query)
+    
+    async def delete_many(self, collection_name, query):
+        with _instrument(collection_name, 'delete_many'):
+            return await self.db[collection_name].delete_many(query)
+    
+    async def create_index(self, collection_name, keys, **options):
+        with _instrument(collection_name, 'create_index'):
+            return await self.db[collection_name].create_index(keys, **options)
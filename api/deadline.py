@@ -0,0 +1,98 @@
+import time
+import contextvars
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the current request has run out of its time budget
+    """
+    def __init__(self, message="Request deadline exceeded"):
+        super().__init__(message)
+
+
+class Deadline:
+    """
+    A point in time by which the current request has to be finished
+    """
+    def __init__(self, seconds):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """
+        Seconds left before the deadline (never negative)
+        """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+
+_current = contextvars.ContextVar('deadline', default=None)
+
+
+def set_deadline(seconds):
+    """
+    Start a deadline for the current request (or task); None clears it
+    """
+    deadline = Deadline(seconds) if seconds is not None else None
+    _current.set(deadline)
+    return deadline
+
+
+def budget(default, requested=None):
+    """
+    Time budget for a request: the endpoint's default, shortened (never
+    lengthened) by a client-requested timeout such as X-Request-Timeout
+    """
+    if requested:
+        try:
+            requested = float(requested)
+            return min(default, requested) if default else requested
+        except ValueError:
+            pass
+    return default
+
+
+def clear_deadline():
+    _current.set(None)
+
+
+def current_deadline():
+    return _current.get()
+
+
+def remaining():
+    """
+    Seconds left for the current request, or None when it has no deadline
+    """
+    deadline = _current.get()
+    return deadline.remaining() if deadline else None
+
+
+def expired():
+    deadline = _current.get()
+    return deadline is not None and deadline.expired()
+
+
+def check():
+    """
+    Raise DeadlineExceeded if the current request is out of time
+    """
+    if expired():
+        raise DeadlineExceeded()
+
+
+def clamp_timeout(timeout, minimum=1.0):
+    """
+    Shrink a per-call timeout to what is left of the request budget.
+
+    Raises DeadlineExceeded when less than `minimum` seconds remain, since a
+    call that cannot realistically finish is not worth starting.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left < minimum:
+        raise DeadlineExceeded()
+    return min(timeout, left)
@@ -0,0 +1,38 @@
+"""
+Production server settings: `gunicorn -c gunicorn.conf.py app:app`, or for the
+async LLM endpoints `GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker
+gunicorn -c gunicorn.conf.py asgi:app`
+
+Every value can be overridden from the environment. The app opens its MongoDB
+and LLM connections lazily in each worker, so preloading is safe.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+
+# LLM-bound requests spend most of their time waiting on the network, so each
+# worker process runs a pool of threads (or, with the uvicorn worker, one event
+# loop); processes give CPU parallelism
+workers = int(os.getenv("GUNICORN_WORKERS", os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1)))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+# Must outlast the longest request deadline (AI test generation, 900s)
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 930))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# Recycle workers now and then to contain slow memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges from the shared Prometheus directory
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,239 @@
+"""
+Spreading LLM calls over several backend endpoints: least-outstanding
+routing, passive and active health checks, and the delay after which a slow
+call is hedged on a second endpoint.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+import requests
+import metrics
+from settings import settings
+from tracing import get_logger
+
+logger = get_logger('llm_pool')
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0         # consecutive failed calls
+        self.down_until = 0.0     # monotonic time it's out of rotation until
+        self.requests = 0
+
+    def healthy(self, now):
+        return self.down_until <= now
+
+
+class EndpointPool:
+    """
+    The LLM backends in MISTRAL_API_URL, which may list several separated by
+    commas.
+
+    Each call goes to the healthy endpoint with the fewest calls outstanding
+    from this process, so a slow or overloaded node gets less traffic. An
+    endpoint that fails `failure_threshold` calls in a row is taken out of
+    rotation for `down_seconds`. With more than one endpoint, a background
+    thread also probes each of them every `health_check_seconds`, taking
+    unreachable ones out of rotation and putting recovered ones back early.
+    If every endpoint is down, calls are spread over all of them anyway and
+    the circuit breaker decides whether to make them at all.
+    """
+    # Successful call latencies kept for the hedge percentile, and how many
+    # are needed before hedging starts
+    latency_window = 500
+    min_latency_samples = 20
+
+    def __init__(self, urls, failure_threshold=3, down_seconds=30, health_check_seconds=10,
+                 health_check_path='/', hedge_percentile=0.0, min_hedge_seconds=0.05):
+        if not urls:
+            raise ValueError("MISTRAL_API_URL is not set in the .env file")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.down_seconds = down_seconds
+        self.health_check_seconds = health_check_seconds
+        self.health_check_path = health_check_path
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_seconds = min_hedge_seconds
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=self.latency_window)
+        self._pid = None
+        self.source = None   # the MISTRAL_API_URL value the pool was built from
+
+    @staticmethod
+    def parse_urls(value):
+        return [url.strip().rstrip('/') for url in (value or '').split(',') if url.strip()]
+
+    @classmethod
+    def from_settings(cls):
+        pool = cls(
+            cls.parse_urls(settings.mistral_api_url),
+            failure_threshold=settings.mistral_endpoint_failures,
+            down_seconds=settings.mistral_endpoint_down_seconds,
+            health_check_seconds=settings.mistral_health_check_seconds,
+            health_check_path=settings.mistral_health_check_path,
+            hedge_percentile=settings.mistral_hedge_percentile,
+        )
+        pool.source = settings.mistral_api_url
+        return pool
+
+    def acquire(self, exclude=()):
+        """
+        Pick the endpoint for a call and count the call as outstanding on it.
+        Pass it back to `release` when the call is over.
+
+        Args:
+            exclude (list): Endpoints the call must not go to, such as those
+                it already failed on; with any given, only healthy endpoints
+                are considered
+
+        Returns:
+            Endpoint, or None if `exclude` leaves no healthy endpoint
+        """
+        now = time.monotonic()
+        with self._lock:
+            for endpoint in self.endpoints:
+                if endpoint.down_until and endpoint.healthy(now):
+                    # Its time out is over; one more failure takes it out again
+                    endpoint.down_until = 0.0
+                    metrics.LLM_ENDPOINT_HEALTHY.labels(endpoint.url).set(1)
+            candidates = [e for e in self.endpoints if e not in exclude and e.healthy(now)]
+            if not candidates and not exclude:
+                candidates = self.endpoints
+            if not candidates:
+                return None
+            fewest = min(e.outstanding for e in candidates)
+            endpoint = random.choice([e for e in candidates if e.outstanding == fewest])
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, ok, latency=None):
+        """
+        Finish a call started with `acquire`
+
+        Args:
+            ok (bool): Whether the endpoint answered properly; None when the
+                call was abandoned by the caller and says nothing about it
+            latency (float): Seconds the endpoint took, for a successful call
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.failures = 0
+                if latency is not None:
+                    self._latencies.append(latency)
+            elif ok is not None:
+                endpoint.failures += 1
+                if endpoint.failures >= self.failure_threshold and endpoint.healthy(time.monotonic()):
+                    self._mark_down(endpoint, f"{endpoint.failures} failed calls in a row")
+        if ok is not None:
+            metrics.LLM_ENDPOINT_REQUESTS.labels(endpoint.url, 'ok' if ok else 'error').inc()
+
+    def hedge_delay(self):
+        """
+        How long to wait on a call before hedging it on a second endpoint:
+        the `hedge_percentile` of recent call latencies. None while hedging is
+        off, there's no second endpoint or there aren't enough samples yet.
+        """
+        if not self.hedge_percentile or len(self.endpoints) < 2:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.min_latency_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile))
+        return max(latencies[index], self.min_hedge_seconds)
+
+    def _mark_down(self, endpoint, reason):
+        # Called with the lock held
+        endpoint.down_until = time.monotonic() + self.down_seconds
+        metrics.LLM_ENDPOINT_HEALTHY.labels(endpoint.url).set(0)
+        logger.warning("LLM endpoint %s out of rotation for %ss: %s", endpoint.url, self.down_seconds, reason)
+
+    def start(self):
+        """
+        Start the active health checks, once per process; a no-op if disabled
+        or there's only one endpoint to send calls to
+        """
+        if self.health_check_seconds <= 0 or len(self.endpoints) < 2 or self._pid == os.getpid():
+            return
+        with self._lock:
+            # Threads don't survive a fork, so each worker process starts its own
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='llm-health-check', daemon=True).start()
+            self._pid = os.getpid()
+
+    def check(self):
+        """
+        Probe every endpoint once. Any answer below 500 counts as up, since
+        backends don't share a health route.
+        """
+        for endpoint in self.endpoints:
+            try:
+                status = requests.get(endpoint.url + self.health_check_path,
+                                      timeout=min(5, self.health_check_seconds)).status_code
+                error = f"health check answered {status}" if status >= 500 else None
+            except requests.exceptions.RequestException as e:
+                error = f"health check failed: {e}"
+            with self._lock:
+                healthy = endpoint.healthy(time.monotonic())
+                if error and healthy:
+                    self._mark_down(endpoint, error)
+                elif not error and not healthy:
+                    endpoint.down_until = 0.0
+                    endpoint.failures = 0
+                    logger.info("LLM endpoint %s back in rotation", endpoint.url)
+                if not error:
+                    metrics.LLM_ENDPOINT_HEALTHY.labels(endpoint.url).set(1)
+
+    def _run(self):
+        while True:
+            time.sleep(self.health_check_seconds)
+            try:
+                self.check()
+            except Exception as e:
+                logger.warning("LLM health check failed: %s", e)
+
+    def snapshot(self):
+        """
+        Per-endpoint load and health, for the LLM health endpoint
+        """
+        now = time.monotonic()
+        hedge_after = self.hedge_delay()
+        with self._lock:
+            return {
+                "endpoints": [{
+                    "url": e.url,
+                    "healthy": e.healthy(now),
+                    "outstanding": e.outstanding,
+                    "consecutive_failures": e.failures,
+                    "requests": e.requests,
+                } for e in self.endpoints],
+                "hedge_after": hedge_after,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_endpoint_pool():
+    """
+    The process-wide endpoint pool shared by every MistralAPI instance,
+    rebuilt if MISTRAL_API_URL is changed at runtime (as the benchmarks do)
+    """
+    global _pool
+    pool = _pool
+    if pool is None or pool.source != settings.mistral_api_url:
+        with _pool_lock:
+            if _pool is None or _pool.source != settings.mistral_api_url:
+                _pool = EndpointPool.from_settings()
+            pool = _pool
+    pool.start()
+    return pool
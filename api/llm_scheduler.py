@@ -0,0 +1,106 @@
+import threading
+from collections import deque
+import metrics
+from deadline import DeadlineExceeded
+from settings import settings
+from slots import SlotGate
+
+# Highest priority first
+PRIORITIES = ('grading', 'ask', 'generation', 'batch')
+
+# Priority class used when a caller doesn't pick one
+PRIORITY_BY_CALL_SITE = {
+    'grading': 'grading',
+    'ask': 'ask',
+    'generation': 'generation',
+    'generation_staged': 'generation',
+    'pregrading': 'batch',
+}
+
+
+class LLMScheduler(SlotGate):
+    """
+    Process-wide gate every LLM call passes through.
+
+    At most `max_concurrency` calls reach the backend at once. When more are
+    waiting, slots are handed out by weighted fair queuing across the priority
+    classes: each class gets a share of the backend proportional to its weight
+    while it has work queued, so interactive grading keeps a short queue while
+    generation and batch regrading soak up whatever capacity is left, without
+    being starved outright.
+    """
+    def __init__(self, max_concurrency=32, weights=None):
+        super().__init__(max_concurrency)
+        self.weights = weights or settings.llm_priority_weights
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self._last_finish = {priority: 0.0 for priority in PRIORITIES}
+        self._virtual_time = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(max_concurrency=settings.llm_max_concurrency, weights=settings.llm_priority_weights)
+
+    def _enqueue(self, waiter):
+        # Start-time fair queuing: a call's virtual start is when its class's
+        # previous call finishes (or now, if the class was idle); each call
+        # costs 1/weight of virtual time
+        start = max(self._virtual_time, self._last_finish[waiter.key])
+        self._last_finish[waiter.key] = start + 1 / self.weights[waiter.key]
+        waiter.tag = start
+        self._queues[waiter.key].append(waiter)
+
+    def _dequeue(self):
+        heads = [(queue[0].tag, PRIORITIES.index(priority), priority)
+                 for priority, queue in self._queues.items() if queue]
+        if not heads:
+            return None
+        start, _, priority = min(heads)
+        self._virtual_time = start
+        return self._queues[priority].popleft()
+
+    def _remove(self, waiter):
+        queue = self._queues[waiter.key]
+        if waiter not in queue:
+            return False
+        queue.remove(waiter)
+        return True
+
+    def _on_timeout(self, waiter):
+        # Waits are only bounded by the request deadline
+        raise DeadlineExceeded("Request deadline exceeded while waiting for the LLM")
+
+    def _on_granted(self, priority, waited):
+        metrics.LLM_QUEUE_SECONDS.labels(priority).observe(waited)
+
+    def _publish(self):
+        metrics.LLM_IN_FLIGHT.set(self._in_flight)
+        for priority, queue in self._queues.items():
+            metrics.LLM_QUEUE_DEPTH.labels(priority).set(len(queue))
+
+    def snapshot(self):
+        """
+        Current load, for the LLM health endpoint
+        """
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_in_flight,
+                "queued": {priority: len(queue) for priority, queue in self._queues.items()},
+                "weights": dict(self.weights),
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler():
+    """
+    The process-wide scheduler shared by every MistralAPI instance
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler.from_settings()
+    return _scheduler
@@ -0,0 +1,149 @@
+import time
+from contextlib import contextmanager
+
+# Settings first: importing them loads .env, and prometheus_client picks its
+# single- or multi-process value store from PROMETHEUS_MULTIPROC_DIR when it
+# is imported, so a directory set only in .env would otherwise be missed
+from settings import settings
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# When PROMETHEUS_MULTIPROC_DIR is set (e.g. under gunicorn), prometheus_client
+# keeps every worker's values in files in that directory and render() merges
+# them, so any worker can answer a scrape for the whole server.
+MULTIPROCESS = bool(settings.prometheus_multiproc_dir)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 180, 300)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+HTTP_RESPONSE_BYTES = Histogram(
+    'http_response_size_bytes', 'HTTP response body size by route',
+    ['method', 'route'], buckets=SIZE_BUCKETS)
+
+DB_OPERATION_SECONDS = Histogram(
+    'mongodb_operation_duration_seconds', 'Database call latency by collection and operation',
+    ['collection', 'operation'], buckets=DB_BUCKETS)
+DB_OPERATION_ERRORS = Counter(
+    'mongodb_operation_errors_total', 'Database calls that raised',
+    ['collection', 'operation'])
+
+LLM_REQUEST_SECONDS = Histogram(
+    'llm_request_duration_seconds', 'MistralAPI.get_response latency by call site',
+    ['call_site', 'outcome'], buckets=LLM_BUCKETS)
+LLM_REQUEST_BYTES = Histogram(
+    'llm_request_size_bytes', 'Prompt plus instructions size sent to the LLM',
+    ['call_site'], buckets=SIZE_BUCKETS)
+LLM_RESPONSE_BYTES = Histogram(
+    'llm_response_size_bytes', 'LLM response body size',
+    ['call_site'], buckets=SIZE_BUCKETS)
+LLM_JSON_PARSE_FAILURES = Counter(
+    'llm_json_parse_failures_total', 'LLM replies that were not clean JSON',
+    ['call_site', 'outcome'])  # outcome: 'repaired' by extraction or 'failed'
+
+PROMPT_TOKENS = Histogram(
+    'llm_prompt_tokens', 'Estimated prompt plus instructions tokens by template and version',
+    ['template', 'version'], buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000))
+PROMPT_FIELD_TRUNCATIONS = Counter(
+    'llm_prompt_field_truncations_total', 'Prompt fields cut down to their token budget',
+    ['template', 'field'])
+
+LLM_ENDPOINT_REQUESTS = Counter(
+    'llm_endpoint_requests_total', 'LLM requests by backend endpoint',
+    ['endpoint', 'outcome'])  # outcome: 'ok' or 'error'
+LLM_ENDPOINT_HEALTHY = Gauge(
+    'llm_endpoint_healthy', 'Whether a backend endpoint is in rotation (1) or out after failures (0)',
+    ['endpoint'], multiprocess_mode='min')
+LLM_HEDGES = Counter(
+    'llm_hedged_requests_total', 'Slow LLM calls duplicated on a second endpoint',
+    ['winner'])  # 'hedge' if the duplicate answered first, else 'primary'
+
+LLM_BREAKER_STATE = Gauge(
+    'llm_circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half open, 2 open)',
+    multiprocess_mode='max')
+LLM_BREAKER_REJECTIONS = Counter(
+    'llm_circuit_breaker_rejections_total', 'LLM calls failed fast by the open breaker')
+
+LLM_IN_FLIGHT = Gauge(
+    'llm_in_flight', 'LLM calls currently holding a scheduler slot',
+    multiprocess_mode='livesum')
+LLM_QUEUE_DEPTH = Gauge(
+    'llm_queue_depth', 'LLM calls waiting for a scheduler slot, by priority class',
+    ['priority'], multiprocess_mode='livesum')
+LLM_QUEUE_SECONDS = Histogram(
+    'llm_queue_wait_seconds', 'Time an LLM call waited for a scheduler slot, by priority class',
+    ['priority'], buckets=LATENCY_BUCKETS)
+
+GENERATION_IN_FLIGHT = Gauge(
+    'generation_in_flight', 'AI test generations currently running',
+    multiprocess_mode='livesum')
+GENERATION_QUEUE_DEPTH = Gauge(
+    'generation_queue_depth', 'AI test generation requests waiting for a slot',
+    multiprocess_mode='livesum')
+GENERATION_QUEUE_WAIT_SECONDS = Histogram(
+    'generation_queue_wait_seconds', 'Time a generation request waited before it was admitted',
+    buckets=LATENCY_BUCKETS)
+GENERATION_REJECTIONS = Counter(
+    'generation_rejections_total', 'Generation requests turned away with 429',
+    ['reason'])  # reason: 'rate_limited', 'queue_full' or 'wait_timeout'
+
+PREGRADE_OUTCOMES = Counter(
+    'pregrade_outcomes_total', 'Background pre-grading of autosaved answers',
+    ['outcome'])  # 'graded', 'cached', 'stale', 'failed' or 'dropped' (queue full)
+PREGRADE_REUSE = Counter(
+    'pregrade_reuse_total', 'Paragraph answers at submit that had a matching pre-grade',
+    ['result'])  # 'hit' or 'miss'
+
+ATTEMPTS_EXPIRED = Counter(
+    'attempts_expired_total', 'In-progress attempts closed by the sweeper after their time limit',
+    ['outcome'])  # 'submitted', 'abandoned' (nothing saved), 'skipped' (claimed elsewhere) or 'failed'
+
+ATTEMPTS_ARCHIVED = Counter(
+    'attempts_archived_total', 'Completed attempts moved to the archive collection')
+
+INSERT_BATCH_SIZE = Histogram(
+    'insert_batch_size', 'Documents written per coalesced insert_many (exam-start surge mode)',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+BREAKER_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+@contextmanager
+def time_db(collection, operation):
+    """
+    Time one Database call, counting it as an error if it raises
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DB_OPERATION_ERRORS.labels(collection, operation).inc()
+        raise
+    finally:
+        DB_OPERATION_SECONDS.labels(collection, operation).observe(time.perf_counter() - start)
+
+
+def set_breaker_state(state):
+    LLM_BREAKER_STATE.set(BREAKER_STATE_VALUES.get(state, 0))
+
+
+def render():
+    """
+    Current metrics in the Prometheus text exposition format
+    """
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
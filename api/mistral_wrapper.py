@@ -1,20 +1,571 @@
 import os
+import gzip
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import httpx
 import requests
-from dotenv import load_dotenv
 import urllib.parse
 import json
+import deadline
+import metrics
+from deadline import DeadlineExceeded
+from llm_pool import get_endpoint_pool
+from llm_scheduler import PRIORITIES, PRIORITY_BY_CALL_SITE, get_llm_scheduler
+from settings import settings
+from tracing import current_span, get_logger, traced
+
+logger = get_logger('mistral')
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the LLM while the circuit breaker is open
+    """
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Mistral API is unavailable, retry in {int(retry_after) + 1} seconds")
+
+
+class CircuitBreaker:
+    """
+    Tracks LLM call outcomes over a rolling time window and stops sending
+    requests while the backend is failing or stalling.
+
+    closed    -> calls go through; opens when the failure or slow-call rate
+                 over the window crosses its threshold
+    open      -> calls fail fast with CircuitOpenError for `open_seconds`
+    half_open -> a limited number of probe calls go through; a success closes
+                 the breaker again, a failure re-opens it
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, window_seconds=120, min_calls=5, failure_rate_threshold=0.5,
+                 slow_call_seconds=60, slow_call_rate_threshold=0.8, open_seconds=30,
+                 half_open_max_calls=1):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._calls = deque()        # (finished_at, succeeded, latency)
+        self._in_flight = {}         # call token -> started_at
+        self._next_token = 0
+        self._half_open_calls = 0
+        self._times_opened = 0
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Build a breaker from the MISTRAL_BREAKER_* settings
+        """
+        return cls(
+            window_seconds=settings.breaker_window_seconds,
+            min_calls=settings.breaker_min_calls,
+            failure_rate_threshold=settings.breaker_failure_rate,
+            slow_call_seconds=settings.breaker_slow_call_seconds,
+            slow_call_rate_threshold=settings.breaker_slow_call_rate,
+            open_seconds=settings.breaker_open_seconds,
+        )
+
+    def before_call(self):
+        """
+        Reserve a call slot. Returns a token to pass to record_success or
+        record_failure, or raises CircuitOpenError if the call must not be made.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._state == self.CLOSED:
+                self._evaluate(now)
+
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    metrics.LLM_BREAKER_REJECTIONS.inc()
+                    raise CircuitOpenError(remaining)
+                self._state = self.HALF_OPEN
+                self._half_open_calls = 0
+                metrics.set_breaker_state(self.HALF_OPEN)
+
+            if self._state == self.HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    metrics.LLM_BREAKER_REJECTIONS.inc()
+                    raise CircuitOpenError(self.open_seconds)
+                self._half_open_calls += 1
+
+            self._next_token += 1
+            self._in_flight[self._next_token] = now
+            return self._next_token
+
+    def record_success(self, token):
+        self._record(token, True)
+
+    def record_failure(self, token):
+        self._record(token, False)
+
+    def record_cancelled(self, token):
+        """
+        Forget a call that was cut short by the caller rather than the backend
+        """
+        with self._lock:
+            self._in_flight.pop(token, None)
+            if self._state == self.HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+
+    def _record(self, token, succeeded):
+        now = time.monotonic()
+        with self._lock:
+            started_at = self._in_flight.pop(token, now)
+            latency = now - started_at
+            self._calls.append((now, succeeded, latency))
+
+            if self._state == self.HALF_OPEN:
+                if succeeded and latency < self.slow_call_seconds:
+                    self._close()
+                else:
+                    self._open(now)
+            elif self._state == self.CLOSED:
+                self._evaluate(now)
+
+    def _evaluate(self, now):
+        """
+        Open the breaker if the rolling window looks unhealthy. Calls still in
+        flight past the slow-call limit count as slow, so a stalled backend trips
+        the breaker before those requests finally time out.
+        """
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+        stalled = sum(1 for started_at in self._in_flight.values()
+                      if now - started_at >= self.slow_call_seconds)
+        total = len(self._calls) + stalled
+        if total < self.min_calls:
+            return
+
+        failures = sum(1 for _, succeeded, _ in self._calls if not succeeded)
+        slow = stalled + sum(1 for _, _, latency in self._calls if latency >= self.slow_call_seconds)
+
+        if failures / total >= self.failure_rate_threshold or slow / total >= self.slow_call_rate_threshold:
+            self._open(now)
+
+    def _open(self, now):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._times_opened += 1
+        metrics.set_breaker_state(self.OPEN)
+
+    def _close(self):
+        self._state = self.CLOSED
+        self._calls.clear()
+        self._half_open_calls = 0
+        metrics.set_breaker_state(self.CLOSED)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def snapshot(self):
+        """
+        Current breaker state and window statistics, for status endpoints and metrics
+        """
+        now = time.monotonic()
+        with self._lock:
+            calls = [call for call in self._calls if call[0] >= now - self.window_seconds]
+            failures = sum(1 for _, succeeded, _ in calls if not succeeded)
+            latencies = sorted(latency for _, _, latency in calls)
+            state = self._state
+            retry_after = 0
+            if state == self.OPEN:
+                retry_after = max(0.0, self._opened_at + self.open_seconds - now)
+                if retry_after == 0:
+                    state = self.HALF_OPEN
+            return {
+                "state": state,
+                "window_calls": len(calls),
+                "window_failures": failures,
+                "failure_rate": failures / len(calls) if calls else 0.0,
+                "p50_latency": latencies[len(latencies) // 2] if latencies else None,
+                "max_latency": latencies[-1] if latencies else None,
+                "in_flight": len(self._in_flight),
+                "times_opened": self._times_opened,
+                "retry_after": retry_after,
+            }
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_circuit_breaker():
+    """
+    The process-wide breaker shared by every MistralAPI instance
+    """
+    global _breaker
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker.from_settings()
+    return _breaker
+
+
+# One pooled HTTP session per process so LLM calls reuse connections
+_session = None
+_session_pid = None
+
+
+def _get_session():
+    """
+    The process's HTTP session, recreated after a fork so workers never share
+    pooled sockets with their parent
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = requests.Session()
+        _session_pid = os.getpid()
+    return _session
+
+
+# Threads that send hedged calls, so the caller can wait on two at once
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                # Room for a hedge per scheduler slot, plus losers still finishing
+                _executor = ThreadPoolExecutor(max_workers=4 * max(1, settings.llm_max_concurrency),
+                                               thread_name_prefix='llm-hedge')
+                _executor_pid = os.getpid()
+    return _executor
+
+# Transport picked by MISTRAL_TRANSPORT=auto, remembered per endpoint URL once
+# the endpoint has shown whether it accepts POST bodies
+_negotiated = {}
+_negotiated_lock = threading.Lock()
+
+# Status codes meaning "this backend doesn't take POST / gzip bodies"
+POST_UNSUPPORTED = (404, 405, 501)
+# Only 415: a 400 can be a real error in the request, which retrying
+# uncompressed would just repeat
+GZIP_UNSUPPORTED = (415,)
+
+DEFAULT_INSTRUCTIONS = "You are a respectful and helpful assistant. Respond with only the answer to the question in a few words of conversational English. Do not repeat the question."
+
 
 class MistralAPI:
-    def __init__(self, debug=False, timeout=180):  # Increased default timeout to 180 seconds
-        # Load environment variables
-        load_dotenv()
-        self.api_url = os.getenv("MISTRAL_API_URL")
+    TRANSPORTS = ('auto', 'post', 'get')
+    # Client library errors, told apart so deadline cuts aren't blamed on the backend
+    TIMEOUT_ERRORS = (requests.exceptions.Timeout,)
+    REQUEST_ERRORS = (requests.exceptions.RequestException,)
+    # Errors meaning the request never reached the endpoint, so another can take it
+    CONNECT_ERRORS = (requests.exceptions.ConnectionError,)
+    
+    def __init__(self, debug=False, timeout=180, breaker=None, transport=None, gzip_requests=None,
+                 call_site='ask', priority=None, scheduler=None, pool=None):  # Increased default timeout to 180 seconds
         self.debug = debug
         self.timeout = timeout  # Store timeout value
+        # Label for metrics: 'ask', 'generation', 'generation_staged' or 'grading'
+        self.call_site = call_site
+        # Instances are created per call site, so they share one breaker by default
+        self.breaker = breaker or get_circuit_breaker()
+        # Scheduler class: 'grading', 'ask', 'generation' or 'batch' (regrading);
+        # defaults from the call site
+        self.priority = priority or PRIORITY_BY_CALL_SITE.get(call_site, 'batch')
+        self.scheduler = scheduler or get_llm_scheduler()
+        # The backend endpoints from MISTRAL_API_URL, shared like the breaker
+        self.pool = pool or get_endpoint_pool()
+        
+        # 'post' sends the prompt as a JSON body, 'get' in the query string (legacy
+        # backends), 'auto' tries POST and drops back to GET if it is refused
+        self.transport = (transport or settings.mistral_transport).lower()
+        self.gzip_requests = settings.mistral_gzip_requests if gzip_requests is None else gzip_requests
+        self.gzip_min_bytes = settings.mistral_gzip_min_bytes
+        
+        if self.transport not in self.TRANSPORTS:
+            raise ValueError(f"MISTRAL_TRANSPORT must be one of {', '.join(self.TRANSPORTS)}")
+        if self.priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    
+    def circuit_state(self):
+        """
+        Snapshot of the circuit breaker guarding this API
+        """
+        return self.breaker.snapshot()
+    
+    def _transport(self, url):
+        if self.transport == 'auto':
+            return _negotiated.get(url, {}).get('transport', 'post')
+        return self.transport
+    
+    def _gzip_allowed(self, url):
+        return self.gzip_requests and _negotiated.get(url, {}).get('gzip', True)
+    
+    def _remember(self, url, **choices):
+        with _negotiated_lock:
+            _negotiated.setdefault(url, {}).update(choices)
+    
+    def _encode_post(self, url, prompt, instructions):
+        """
+        JSON body and headers for a POST, gzipped when large enough and allowed
+        """
+        body = json.dumps({"prompt": prompt, "instructions": instructions}).encode('utf-8')
+        compress = self._gzip_allowed(url) and len(body) >= self.gzip_min_bytes
+        return body, compress
+    
+    def _post_payload(self, body, compress):
+        headers = {"Content-Type": "application/json"}
+        if compress:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+    
+    def _get_url(self, endpoint_url, prompt, instructions):
+        # URL encode the prompt and instructions
+        encoded_prompt = urllib.parse.quote(prompt)
+        encoded_instructions = urllib.parse.quote(instructions)
+        
+        if self.debug:
+            logger.debug("Sending GET to: %s (%s encoded bytes)", endpoint_url, len(encoded_prompt) + len(encoded_instructions))
+        
+        return f"{endpoint_url}?prompt={encoded_prompt}&instructions={encoded_instructions}"
+    
+    def _fallback(self, url, response, compress):
+        """
+        What to retry with after the backend refused a request: 'plain' for an
+        uncompressed POST, 'get' for the query-string transport, or None
+        """
+        if compress and response.status_code in GZIP_UNSUPPORTED:
+            logger.info("Backend refused a gzip body (%s); sending uncompressed from now on", response.status_code)
+            self._remember(url, gzip=False)
+            return 'plain'
+        if self.transport == 'auto' and response.status_code in POST_UNSUPPORTED:
+            logger.info("Backend refused POST (%s); using GET from now on", response.status_code)
+            self._remember(url, transport='get')
+            return 'get'
+        return None
+    
+    def _send(self, prompt, instructions, timeout):
+        """
+        Send the call to the least busy endpoint. If it can't be reached the
+        call goes to another one; with hedging on, a call that runs slower
+        than usual is also sent to a second endpoint.
+        """
+        endpoint = self.pool.acquire()
+        tried = [endpoint]  # A failover must not go back to any of these
+        hedge_after = self.pool.hedge_delay()
+        started = time.monotonic()
+        try:
+            if hedge_after is not None and hedge_after < timeout:
+                return self._send_hedged(endpoint, prompt, instructions, timeout, hedge_after, tried)
+            return self._attempt(endpoint, prompt, instructions, timeout)
+        except self.CONNECT_ERRORS:
+            remaining = timeout - (time.monotonic() - started)
+            # Only take another endpoint when there's time to use it; an
+            # acquired endpoint must always go back through _attempt
+            other = self.pool.acquire(exclude=tried) if remaining > 0 else None
+            if other is None:
+                raise
+            logger.info("LLM endpoint %s unreachable; sending to %s", endpoint.url, other.url)
+            return self._attempt(other, prompt, instructions, remaining)
+    
+    def _send_hedged(self, endpoint, prompt, instructions, timeout, hedge_after, tried):
+        """
+        Send to `endpoint`, and if it hasn't answered after `hedge_after`
+        seconds, to a second endpoint too; the first good answer wins. The
+        other request is left to finish in the background. A connect error
+        is raised for _send to fail over, to an endpoint not in `tried`,
+        which gets the second endpoint added once it is used.
+        """
+        executor = _get_executor()
+        # Requests run in a copy of the caller's context, for its deadline and trace
+        primary = executor.submit(contextvars.copy_context().run, self._attempt, endpoint, prompt, instructions, timeout)
+        if wait([primary], timeout=hedge_after).done:
+            return primary.result()
+        
+        # The hedge needs a scheduler slot of its own, so it only goes out if
+        # one is free. The caller's slot is released when it returns, so this
+        # one is held until both requests are over, keeping whichever loses
+        # within LLM_MAX_CONCURRENCY while it finishes in the background.
+        slot = self.scheduler.try_slot(self.priority)
+        if slot is None:
+            return primary.result()
+        backup = self.pool.acquire(exclude=tried)
+        if backup is None:
+            self.scheduler.release_slot(slot)
+            return primary.result()
+        tried.append(backup)
+        hedge = executor.submit(contextvars.copy_context().run, self._attempt, backup, prompt, instructions,
+                                timeout - hedge_after)
+        _release_when_done(self.scheduler, slot, (primary, hedge))
+        
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = _winner(done, pending)
+            if winner is not None:
+                metrics.LLM_HEDGES.labels('hedge' if winner is hedge else 'primary').inc()
+                return winner.result()
+    
+    def _attempt(self, endpoint, prompt, instructions, timeout):
+        """
+        One request to `endpoint`, with its outcome reported to the pool
+        """
+        started = time.monotonic()
+        ok = None
+        try:
+            response = self._send_to(endpoint.url, prompt, instructions, timeout)
+            ok = response.status_code < 500
+            return response
+        except self.REQUEST_ERRORS:
+            ok = False
+            raise
+        finally:
+            self.pool.release(endpoint, ok, time.monotonic() - started)
+    
+    def _send_to(self, url, prompt, instructions, timeout):
+        """
+        Send one request to the endpoint at `url` over the configured
+        transport, falling back to a plainer one if the endpoint refuses it
+        """
+        endpoint_url = f"{url}/get_response"
+        
+        if self._transport(url) == 'get':
+            return self._send_get(endpoint_url, prompt, instructions, timeout)
+        
+        started = time.monotonic()
+        body, compress = self._encode_post(url, prompt, instructions)
+        response = self._send_post(endpoint_url, body, compress, timeout)
+        
+        # Retries share the call's timeout rather than each getting all of it
+        fallback = self._fallback(url, response, compress)
+        if fallback == 'plain':
+            left = timeout - (time.monotonic() - started)
+            if left <= 0:
+                return response
+            response = self._send_post(endpoint_url, body, False, left)
+            fallback = self._fallback(url, response, False)
+        if fallback == 'get':
+            left = timeout - (time.monotonic() - started)
+            if left <= 0:
+                return response
+            response = self._send_get(endpoint_url, prompt, instructions, left)
+        
+        return response
+    
+    def _send_post(self, endpoint_url, body, compress, timeout):
+        body, headers = self._post_payload(body, compress)
+        
+        if self.debug:
+            logger.debug("Sending POST to: %s (%s bytes%s)", endpoint_url, len(body), ', gzip' if compress else '')
+            logger.debug("Using timeout: %s seconds", timeout)
+        
+        return _get_session().post(endpoint_url, data=body, headers=headers, timeout=timeout)
+    
+    def _send_get(self, endpoint_url, prompt, instructions, timeout):
+        if self.debug:
+            logger.debug("Using timeout: %s seconds", timeout)
+        return _get_session().get(self._get_url(endpoint_url, prompt, instructions), timeout=timeout)
+    
+    def _record_queue_time(self, queued_at):
+        current_span().set(priority=self.priority, queue_ms=round((time.perf_counter() - queued_at) * 1000, 1))
+    
+    @contextmanager
+    def _guard(self, prompt, instructions):
+        """
+        Wrap one LLM call: deadline-clamped timeout, circuit breaker bookkeeping,
+        metrics and error translation. Yields the timeout to use for the call.
+        """
+        # Never wait longer than the request that is asking has left
+        timeout = deadline.clamp_timeout(self.timeout)
+        cut_by_deadline = timeout < self.timeout
+        
+        # Fail fast without touching the network while the backend is unhealthy
+        token = self.breaker.before_call()
+        
+        metrics.LLM_REQUEST_BYTES.labels(self.call_site).observe(len(prompt) + len(instructions))
+        started = time.perf_counter()
+        outcome = 'error'
+        
+        try:
+            yield timeout
+            outcome = 'ok'
+        except self.TIMEOUT_ERRORS as timeout_err:
+            if cut_by_deadline:
+                # Our budget ran out, which says nothing about the backend's health
+                self.breaker.record_cancelled(token)
+                outcome = 'deadline'
+                raise DeadlineExceeded()
+            self.breaker.record_failure(token)
+            outcome = 'timeout'
+            logger.warning("Request error: %s", timeout_err)
+            raise Exception(f"Error calling Mistral API: {str(timeout_err)}")
+        except self.REQUEST_ERRORS as req_err:
+            self.breaker.record_failure(token)
+            logger.warning("Request error: %s", req_err)
+            raise Exception(f"Error calling Mistral API: {str(req_err)}")
+        except asyncio.CancelledError:
+            # The awaiting task was cancelled (e.g. the client went away); not the backend's fault
+            self.breaker.record_cancelled(token)
+            outcome = 'cancelled'
+            raise
+        except Exception as e:
+            self.breaker.record_failure(token)
+            logger.warning("Unexpected error: %s", e)
+            raise Exception(f"Error calling Mistral API: {str(e)}")
+        finally:
+            metrics.LLM_REQUEST_SECONDS.labels(self.call_site, outcome).observe(time.perf_counter() - started)
+            current_span().set(call_site=self.call_site, outcome=outcome, timeout=round(timeout, 1),
+                               request_chars=len(prompt) + len(instructions))
         
-        if not self.api_url:
-            raise ValueError("MISTRAL_API_URL is not set in the .env file")
+        self.breaker.record_success(token)
     
+    def _decode(self, response):
+        """
+        The answer text from a successful response
+        """
+        metrics.LLM_RESPONSE_BYTES.labels(self.call_site).observe(len(response.content))
+        
+        # Try to parse as JSON first
+        try:
+            data = response.json()
+            
+            # Handle different response types
+            if isinstance(data, dict):
+                # If it's a dictionary, try to get the "response" field
+                return data.get("response", response.text)
+            elif isinstance(data, list):
+                # If it's a list (like in the AI test generation case), return it directly
+                return json.dumps(data)
+            else:
+                # For any other type, convert to string
+                return str(data)
+        except ValueError:
+            # If not JSON, return the raw text response
+            if self.debug:
+                logger.debug("Response is not in JSON format. Returning raw text response.")
+            return response.text
+    
+    @traced('llm.get_response')
     def get_response(self, prompt, instructions=None):
         """
         Send a prompt to the Mistral LLM API and get the response.
@@ -27,60 +578,230 @@ class MistralAPI:
             str: The response from the LLM
             
         Raises:
+            CircuitOpenError: If the circuit breaker is open and no request was made
+            DeadlineExceeded: If the current request ran out of time budget, including
+                while waiting for a scheduler slot
             Exception: If there's an error with the API request
         """
-        try:
-            # URL encode the prompt and instructions
-            encoded_prompt = urllib.parse.quote(prompt)
-            
-            # Set default instructions if none provided
-            if instructions is None:
-                instructions = "You are a respectful and helpful assistant. Respond with only the answer to the question in a few words of conversational English. Do not repeat the question."
-            
-            # URL encode instructions
-            encoded_instructions = urllib.parse.quote(instructions)
-            
-            # Construct the endpoint URL
-            endpoint_url = f"{self.api_url}/get_response?prompt={encoded_prompt}&instructions={encoded_instructions}"
-            
-            if self.debug:
-                print(f"Sending request to: {endpoint_url}")
-                print(f"Using timeout: {self.timeout} seconds")
+        # Set default instructions if none provided
+        if instructions is None:
+            instructions = DEFAULT_INSTRUCTIONS
+        
+        # Wait for a backend slot; higher priority classes get a bigger share
+        queued_at = time.perf_counter()
+        with self.scheduler.slot(self.priority):
+            self._record_queue_time(queued_at)
+            with self._guard(prompt, instructions) as timeout:
+                # Use the configured timeout (in seconds), shortened to the request deadline
+                response = self._send(prompt, instructions, timeout)
                 
-            # Use the configured timeout (in seconds)
-            response = requests.get(endpoint_url, timeout=self.timeout)
-            
-            if self.debug:
-                print(f"Status code: {response.status_code}")
-                print(f"Response content: {response.content[:200]}...")
+                if self.debug:
+                    logger.debug("Status code: %s", response.status_code)
+                    logger.debug("Response content: %s...", response.content[:200])
+                
+                response.raise_for_status()
+        
+        return self._decode(response)
+
+
+def _answered(future):
+    """
+    Whether a finished request got a response the endpoint didn't fail on
+    """
+    return future.exception() is None and future.result().status_code < 500
+
+
+def _release_when_done(scheduler, slot, futures):
+    """
+    Release a scheduler slot once every one of `futures` has finished
+    """
+    left = [len(futures)]
+    lock = threading.Lock()
+    
+    def finished(future):
+        with lock:
+            left[0] -= 1
+            last = left[0] == 0
+        if last:
+            scheduler.release_slot(slot)
+    
+    for future in futures:
+        future.add_done_callback(finished)
+
+
+def _winner(done, pending):
+    """
+    The hedged request whose outcome to use: any good answer among those just
+    finished, or, once nothing is left running, one of the failures. None
+    while the other request might still answer.
+    """
+    for future in done:
+        if _answered(future):
+            return future
+    return None if pending else next(iter(done))
+
+
+# One async HTTP client per process and event loop; it multiplexes every
+# in-flight LLM call of the async endpoints over a shared connection pool
+_async_client = None
+_async_client_owner = None
+
+
+def _get_async_client():
+    """
+    The process's async HTTP client, recreated after a fork or when used from
+    a different event loop
+    """
+    global _async_client, _async_client_owner
+    owner = (os.getpid(), id(asyncio.get_running_loop()))
+    if _async_client is None or _async_client_owner != owner:
+        limit = settings.mistral_async_max_connections or None
+        _async_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit))
+        _async_client_owner = owner
+    return _async_client
+
+
+async def close_async_client():
+    """
+    Close the async HTTP client on shutdown of the event loop that owns it
+    """
+    global _async_client, _async_client_owner
+    if _async_client is not None and _async_client_owner == (os.getpid(), id(asyncio.get_running_loop())):
+        await _async_client.aclose()
+    _async_client = None
+    _async_client_owner = None
+
+
+class AsyncMistralAPI(MistralAPI):
+    """
+    MistralAPI for asyncio code: the same transport negotiation, breaker,
+    deadline and metrics, but waiting on the backend without holding a thread
+    """
+    TIMEOUT_ERRORS = (httpx.TimeoutException,)
+    REQUEST_ERRORS = (httpx.HTTPError,)
+    CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+    
+    async def _send(self, prompt, instructions, timeout):
+        endpoint = self.pool.acquire()
+        tried = [endpoint]  # A failover must not go back to any of these
+        hedge_after = self.pool.hedge_delay()
+        started = time.monotonic()
+        try:
+            if hedge_after is not None and hedge_after < timeout:
+                return await self._send_hedged(endpoint, prompt, instructions, timeout, hedge_after, tried)
+            return await self._attempt(endpoint, prompt, instructions, timeout)
+        except self.CONNECT_ERRORS:
+            remaining = timeout - (time.monotonic() - started)
+            # Only take another endpoint when there's time to use it; an
+            # acquired endpoint must always go back through _attempt
+            other = self.pool.acquire(exclude=tried) if remaining > 0 else None
+            if other is None:
+                raise
+            logger.info("LLM endpoint %s unreachable; sending to %s", endpoint.url, other.url)
+            return await self._attempt(other, prompt, instructions, remaining)
+    
+    async def _send_hedged(self, endpoint, prompt, instructions, timeout, hedge_after, tried):
+        # Unlike the threaded version, the slower request is cancelled, so the
+        # hedge's scheduler slot is only held until this returns
+        primary = asyncio.ensure_future(self._attempt(endpoint, prompt, instructions, timeout))
+        pending = {primary}
+        slot = None
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return primary.result()
             
-            response.raise_for_status()
+            slot = self.scheduler.try_slot(self.priority)
+            backup = self.pool.acquire(exclude=tried) if slot is not None else None
+            if backup is None:
+                return await primary
+            tried.append(backup)
+            hedge = asyncio.ensure_future(self._attempt(backup, prompt, instructions, timeout - hedge_after))
             
-            # Try to parse as JSON first
-            try:
-                data = response.json()
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = _winner(done, pending)
+                if winner is not None:
+                    metrics.LLM_HEDGES.labels('hedge' if winner is hedge else 'primary').inc()
+                    return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if slot is not None:
+                self.scheduler.release_slot(slot)
+    
+    async def _attempt(self, endpoint, prompt, instructions, timeout):
+        started = time.monotonic()
+        ok = None
+        try:
+            response = await self._send_to(endpoint.url, prompt, instructions, timeout)
+            ok = response.status_code < 500
+            return response
+        except self.REQUEST_ERRORS:
+            ok = False
+            raise
+        finally:
+            self.pool.release(endpoint, ok, time.monotonic() - started)
+    
+    async def _send_to(self, url, prompt, instructions, timeout):
+        endpoint_url = f"{url}/get_response"
+        
+        if self._transport(url) == 'get':
+            return await self._send_get(endpoint_url, prompt, instructions, timeout)
+        
+        started = time.monotonic()
+        body, compress = self._encode_post(url, prompt, instructions)
+        response = await self._send_post(endpoint_url, body, compress, timeout)
+        
+        # Retries share the call's timeout rather than each getting all of it
+        fallback = self._fallback(url, response, compress)
+        if fallback == 'plain':
+            left = timeout - (time.monotonic() - started)
+            if left <= 0:
+                return response
+            response = await self._send_post(endpoint_url, body, False, left)
+            fallback = self._fallback(url, response, False)
+        if fallback == 'get':
+            left = timeout - (time.monotonic() - started)
+            if left <= 0:
+                return response
+            response = await self._send_get(endpoint_url, prompt, instructions, left)
+        
+        return response
+    
+    async def _send_post(self, endpoint_url, body, compress, timeout):
+        body, headers = self._post_payload(body, compress)
+        
+        if self.debug:
+            logger.debug("Sending POST to: %s (%s bytes%s)", endpoint_url, len(body), ', gzip' if compress else '')
+            logger.debug("Using timeout: %s seconds", timeout)
+        
+        return await _get_async_client().post(endpoint_url, content=body, headers=headers, timeout=timeout)
+    
+    async def _send_get(self, endpoint_url, prompt, instructions, timeout):
+        if self.debug:
+            logger.debug("Using timeout: %s seconds", timeout)
+        return await _get_async_client().get(self._get_url(endpoint_url, prompt, instructions), timeout=timeout)
+    
+    @traced('llm.get_response')
+    async def get_response(self, prompt, instructions=None):
+        """
+        Async version of MistralAPI.get_response, with the same errors
+        """
+        if instructions is None:
+            instructions = DEFAULT_INSTRUCTIONS
+        
+        queued_at = time.perf_counter()
+        async with self.scheduler.async_slot(self.priority):
+            self._record_queue_time(queued_at)
+            with self._guard(prompt, instructions) as timeout:
+                response = await self._send(prompt, instructions, timeout)
                 
-                # Handle different response types
-                if isinstance(data, dict):
-                    # If it's a dictionary, try to get the "response" field
-                    return data.get("response", response.text)
-                elif isinstance(data, list):
-                    # If it's a list (like in the AI test generation case), return it directly
-                    return json.dumps(data)
-                else:
-                    # For any other type, convert to string
-                    return str(data)
-            except ValueError:
-                # If not JSON, return the raw text response
                 if self.debug:
-                    print("Response is not in JSON format. Returning raw text response.")
-                return response.text
+                    logger.debug("Status code: %s", response.status_code)
+                    logger.debug("Response content: %s...", response.content[:200])
                 
-        except requests.exceptions.RequestException as req_err:
-            if self.debug:
-                print(f"Request error: {str(req_err)}")
-            raise Exception(f"Error calling Mistral API: {str(req_err)}")
-        except Exception as e:
-            if self.debug:
-                print(f"Unexpected error: {str(e)}")
-            raise Exception(f"Error calling Mistral API: {str(e)}")
+                response.raise_for_status()
+        
+        return self._decode(response)
@@ -1,11 +1,60 @@
-from datetime import datetime
+import os
+import re
+import json
+import time
+import zlib
+import uuid
+import random
+import hashlib
+from datetime import datetime, timedelta
+from batching import InsertBatcher
 from database import Database
+from mistral_wrapper import MistralAPI, CircuitOpenError
+import deadline
+import metrics
+import prompts
+from deadline import DeadlineExceeded
 from passlib.hash import pbkdf2_sha256
+import bson
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from settings import settings
+from tracing import get_logger, trace_class
 
+logger = get_logger('models')
+
+# Connects lazily on first use, separately in each worker process
 db = Database()
-db.connect()
 
+# Patterns for pulling JSON out of LLM replies and repairing common mistakes
+JSON_ARRAY_PATTERN = re.compile(r'\[\s*\{.*\}\s*\]', re.DOTALL)
+JSON_OBJECT_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+TRAILING_COMMA_OBJECT_PATTERN = re.compile(r',\s*}')
+TRAILING_COMMA_ARRAY_PATTERN = re.compile(r',\s*\]')
+UNQUOTED_KEY_PATTERN = re.compile(r'([{,]\s*)(\w+)(\s*:)')
+
+# Question bank matching: words of a title, minus ones that say nothing about its topic
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+TOPIC_STOPWORDS = frozenset((
+    'and', 'the', 'for', 'with', 'from', 'into', 'about', 'of', 'to', 'in', 'on',
+    'test', 'quiz', 'exam', 'questions', 'question', 'assessment', 'unit', 'chapter',
+    'part', 'introduction', 'intro', 'basics', 'basic', 'advanced', 'final', 'midterm',
+))
+
+# The aggregation $slice needs an element count; this stands for "to the end"
+MAX_ARRAY_SLICE = 2**31 - 1
+
+def lease_expiry(now, default_seconds):
+    """
+    When a lease taken now runs out. A lease past its expiry was abandoned (its
+    worker died or hung) and may be taken over. Nothing outlives its request
+    deadline, so that bounds the lease, with some slack for the final write.
+    """
+    left = deadline.remaining()
+    return now + timedelta(seconds=left + 30 if left is not None else default_seconds)
+
+
+@trace_class
 class User:
     @staticmethod
     def create(username, email, password, role, first_name="", last_name=""):
@@ -105,17 +154,15 @@ class User:
         """
         Get all pending teacher approvals
         """
-        teachers = db.find('users', {'role': 'teacher', 'is_approved': False})
-        for teacher in teachers:
-            teacher['_id'] = str(teacher['_id'])
-        return teachers
+        return db.find('users', {'role': 'teacher', 'is_approved': False})
 
 
+@trace_class
 class Test:
     @staticmethod
-    def create(title, description, created_by, questions, time_limit=60):
+    def new_document(title, description, created_by, questions, time_limit=60, generation_status=None):
         """
-        Create a new test
+        Build a test document ready to be inserted
         """
         test = {
             "title": title,
@@ -123,16 +170,30 @@ class Test:
             "created_by": created_by,  # user_id of teacher
             "questions": questions,
             "time_limit": time_limit,  # in minutes
+            "version": 1,  # bumped by every write, for optimistic concurrency
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow()
         }
         
+        # AI-generated tests cut short by the request deadline are marked 'partial'
+        if generation_status:
+            test["generation_status"] = generation_status
+        
+        return test
+    
+    @staticmethod
+    def create(title, description, created_by, questions, time_limit=60, generation_status=None):
+        """
+        Create a new test
+        """
+        test = Test.new_document(title, description, created_by, questions, time_limit, generation_status)
         result = db.insert_one('tests', test)
         test['_id'] = str(result.inserted_id)
         return test
         
     @staticmethod
-    def generate_ai_test(title, description, num_questions, question_types, subject_area=None, created_by=None, time_limit=60):
+    def generate_ai_test(title, description, num_questions, question_types, subject_area=None, created_by=None, time_limit=60, job=None,
+                         use_question_bank=True):
         """
         Generate a test using AI with Mistral
         
@@ -144,675 +205,2134 @@ class Test:
             subject_area (str): Optional subject area for context
             created_by (str): Teacher user ID
             time_limit (int): Test time limit in minutes
+            job (dict): Generation job to checkpoint into (and resume from); a new one if omitted
+            use_question_bank (bool): Start a new job with matching questions from the question bank
             
         Returns:
             dict: Generated test object
         """
-        from mistral_wrapper import MistralAPI
-        import json
-        import re
-        import time
+        if job is None:
+            job = GenerationJob.create(title, description, num_questions, question_types, subject_area, created_by, time_limit,
+                                       use_question_bank)
         
-        # For paragraph questions, use a staged approach generating one question at a time
-        # instead of all questions at once (which causes timeouts)
-        if 'paragraph' in question_types and not 'mcq' in question_types:
-            print(f"Using staged approach for {num_questions} paragraph questions")
+        if Test.generates_staged(question_types):
+            logger.debug("Using staged approach for %s paragraph questions", num_questions)
             return Test._generate_paragraph_questions_staged(
-                title, description, num_questions, subject_area, created_by, time_limit
+                title, description, num_questions, subject_area, created_by, time_limit, job
             )
+        
+        # Only ask for what the question bank (or an earlier run) didn't supply
+        counts = Test.missing_counts(num_questions, question_types, job['questions'])
+        remaining = sum(counts.values())
+        if remaining <= 0:
+            return GenerationJob.complete(job, job['questions'])
             
         # For MCQ questions or mixed types, use the standard approach
-        # Use a longer timeout for paragraph questions (they take longer to generate)
-        timeout = 300 if 'paragraph' in question_types else 180
-        mistral = MistralAPI(debug=True, timeout=timeout)
-        
-        # Construct prompt for test generation
-        context = f"Subject: {subject_area}" if subject_area else ""
-        
-        # Calculate distribution of question types
-        has_mcq = 'mcq' in question_types
-        has_paragraph = 'paragraph' in question_types
-        
-        # Define explicit question type requirements
-        question_type_instruction = ""
-        if has_mcq and not has_paragraph:
-            question_type_instruction = f"Generate EXACTLY {num_questions} multiple choice questions. DO NOT include any paragraph or essay questions. You MUST create {num_questions} questions, not more or less."
-        elif has_paragraph and not has_mcq:
-            question_type_instruction = f"""
-            Generate EXACTLY {num_questions} paragraph/essay questions. DO NOT include any multiple choice questions. 
-            You MUST create EXACTLY {num_questions} questions, not more or less.
-            Each paragraph question MUST include:
-            1. A detailed question text that requires an essay response
-            2. A comprehensive model answer (3-4 paragraphs) for grading
-            3. A list of 5-8 important keywords/concepts that should be included in a good answer
-            """
-        else:
-            # If both types are requested, distribute them evenly
-            mcq_count = num_questions // 2
-            para_count = num_questions - mcq_count
-            question_type_instruction = f"""
-            Generate EXACTLY {num_questions} questions with this specific distribution: 
-            - {mcq_count} multiple choice questions 
-            - {para_count} paragraph/essay questions
-            You MUST create exactly this number of questions with this exact distribution.
-            
-            For each paragraph question, include:
-            1. A detailed question text that requires an essay response
-            2. A comprehensive model answer (3-4 paragraphs) for grading
-            3. A list of 5-8 important keywords/concepts that should be included in a good answer
-            """
-        
-        prompt = f"""
-        Create a test on the topic: {title}
-        {context}
-        Description: {description}
-        
-        {question_type_instruction}
-        
-        For multiple choice questions, include:
-        1. The question text
-        2. Four possible answer options
-        3. The index of the correct answer (0-3)
-        
-        For paragraph questions, include:
-        1. The question text
-        2. A model answer that would receive full marks
-        3. A list of keywords/concepts that should be included in a good answer
-        
-        Format your response as a valid JSON array of questions with proper formatting.
-        Ensure all JSON is correctly formatted with no trailing commas or syntax errors.
-        """
-        
-        # Set instructions for AI to generate structured test data
-        instructions = """
-        You are a professional educator creating test content. Generate well-formed questions in valid JSON format.
-        Each question should have:
-        1. 'text' (string): The question text
-        2. 'type' (string): Either 'mcq' or 'paragraph'
-        3. For MCQ type:
-           - 'options' (array of strings): Four answer choices
-           - 'correct_answer' (number): Index (0-3) of correct option
-        4. For paragraph type:
-           - 'model_answer' (string): Example of a complete, correct answer
-           - 'keywords' (array of strings): Important concepts that should be included
-           - 'max_score' (number): Maximum points for the question (default: 10)
-        
-        IMPORTANT: Your response must be valid JSON with proper formatting. Double-check for syntax errors, especially:
-        - Make sure all strings are properly quoted with double quotes
-        - All properties and string values need to be enclosed in double quotes
-        - No trailing commas in arrays or objects
-        - Correct use of brackets and braces
-        """
+        mistral = MistralAPI(debug=True, timeout=Test.generation_timeout(question_types), call_site='generation')
+        
+        prompt, instructions = Test.generation_prompt(title, description, counts, subject_area)
         
         try:
             # Get AI-generated questions
             response = mistral.get_response(prompt, instructions)
+            generated = Test.generated_questions(response, question_types, remaining)
             
-            print(f"Raw API response (first 1000 chars): {response[:1000]}...")
-            
-            # Enhanced JSON parsing with more robust error handling
-            try:
-                # First, try to parse directly in case the response is already valid JSON
-                questions = json.loads(response)
-            except json.JSONDecodeError:
-                # If direct parsing fails, try extraction and fixing approaches
-                
-                # Try to extract JSON array if embedded in text
-                json_match = re.search(r'\[\s*\{.*\}\s*\]', response, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                    
-                    # Try to fix common JSON issues
-                    # Fix trailing commas
-                    json_str = re.sub(r',\s*}', '}', json_str)
-                    json_str = re.sub(r',\s*\]', ']', json_str)
-                    
-                    # Ensure properties are correctly quoted
-                    json_str = re.sub(r'([{,]\s*)(\w+)(\s*:)', r'\1"\2"\3', json_str)
-                    
-                    try:
-                        questions = json.loads(json_str)
-                    except json.JSONDecodeError as e:
-                        print(f"JSON parse error: {str(e)}")
-                        print(f"Attempted to parse: {json_str[:500]}...")
-                        raise Exception(f"Failed to parse the generated questions: {str(e)}")
-                else:
-                    raise Exception("No valid JSON found in the response")
-            
-            # Safeguard: If the questions is not a list, wrap it
-            if not isinstance(questions, list):
-                if isinstance(questions, dict):
-                    questions = [questions]
-                else:
-                    raise Exception("Generated questions are not in the expected format")
-            
-            print(f"Successfully parsed {len(questions)} questions")
-                    
-            # Post-processing to ensure only requested question types are included
-            filtered_questions = []
-            for question in questions:
-                q_type = question.get('type', 'mcq')
-                if q_type in question_types:
-                    # Ensure paragraph questions have keywords
-                    if q_type == 'paragraph' and 'keywords' not in question:
-                        # Extract keywords from model answer if not provided
-                        model_answer = question.get('model_answer', '')
-                        # Simple keyword extraction - split by spaces and take unique words over 5 chars
-                        words = set([word.strip('.,;:()[]{}"\'"').lower() for word in model_answer.split() if len(word) > 5])
-                        question['keywords'] = list(words)[:8]  # Take up to 8 keywords
-                    
-                    # Ensure paragraph questions have a max_score
-                    if q_type == 'paragraph' and 'max_score' not in question:
-                        question['max_score'] = 10
-                        
-                    filtered_questions.append(question)
-            
-            # If we've had to filter out unwanted question types, make sure we still have some questions
-            if not filtered_questions and questions:
-                filtered_questions = questions
-            
-            # Check if we have enough questions
-            if len(filtered_questions) < num_questions:
-                print(f"Warning: Generated only {len(filtered_questions)} questions but {num_questions} were requested")
-                
-                # If we specifically requested paragraph questions but got fewer than needed,
-                # try to generate additional questions to make up the difference
-                if has_paragraph and not has_mcq and len(filtered_questions) < num_questions:
-                    remaining = num_questions - len(filtered_questions)
-                    print(f"Attempting to generate {remaining} additional paragraph questions...")
-                    
-                    # Create additional paragraph questions manually
-                    for i in range(remaining):
-                        # Create a more specific prompt for a single paragraph question
-                        additional_prompt = f"""
-                        Create a detailed paragraph/essay question on the topic: {title}
-                        {context}
-                        Description: {description}
-                        
-                        Generate ONE well-formed question suitable for an advanced student exam.
-                        Include a comprehensive model answer (3-4 paragraphs) and a list of 5-8 important keywords.
-                        
-                        Format your response as a valid JSON object with proper formatting.
-                        """
-                        
-                        additional_instructions = """
-                        Generate a single paragraph question in valid JSON format with:
-                        {
-                          "text": "The detailed question text",
-                          "type": "paragraph",
-                          "model_answer": "A comprehensive model answer (3-4 paragraphs)",
-                          "keywords": ["keyword1", "keyword2", "keyword3", "keyword4", "keyword5"],
-                          "max_score": 10
-                        }
-                        """
-                        
-                        try:
-                            additional_response = mistral.get_response(additional_prompt, additional_instructions)
-                            
-                            # Parse the additional question
-                            try:
-                                # Try direct parsing first
-                                additional_question = json.loads(additional_response)
-                                
-                                # If we got a list with one item, use that item
-                                if isinstance(additional_question, list) and len(additional_question) > 0:
-                                    additional_question = additional_question[0]
-                                
-                                # Set type to paragraph if not already set
-                                additional_question['type'] = 'paragraph'
-                                
-                                # Add max_score if missing
-                                if 'max_score' not in additional_question:
-                                    additional_question['max_score'] = 10
-                                
-                                # Add to our filtered questions
-                                filtered_questions.append(additional_question)
-                                print(f"Successfully added additional paragraph question {i+1}/{remaining}")
-                                
-                            except json.JSONDecodeError:
-                                # Try to extract JSON object if embedded in text
-                                json_match = re.search(r'\{.*\}', additional_response, re.DOTALL)
-                                if json_match:
-                                    json_str = json_match.group(0)
-                                    # Fix common JSON formatting issues
-                                    json_str = re.sub(r',\s*}', '}', json_str)
-                                    json_str = re.sub(r'([{,]\s*)(\w+)(\s*:)', r'\1"\2"\3', json_str)
-                                    
-                                    additional_question = json.loads(json_str)
-                                    additional_question['type'] = 'paragraph'
-                                    if 'max_score' not in additional_question:
-                                        additional_question['max_score'] = 10
-                                    
-                                    filtered_questions.append(additional_question)
-                                    print(f"Successfully added additional paragraph question {i+1}/{remaining}")
-                                else:
-                                    print(f"Failed to parse additional question {i+1}: No valid JSON found")
-                        except Exception as e:
-                            print(f"Error generating additional question {i+1}: {str(e)}")
-                        
-                        # Brief pause between requests to avoid rate limiting
-                        time.sleep(1)
+            # Save the paid-for questions before anything else can go wrong
+            GenerationJob.checkpoint(job['_id'], generated)
+            GenerationJob.bank(job, generated)
             
             # Create test with generated questions
-            test = Test.create(
-                title=title,
-                description=description,
-                created_by=created_by,
-                questions=filtered_questions,
-                time_limit=time_limit
-            )
-            
-            return test
+            return GenerationJob.complete(job, job['questions'] + generated)
             
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            GenerationJob.fail(job['_id'], e)
+            raise
         except Exception as e:
-            print(f"Error generating AI test: {str(e)}")
-            raise Exception(f"Failed to generate AI test: {str(e)}")
-            
-    @staticmethod
-    def _generate_paragraph_questions_staged(title, description, num_questions, subject_area=None, created_by=None, time_limit=60):
-        """
-        Generate paragraph questions one by one to avoid timeouts
-        """
-        from mistral_wrapper import MistralAPI
-        import json
-        import re
-        import time
-        
-        print(f"Generating {num_questions} paragraph questions individually")
-        questions = []
-        mistral = MistralAPI(debug=True, timeout=120)  # Use a shorter timeout for individual questions
-        context = f"Subject: {subject_area}" if subject_area else ""
-        
-        for i in range(num_questions):
-            print(f"Generating paragraph question {i+1}/{num_questions}")
-            
-            # Generate a single paragraph question with a shorter, more focused prompt
-            prompt = f"""
-            Create ONE detailed paragraph/essay question about {title}.
-            {context}
-            Description: {description}
-            
-            Make this question #{i+1} in a series of {num_questions} questions on this topic.
-            
-            The question should:
-            1. Be well-formed and challenging
-            2. Require a well-structured essay response
-            3. Be suitable for an educational assessment
-            
-            Format as JSON with these fields:
-            - text: question text
-            - type: "paragraph" 
-            - model_answer: 3-4 paragraph comprehensive answer
-            - keywords: 5-8 key concepts
-            - max_score: 10
-            """
-            
-            instructions = """
-            You are creating ONE paragraph question in valid JSON format:
-            {
-              "text": "The detailed question text",
-              "type": "paragraph",
-              "model_answer": "A comprehensive model answer (3-4 paragraphs)",
-              "keywords": ["keyword1", "keyword2", "keyword3", "keyword4", "keyword5"],
-              "max_score": 10
-            }
-            
-            Ensure proper JSON formatting with double quotes, no trailing commas, and proper use of brackets.
-            """
-            
-            try:
-                response = mistral.get_response(prompt, instructions)
-                
-                try:
-                    # Try direct parsing first
-                    question = json.loads(response)
-                    
-                    # If we got a list with one item, use that item
-                    if isinstance(question, list) and len(question) > 0:
-                        question = question[0]
-                        
-                except json.JSONDecodeError:
-                    # Try to extract JSON object if embedded in text
-                    json_match = re.search(r'\{.*\}', response, re.DOTALL)
-                    if not json_match:
-                        print(f"Failed to find JSON in response for question {i+1}")
-                        print(f"Response preview: {response[:200]}...")
-                        # Create a simple fallback question
-                        question = {
-                            "text": f"Question #{i+1} about {title}. Please explain the key concepts related to this topic.",
-                            "type": "paragraph",
-                            "model_answer": f"This is a model answer about {title} covering key concepts in the field.",
-                            "keywords": ["concept", "theory", "analysis", "critical thinking", "evaluation"],
-                            "max_score": 10
-                        }
-                    else:
-                        json_str = json_match.group(0)
-                        # Fix common JSON formatting issues
-                        json_str = re.sub(r',\s*}', '}', json_str)
-                        json_str = re.sub(r'([{,]\s*)(\w+)(\s*:)', r'\1"\2"\3', json_str)
-                        
-                        question = json.loads(json_str)
-                
-                # Ensure type is set correctly
-                question['type'] = 'paragraph'
-                
-                # Ensure max_score is present
-                if 'max_score' not in question:
-                    question['max_score'] = 10
-                    
-                # Ensure keywords are present
-                if 'keywords' not in question or not question['keywords']:
-                    model_answer = question.get('model_answer', '')
-                    # Simple keyword extraction
-                    words = set([word.strip('.,;:()[]{}"\'"').lower() for word in model_answer.split() if len(word) > 5])
-                    question['keywords'] = list(words)[:8]  # Take up to 8 keywords
-                
-                questions.append(question)
-                print(f"Successfully generated question {i+1}")
-                
-            except Exception as e:
-                print(f"Error generating question {i+1}: {str(e)}")
-                # Create a simple fallback question in case of error
-                questions.append({
-                    "text": f"Question #{i+1} about {title}. Please explain the key concepts related to this topic.",
-                    "type": "paragraph",
-                    "model_answer": f"This is a model answer about {title} covering key concepts in the field.",
-                    "keywords": ["concept", "theory", "analysis", "critical thinking", "evaluation"],
-                    "max_score": 10
-                })
-                
-            # Brief pause between questions
-            time.sleep(1)
-        
-        # Create test with the generated questions
-        test = Test.create(
-            title=title,
-            description=description,
-            created_by=created_by,
-            questions=questions,
-            time_limit=time_limit
-        )
-        
-        return test
+            GenerationJob.fail(job['_id'], e)
+            raise Test.generation_failure(e)
     
     @staticmethod
-    def get_by_id(test_id):
+    def generates_staged(question_types):
         """
-        Get test by ID
+        Whether a test is generated one question per LLM call: paragraph-only
+        tests are, since asking for all their essays at once runs into timeouts
         """
-        try:
-            test = db.find_one('tests', {'_id': ObjectId(test_id)})
-            if test:
-                test['_id'] = str(test['_id'])
-            return test
-        except Exception:
-            return None
+        return 'paragraph' in question_types and 'mcq' not in question_types
     
     @staticmethod
-    def get_by_teacher(teacher_id):
+    def generation_timeout(question_types):
         """
-        Get all tests created by a teacher
+        LLM timeout for a whole-test generation; paragraph questions take longer
         """
-        tests = db.find('tests', {'created_by': teacher_id})
-        for test in tests:
-            test['_id'] = str(test['_id'])
-        return tests
+        return 300 if 'paragraph' in question_types else 180
     
     @staticmethod
-    def get_all_tests():
+    def generated_questions(response, question_types, count):
         """
-        Get all tests
+        Up to `count` questions of the requested types from a whole-test reply
+        
+        Raises:
+            Exception: If no usable JSON array can be recovered
         """
-        tests = db.find('tests', {})
-        for test in tests:
-            test['_id'] = str(test['_id'])
-        return tests
+        logger.debug("Raw API response (first 200 chars): %s...", response[:200])
+        generated = Test.parse_generated_questions(response, question_types)[:count]
+        if len(generated) < count:
+            logger.warning("Generated only %s questions but %s were requested", len(generated), count)
+        return generated
     
     @staticmethod
-    def update(test_id, update_data):
+    def generation_failure(error):
         """
-        Update test information
+        The error a whole-test generation reports for an unexpected failure
         """
-        update_data['updated_at'] = datetime.utcnow()
-        
-        # Don't allow updating certain fields
-        if 'created_by' in update_data:
-            del update_data['created_by']
-        if '_id' in update_data:
-            del update_data['_id']
-            
-        db.update_one('tests', {'_id': ObjectId(test_id)}, {'$set': update_data})
-        return Test.get_by_id(test_id)
+        logger.error("Error generating AI test: %s", error)
+        return Exception(f"Failed to generate AI test: {str(error)}")
     
     @staticmethod
-    def delete(test_id):
+    def type_counts(num_questions, question_types):
         """
-        Delete a test
+        How many questions of each type a test of `num_questions` gets: all of
+        the one type requested, or with both an even split
+        
+        Returns:
+            dict: question type -> count
         """
-        return db.delete_one('tests', {'_id': ObjectId(test_id)})
-
-
-class TestAttempt:
+        if 'mcq' in question_types and 'paragraph' in question_types:
+            return {'mcq': num_questions // 2, 'paragraph': num_questions - num_questions // 2}
+        if 'paragraph' in question_types:
+            return {'paragraph': num_questions}
+        return {'mcq': num_questions}
+    
     @staticmethod
-    def create(test_id, student_id, answers=None):
-        """
-        Create a new test attempt
+    def missing_counts(num_questions, question_types, questions):
         """
-        if answers is None:
-            answers = []
-            
-        attempt = {
-            "test_id": test_id,
-            "student_id": student_id,
-            "answers": answers,
-            "score": 0,
-            "question_scores": [],  # Individual question scores
-            "feedback": [],         # Feedback for each question
-            "is_completed": False,
-            "started_at": datetime.utcnow(),
-            "completed_at": None
-        }
+        How many questions of each type the test still needs on top of
+        `questions`, so that it ends up with the split type_counts gives
         
-        result = db.insert_one('test_attempts', attempt)
-        attempt['_id'] = str(result.inserted_id)
-        return attempt
+        Returns:
+            dict: question type -> count, adding up to what is left of `num_questions`
+        """
+        counts = Test.type_counts(num_questions, question_types)
+        for question in questions:
+            question_type = question.get('type', 'mcq')
+            if counts.get(question_type):
+                counts[question_type] -= 1
+        # Questions beyond their type's share still fill the test
+        excess = sum(counts.values()) - max(num_questions - len(questions), 0)
+        for question_type in counts:
+            cut = min(max(excess, 0), counts[question_type])
+            counts[question_type] -= cut
+            excess -= cut
+        return counts
     
     @staticmethod
-    def evaluate_paragraph_answer(student_answer, question):
+    def generation_prompt(title, description, counts, subject_area=None):
         """
-        Use Mistral API to evaluate a paragraph answer against a model answer
+        Prompt and instructions asking for a whole test in one LLM call
         
         Args:
-            student_answer (str): The student's written response
-            question (dict): Question object containing model answer and max score
-            
+            counts (dict): How many questions of each type to ask for, as
+                returned by missing_counts
+        
         Returns:
-            dict: Evaluation results with score and feedback
+            tuple: (prompt, instructions)
         """
-        from mistral_wrapper import MistralAPI
+        mcq_count = counts.get('mcq', 0)
+        para_count = counts.get('paragraph', 0)
+        num_questions = mcq_count + para_count
         
-        # Default max score is 10 if not specified
-        max_score = question.get('max_score', 10)
-        model_answer = question.get('model_answer', "")
-        keywords = question.get('keywords', [])
+        # Spell out exactly which question types to generate
+        if not para_count:
+            question_type_instruction = prompts.MCQ_ONLY.format(num_questions=num_questions)
+        elif not mcq_count:
+            question_type_instruction = prompts.PARAGRAPH_ONLY.format(num_questions=num_questions)
+        else:
+            question_type_instruction = prompts.MIXED.format(
+                num_questions=num_questions, mcq_count=mcq_count, para_count=para_count)
         
-        # If student didn't answer, return 0 with feedback
-        if not student_answer or student_answer.strip() == "":
-            return {
-                "score": 0,
-                "feedback": "No answer provided."
-            }
+        return prompts.GENERATION.render(
+            title=prompts.normalize(title),
+            context=f"Subject: {prompts.normalize(subject_area)}" if subject_area else "",
+            description=prompts.normalize(description),
+            question_types=question_type_instruction,
+        )
+    
+    @staticmethod
+    def parse_generated_questions(response, question_types):
+        """
+        Questions of the requested types from a whole-test LLM reply,
+        repairing common JSON mistakes
+        
+        Raises:
+            Exception: If no usable JSON array can be recovered
+        """
+        # Enhanced JSON parsing with more robust error handling
+        try:
+            # First, try to parse directly in case the response is already valid JSON
+            questions = json.loads(response)
+        except json.JSONDecodeError:
+            # If direct parsing fails, try extraction and fixing approaches
             
-        # Prepare evaluation prompt
-        prompt = f"""
-        Question: {question['text']}
+            # Try to extract JSON array if embedded in text
+            json_match = JSON_ARRAY_PATTERN.search(response)
+            if json_match:
+                json_str = json_match.group(0)
+                
+                # Try to fix common JSON issues
+                # Fix trailing commas
+                json_str = TRAILING_COMMA_OBJECT_PATTERN.sub('}', json_str)
+                json_str = TRAILING_COMMA_ARRAY_PATTERN.sub(']', json_str)
+                
+                # Ensure properties are correctly quoted
+                json_str = UNQUOTED_KEY_PATTERN.sub(r'\1"\2"\3', json_str)
+                
+                try:
+                    questions = json.loads(json_str)
+                    metrics.LLM_JSON_PARSE_FAILURES.labels('generation', 'repaired').inc()
+                except json.JSONDecodeError as e:
+                    metrics.LLM_JSON_PARSE_FAILURES.labels('generation', 'failed').inc()
+                    logger.warning("JSON parse error: %s; attempted to parse: %s...", e, json_str[:200])
+                    raise Exception(f"Failed to parse the generated questions: {str(e)}")
+            else:
+                metrics.LLM_JSON_PARSE_FAILURES.labels('generation', 'failed').inc()
+                raise Exception("No valid JSON found in the response")
         
-        Model answer: {model_answer}
+        # Safeguard: If the questions is not a list, wrap it
+        if not isinstance(questions, list):
+            if isinstance(questions, dict):
+                questions = [questions]
+            else:
+                raise Exception("Generated questions are not in the expected format")
         
-        Important keywords/concepts: {', '.join(keywords)}
+        logger.debug("Successfully parsed %s questions", len(questions))
+                
+        # Post-processing to ensure only requested question types are included
+        filtered_questions = []
+        for question in questions:
+            q_type = question.get('type', 'mcq')
+            if q_type in question_types:
+                # Ensure paragraph questions have keywords
+                if q_type == 'paragraph' and 'keywords' not in question:
+                    question['keywords'] = Test.extract_keywords(question.get('model_answer', ''))
+                
+                # Ensure paragraph questions have a max_score
+                if q_type == 'paragraph' and 'max_score' not in question:
+                    question['max_score'] = 10
+                    
+                filtered_questions.append(question)
         
-        Student answer: {student_answer}
+        # If we've had to filter out unwanted question types, make sure we still have some questions
+        if not filtered_questions and questions:
+            filtered_questions = questions
         
-        Evaluate the student's answer against the model answer and assign a score out of {max_score} points.
-        Consider:
-        1. Content accuracy and completeness
-        2. Inclusion of key concepts: {', '.join(keywords)}
-        3. Clarity of explanation
+        return filtered_questions
+    
+    @staticmethod
+    def extract_keywords(model_answer):
         """
-        
-        # Instructions for consistent evaluation format
-        instructions = f"""
-        You are an objective educator evaluating student responses. Provide your evaluation as a JSON object with these fields:
-        1. "score": A number from 0 to {max_score}
-        2. "feedback": Constructive feedback explaining the score with specific strengths and areas for improvement
-        
-        Example:
-        {{
-          "score": 7,
-          "feedback": "Good explanation of key concepts X and Y. Mentioned most key terms. Could improve by elaborating on Z and connecting concepts more clearly."
-        }}
+        Fallback keywords for a paragraph question: up to 8 unique words over 5 characters
         """
-        
-        try:
-            mistral = MistralAPI()
-            response = mistral.get_response(prompt, instructions)
+        words = set([word.strip('.,;:()[]{}"\'"').lower() for word in model_answer.split() if len(word) > 5])
+        return list(words)[:8]
             
-            # Extract JSON from response
-            import json
-            import re
+    @staticmethod
+    def _generate_paragraph_questions_staged(title, description, num_questions, subject_area, created_by, time_limit, job):
+        """
+        Generate paragraph questions one by one to avoid timeouts, checkpointing
+        each into the job and starting after the ones it already holds
+        """
+        questions = Test.staged_start(job, num_questions)
+        mistral = MistralAPI(debug=True, timeout=120, call_site='generation_staged')  # Use a shorter timeout for individual questions
+        
+        partial = False
+        for i in range(len(questions), num_questions):
+            # Stop once the request is out of time and keep what we have so far
+            if deadline.expired():
+                partial = True
+                break
             
-            # Try to extract JSON object if embedded in text
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                response = json_match.group(0)
-                
-            evaluation = json.loads(response)
+            logger.debug("Generating paragraph question %s/%s", i+1, num_questions)
             
-            # Ensure score is within bounds
-            score = min(max(float(evaluation.get("score", 0)), 0), max_score)
+            prompt, instructions = Test.staged_question_prompt(i, title, description, num_questions, subject_area)
             
-            return {
-                "score": score,
-                "feedback": evaluation.get("feedback", "")
-            }
+            try:
+                response = mistral.get_response(prompt, instructions)
+            except CircuitOpenError as e:
+                # Don't pad the test with placeholder questions while the LLM is down
+                GenerationJob.fail(job['_id'], e)
+                raise
+            except DeadlineExceeded:
+                partial = True
+                break
+            except Exception as e:
+                response = e
+            question, placeholder = Test.staged_question(response, i, title)
             
+            questions.append(question)
+            GenerationJob.checkpoint(job['_id'], [question])
+            if not placeholder:
+                GenerationJob.bank(job, [question])
+                
+            # Brief pause between questions
+            time.sleep(1)
+        
+        error = Test.staged_deadline_error(questions, num_questions) if partial else None
+        if error:
+            GenerationJob.fail(job['_id'], error)
+            raise error
+        
+        # Create test with the generated questions
+        return GenerationJob.complete(job, questions, partial)
+    
+    @staticmethod
+    def staged_start(job, num_questions):
+        """
+        The questions a staged generation starts from: those the job already holds
+        """
+        questions = list(job['questions'])
+        if questions:
+            logger.info("Resuming generation job %s at question %s/%s", job['_id'], len(questions) + 1, num_questions)
+        else:
+            logger.info("Generating %s paragraph questions individually", num_questions)
+        return questions
+    
+    @staticmethod
+    def staged_question(response, i, title):
+        """
+        Question `i` of a staged generation from the LLM's reply, or the
+        placeholder standing in for it when the call failed (`response` is
+        then the error) or the reply isn't a usable question
+        
+        Returns:
+            tuple: (question, whether it is a placeholder)
+        """
+        try:
+            if isinstance(response, Exception):
+                raise response
+            question = Test.parse_staged_question(response, i, title)
         except Exception as e:
-            print(f"Error evaluating paragraph answer: {str(e)}")
-            # Fallback evaluation if AI fails
-            return {
-                "score": 0,
-                "feedback": f"Error evaluating answer: {str(e)[:100]}"
-            }
+            logger.warning("Error generating question %s: %s", i+1, e)
+            return Test.fallback_question(i, title), True
+        logger.debug("Successfully generated question %s", i+1)
+        return question, False
     
     @staticmethod
-    def submit_with_evaluation(attempt_id, answers):
+    def staged_deadline_error(questions, num_questions):
         """
-        Submit a test attempt with AI evaluation of paragraph answers
+        After a staged generation ran out of time: the error to fail with if
+        it has nothing to show for it, otherwise None to keep what it has
+        """
+        logger.info("Request deadline reached after %s/%s questions", len(questions), num_questions)
+        if not questions:
+            return DeadlineExceeded("Request deadline exceeded before any question was generated")
+        return None
+    
+    @staticmethod
+    def staged_question_prompt(i, title, description, num_questions, subject_area=None):
+        """
+        Prompt and instructions for question `i` of a staged paragraph test
         
-        Args:
-            attempt_id (str): The test attempt ID
-            answers (list): List of student answers
-            
         Returns:
-            dict: Updated attempt with scores and feedback
+            tuple: (prompt, instructions)
         """
-        # Get attempt and test data
-        attempt = TestAttempt.get_by_id(attempt_id)
-        if not attempt:
-            raise Exception("Test attempt not found")
-            
-        test = Test.get_by_id(attempt['test_id'])
-        if not test:
-            raise Exception("Test not found")
-            
-        # Calculate scores and provide feedback
-        questions = test['questions']
-        question_scores = []
-        feedback = []
-        total_possible_points = 0
-        total_earned_points = 0
+        # One paragraph question at a time keeps each prompt and reply short
+        return prompts.STAGED_QUESTION.render(
+            title=prompts.normalize(title),
+            context=f"Subject: {prompts.normalize(subject_area)}" if subject_area else "",
+            description=prompts.normalize(description),
+            number=i + 1,
+            num_questions=num_questions,
+        )
+    
+    @staticmethod
+    def parse_staged_question(response, i, title):
+        """
+        One paragraph question from a staged-generation reply
         
-        for i, answer in enumerate(answers):
-            if i >= len(questions):
-                break  # Don't process if there are more answers than questions
-                
-            question = questions[i]
-            question_type = question.get('type', 'mcq')  # Default to mcq for backward compatibility
+        Raises:
+            json.JSONDecodeError: If the JSON found cannot be repaired
+            ValueError: If the reply holds no JSON, or no question text and
+                model answer
+        """
+        try:
+            # Try direct parsing first
+            question = json.loads(response)
             
-            if question_type == 'mcq':
-                # Score MCQ questions as before
-                correct = (answer == question.get('correct_answer'))
-                points = 1 if correct else 0
-                question_scores.append(points)
-                feedback.append("Correct" if correct else "Incorrect")
-                total_possible_points += 1
-                total_earned_points += points
+            # If we got a list with one item, use that item
+            if isinstance(question, list) and len(question) > 0:
+                question = question[0]
                 
-            elif question_type == 'paragraph':
-                # Use AI to evaluate paragraph answers
-                max_score = question.get('max_score', 10)
-                evaluation = TestAttempt.evaluate_paragraph_answer(answer, question)
+        except json.JSONDecodeError:
+            # Try to extract JSON object if embedded in text
+            json_match = JSON_OBJECT_PATTERN.search(response)
+            if not json_match:
+                metrics.LLM_JSON_PARSE_FAILURES.labels('generation_staged', 'failed').inc()
+                logger.warning("Failed to find JSON in response for question %s; response preview: %s...", i+1, response[:200])
+                raise ValueError("No JSON found in the response")
+            else:
+                json_str = json_match.group(0)
+                # Fix common JSON formatting issues
+                json_str = TRAILING_COMMA_OBJECT_PATTERN.sub('}', json_str)
+                json_str = UNQUOTED_KEY_PATTERN.sub(r'\1"\2"\3', json_str)
                 
-                question_scores.append(evaluation['score'])
-                feedback.append(evaluation['feedback'])
-                total_possible_points += max_score
-                total_earned_points += evaluation['score']
+                try:
+                    question = json.loads(json_str)
+                except json.JSONDecodeError:
+                    metrics.LLM_JSON_PARSE_FAILURES.labels('generation_staged', 'failed').inc()
+                    raise
+                metrics.LLM_JSON_PARSE_FAILURES.labels('generation_staged', 'repaired').inc()
         
-        # Calculate overall percentage score
-        overall_score = (total_earned_points / total_possible_points * 100) if total_possible_points > 0 else 0
+        if not isinstance(question, dict) or not all(
+                isinstance(question.get(field), str) and question[field].strip() for field in ('text', 'model_answer')):
+            raise ValueError("The response is not a question with text and a model answer")
         
-        # Update the attempt with scores and feedback
-        update_data = {
-            'answers': answers,
-            'question_scores': question_scores,
-            'feedback': feedback,
-            'score': overall_score,
-            'is_completed': True,
-            'completed_at': datetime.utcnow()
-        }
+        # Ensure type is set correctly
+        question['type'] = 'paragraph'
         
-        return TestAttempt.update(attempt_id, update_data)
+        # Ensure max_score is present
+        if 'max_score' not in question:
+            question['max_score'] = 10
+            
+        # Ensure keywords are present
+        if 'keywords' not in question or not question['keywords']:
+            question['keywords'] = Test.extract_keywords(question.get('model_answer', ''))
+        
+        return question
+    
+    @staticmethod
+    def fallback_question(i, title):
+        """
+        Placeholder paragraph question used when generating question `i` failed
+        """
+        return {
+            "text": f"Question #{i+1} about {title}. Please explain the key concepts related to this topic.",
+            "type": "paragraph",
+            "model_answer": f"This is a model answer about {title} covering key concepts in the field.",
+            "keywords": ["concept", "theory", "analysis", "critical thinking", "evaluation"],
+            "max_score": 10
+        }
     
     @staticmethod
-    def get_by_id(attempt_id):
+    def get_by_id(test_id):
         """
-        Get attempt by ID
+        Get test by ID
         """
         try:
-            attempt = db.find_one('test_attempts', {'_id': ObjectId(attempt_id)})
-            if attempt:
-                attempt['_id'] = str(attempt['_id'])
-            return attempt
+            return Test.from_document(db.find_one('tests', {'_id': ObjectId(test_id)}))
         except Exception:
             return None
     
     @staticmethod
-    def get_by_student_and_test(student_id, test_id):
+    def from_document(test):
         """
-        Get attempts by a student for a specific test
+        A test as read from MongoDB, in the shape the rest of the app expects
         """
-        attempts = db.find('test_attempts', {'student_id': student_id, 'test_id': test_id})
-        for attempt in attempts:
-            attempt['_id'] = str(attempt['_id'])
-        return attempts
+        if test:
+            test['_id'] = str(test['_id'])
+            # Tests created before versioning count as version 0
+            test.setdefault('version', 0)
+        return test
     
     @staticmethod
-    def get_by_student(student_id):
+    def without_answers(test):
         """
-        Get all attempts by a student
+        Copy of the test as students see it, without the correct answers
         """
-        attempts = db.find('test_attempts', {'student_id': student_id})
-        for attempt in attempts:
-            attempt['_id'] = str(attempt['_id'])
-        return attempts
+        questions = [{key: value for key, value in question.items() if key != 'correct_answer'}
+                     for question in test.get('questions', [])]
+        return dict(test, questions=questions)
     
     @staticmethod
-    def update(attempt_id, update_data):
+    def schedule_exam(test_id, starts_at, surge_until):
         """
-        Update attempt information
+        Record when the test is sat as an exam, so it is cached ahead of the
+        start and attempt inserts are coalesced until `surge_until`.
+        Returns False if the test doesn't exist.
         """
-        if 'is_completed' in update_data and update_data['is_completed']:
-            update_data['completed_at'] = datetime.utcnow()
+        try:
+            query = {'_id': ObjectId(test_id)}
+        except Exception:
+            return False
+        result = db.update_one('tests', query, {'$set': {
+            'exam_starts_at': starts_at,
+            'surge_until': surge_until
+        }})
+        return result.matched_count > 0
+    
+    _indexed_pid = None
+    
+    @staticmethod
+    def find_surging(now, horizon):
+        """
+        Tests whose exam starts before `horizon` and whose surge hasn't ended by `now`
+        """
+        if Test._indexed_pid != os.getpid():
+            db.create_index('tests', [('surge_until', 1)], sparse=True)
+            Test._indexed_pid = os.getpid()
+        return db.find('tests', {'exam_starts_at': {'$lte': horizon}, 'surge_until': {'$gt': now}})
+    
+    @staticmethod
+    def current_version(test_id):
+        """
+        The test's version, read on its own; None if the test doesn't exist
+        """
+        try:
+            test = db.find_one('tests', {'_id': ObjectId(test_id)}, {'version': 1})
+        except Exception:
+            return None
+        return None if test is None else test.get('version', 0)
+    
+    @staticmethod
+    def questions_at(test_id, start, count):
+        """
+        The version of a test and up to `count` of its questions from index
+        `start`, without loading the others
+        
+        Returns:
+            tuple: (version, questions), or None if the test doesn't exist
+        """
+        try:
+            test = db.find_one('tests', {'_id': ObjectId(test_id)},
+                               {'version': 1, 'questions': {'$slice': [start, count]}})
+        except Exception:
+            return None
+        if test is None:
+            return None
+        return test.get('version', 0), test.get('questions', [])
+    
+    @staticmethod
+    def question_outline(test_id):
+        """
+        The version of a test and the type and options of each question,
+        without loading the rest of the questions
+        
+        Returns:
+            tuple: (version, questions), or None if the test doesn't exist
+        """
+        try:
+            test = db.find_one('tests', {'_id': ObjectId(test_id)},
+                               {'version': 1, 'questions.type': 1, 'questions.options': 1})
+        except Exception:
+            return None
+        if test is None:
+            return None
+        return test.get('version', 0), test.get('questions', [])
+    
+    @staticmethod
+    def get_by_teacher(teacher_id):
+        """
+        Get all tests created by a teacher
+        """
+        return db.find('tests', {'created_by': teacher_id})
+    
+    @staticmethod
+    def get_all_tests():
+        """
+        Get all tests
+        """
+        return db.find('tests', {})
+    
+    @staticmethod
+    def update(test_id, update_data, version=None):
+        """
+        Update test information
+        
+        Args:
+            version (int): If given, only update the test if it is still at this version
+        
+        Raises:
+            TestVersionConflict: The test changed since `version`
+        """
+        update_data = Test.updatable(update_data)
+        if version is None:
+            db.update_one('tests', {'_id': ObjectId(test_id)}, Test.versioned({'$set': update_data}))
+        elif Test.write(test_id, version, {'$set': update_data}) is None:
+            return None
+        return Test.get_by_id(test_id)
+    
+    @staticmethod
+    def updatable(update_data):
+        """
+        `update_data` without the fields an update may not change
+        """
+        for field in ('created_by', '_id', 'version'):
+            update_data.pop(field, None)
+        return update_data
+    
+    @staticmethod
+    def version_query(test_id, version):
+        """
+        Matches the test only while it is at `version`
+        """
+        if version:
+            return {'_id': ObjectId(test_id), 'version': version}
+        # Version 0: a test from before versioning, which has no version field
+        return {'_id': ObjectId(test_id), 'version': {'$in': [0, None]}}
+    
+    @staticmethod
+    def versioned(update):
+        """
+        Add the version bump and updated_at to an update document, or as a
+        last stage to an update pipeline
+        """
+        if isinstance(update, list):
+            return update + [{'$set': {
+                'updated_at': datetime.utcnow(),
+                'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}
+            }}]
+        update = dict(update)
+        update['$set'] = {**update.get('$set', {}), 'updated_at': datetime.utcnow()}
+        update['$inc'] = {**update.get('$inc', {}), 'version': 1}
+        return update
+    
+    @staticmethod
+    def write(test_id, version, update):
+        """
+        Apply `update` if the test is still at `version`
+        
+        Returns:
+            int: The test's new version, or None if the test doesn't exist
+        
+        Raises:
+            TestVersionConflict: The test changed since `version`
+        """
+        result = db.update_one('tests', Test.version_query(test_id, version), Test.versioned(update))
+        if result.matched_count:
+            return version + 1
+        current = db.find_one('tests', {'_id': ObjectId(test_id)}, {'version': 1})
+        if current is None:
+            return None
+        raise TestVersionConflict(current.get('version', 0))
+    
+    @staticmethod
+    def add_question(test_id, version, question, position=None):
+        """
+        Insert one question, at the end or before index `position`
+        """
+        if position is None:
+            push = {'questions': question}
+        else:
+            push = {'questions': {'$each': [question], '$position': position}}
+        return Test.write(test_id, version, {'$push': push})
+    
+    @staticmethod
+    def update_question(test_id, version, index, changes):
+        """
+        Set (or, for None values, remove) fields of the question at `index`,
+        leaving the rest of the test untouched
+        """
+        update = {}
+        for field, value in changes.items():
+            path = f'questions.{index}.{field}'
+            if value is None:
+                update.setdefault('$unset', {})[path] = ''
+            else:
+                update.setdefault('$set', {})[path] = value
+        return Test.write(test_id, version, update)
+    
+    @staticmethod
+    def delete_question(test_id, version, index):
+        """
+        Remove the question at `index`, in one update that joins the questions
+        before and after it on the server; `index` must exist at `version`
+        """
+        # Not $pull: it takes the question as a query and would also remove
+        # every other question it matches. Slicing by position doesn't send
+        # the rest of the questions back over the wire either.
+        parts = [{'$slice': ['$questions', index + 1, MAX_ARRAY_SLICE]}]
+        if index:
+            parts.insert(0, {'$slice': ['$questions', index]})
+        return Test.write(test_id, version, [{'$set': {'questions': {'$concatArrays': parts}}}])
+    
+    @staticmethod
+    def reorder_questions(test_id, version, questions, order):
+        """
+        Put the questions in the given order: order[i] is the current index of
+        the question that becomes question i
+        """
+        return Test.write(test_id, version, {'$set': {'questions': [questions[i] for i in order]}})
+    
+    @staticmethod
+    def delete(test_id):
+        """
+        Delete a test
+        """
+        return db.delete_one('tests', {'_id': ObjectId(test_id)})
+
+
+class TestVersionConflict(Exception):
+    """
+    Raised when a versioned write finds the test was changed by someone else
+    """
+    def __init__(self, current_version):
+        self.current_version = current_version
+        super().__init__("The test was changed by someone else; reload it and try again")
+
+
+class TestNotFound(Exception):
+    """
+    Raised when an attempt's test no longer exists
+    """
+    def __init__(self):
+        super().__init__("Test not found")
+
+
+class AttemptOutdated(Exception):
+    """
+    Raised when the test was changed after an attempt was started, so the
+    attempt's answers no longer line up with its questions
+    """
+    def __init__(self):
+        super().__init__("This test was changed after the attempt started; start it again")
+
+
+class GenerationJobBusy(Exception):
+    """
+    Raised when a generation job can't be resumed because another run holds it
+    """
+
+
+@trace_class
+class GenerationJob:
+    """
+    A persisted AI test generation. Parsed questions are checkpointed as they
+    arrive, so a generation cut short by a crash, an error or the request
+    deadline can be resumed and only pays for the questions still missing.
+    
+    status: 'running', 'failed' (resumable, no test yet), 'partial' (resumable;
+    a test holding the questions so far exists) or 'completed'
+    """
+    RESUMABLE = ('failed', 'partial')
+    # How long a run may hold a job when no request deadline applies
+    DEFAULT_LEASE_SECONDS = 930
+    
+    @staticmethod
+    def new_document(title, description, num_questions, question_types, subject_area=None, created_by=None, time_limit=60,
+                     bank_questions=()):
+        """
+        Build a generation job document ready to be inserted, starting with
+        any questions drawn from the question bank
+        """
+        now = datetime.utcnow()
+        return {
+            "title": title,
+            "description": description,
+            "num_questions": num_questions,
+            "question_types": question_types,
+            "subject_area": subject_area,
+            "created_by": created_by,
+            "time_limit": time_limit,
+            "status": "running",
+            "questions": list(bank_questions),  # then checkpointed as each one is parsed
+            "from_bank": len(bank_questions),
+            "test_id": None,
+            "error": None,
+            "runs": 1,
+            "lease_expires_at": lease_expiry(now, GenerationJob.DEFAULT_LEASE_SECONDS),
+            "created_at": now,
+            "updated_at": now
+        }
+    
+    @staticmethod
+    def create(title, description, num_questions, question_types, subject_area=None, created_by=None, time_limit=60,
+               use_question_bank=True):
+        """
+        Create a new generation job, already marked as running
+        """
+        bank_questions = []
+        if use_question_bank and settings.question_bank_enabled:
+            bank_questions = QuestionBank.draw(subject_area, title, Test.type_counts(num_questions, question_types), created_by)
+        job = GenerationJob.new_document(title, description, num_questions, question_types, subject_area, created_by, time_limit,
+                                         bank_questions)
+        result = db.insert_one('generation_jobs', job)
+        job['_id'] = str(result.inserted_id)
+        return job
+    
+    @staticmethod
+    def get_by_id(job_id):
+        """
+        Get generation job by ID
+        """
+        try:
+            job = db.find_one('generation_jobs', {'_id': ObjectId(job_id)})
+            if job:
+                job['_id'] = str(job['_id'])
+            return job
+        except Exception:
+            return None
+    
+    @staticmethod
+    def claim_query(job_id, now):
+        """
+        Matches the job only while it may be resumed: failed, partial, or
+        running with an expired lease
+        """
+        return {
+            '_id': ObjectId(job_id),
+            '$or': [
+                {'status': {'$in': list(GenerationJob.RESUMABLE)}},
+                {'status': 'running', 'lease_expires_at': {'$lt': now}}
+            ]
+        }
+    
+    @staticmethod
+    def claim_update(now):
+        return {
+            '$set': {
+                'status': 'running',
+                'error': None,
+                'lease_expires_at': lease_expiry(now, GenerationJob.DEFAULT_LEASE_SECONDS),
+                'updated_at': now
+            },
+            '$inc': {'runs': 1}
+        }
+    
+    @staticmethod
+    def claim(job_id):
+        """
+        Take over a resumable job for this run. Atomic, so two resume requests
+        can't both run it.
+        
+        Returns:
+            dict: The claimed job, or None if it is not resumable right now
+        """
+        now = datetime.utcnow()
+        try:
+            query = GenerationJob.claim_query(job_id, now)
+        except Exception:
+            return None
+        result = db.update_one('generation_jobs', query, GenerationJob.claim_update(now))
+        if result.modified_count != 1:
+            return None
+        return GenerationJob.get_by_id(job_id)
+    
+    @staticmethod
+    def checkpoint(job_id, questions):
+        """
+        Append newly parsed questions to the job
+        """
+        db.update_one('generation_jobs', {'_id': ObjectId(job_id)}, GenerationJob.checkpoint_update(questions))
+    
+    @staticmethod
+    def checkpoint_update(questions):
+        return {
+            '$push': {'questions': {'$each': questions}},
+            '$set': {'updated_at': datetime.utcnow()}
+        }
+    
+    @staticmethod
+    def fail(job_id, error):
+        """
+        Mark a run as failed; its checkpointed questions are kept for a resume
+        """
+        db.update_one('generation_jobs', {'_id': ObjectId(job_id)}, GenerationJob.fail_update(error))
+    
+    @staticmethod
+    def fail_update(error):
+        return {'$set': {
+            'status': 'failed',
+            'error': str(error) or type(error).__name__,
+            'updated_at': datetime.utcnow()
+        }}
+    
+    @staticmethod
+    def test_update(questions, partial):
+        """
+        Fields to $set on the test of a resumed job that already has one
+        """
+        return {'questions': questions, 'generation_status': 'partial' if partial else 'complete'}
+    
+    @staticmethod
+    def finish_update(test_id, partial):
+        """
+        Fields to $set on the job once its test exists
+        """
+        return {'$set': {
+            'status': 'partial' if partial else 'completed',
+            'test_id': test_id,
+            'error': None,
+            'updated_at': datetime.utcnow()
+        }}
+    
+    @staticmethod
+    def complete(job, questions, partial=False):
+        """
+        Turn the job's questions into a Test, or fill in the test an earlier
+        partial run created, and record the outcome on the job
+        
+        Returns:
+            dict: The test
+        """
+        test = None
+        if job.get('test_id'):
+            test = Test.update(job['test_id'], GenerationJob.test_update(questions, partial))
+        if test is None:
+            test = Test.create(**GenerationJob.new_test(job, questions, partial))
+        db.update_one('generation_jobs', {'_id': ObjectId(job['_id'])}, GenerationJob.finish_update(test['_id'], partial))
+        try:
+            QuestionBank.mark_used(questions, job['created_by'])
+        except Exception as e:
+            logger.warning("Could not mark bank questions as used: %s", e)
+        return test
+    
+    @staticmethod
+    def new_test(job, questions, partial):
+        """
+        Test.create arguments for the test a job's questions become
+        """
+        return {
+            'title': job['title'],
+            'description': job['description'],
+            'created_by': job['created_by'],
+            'questions': questions,
+            'time_limit': job['time_limit'],
+            'generation_status': 'partial' if partial else None
+        }
+    
+    @staticmethod
+    def bank(job, questions):
+        """
+        Offer freshly generated questions to the question bank; a bank failure
+        never fails the generation
+        """
+        try:
+            QuestionBank.add(*GenerationJob.bank_args(job, questions))
+        except Exception as e:
+            logger.warning("Could not add generated questions to the question bank: %s", e)
+    
+    @staticmethod
+    def bank_args(job, questions):
+        """
+        QuestionBank.add arguments for a job's generated questions: only
+        those with everything a test needs, so half-parsed output isn't shared
+        """
+        return ([q for q in questions if QuestionBank.complete(q)],
+                job['subject_area'], job['title'], job['created_by'], 'ai')
+    
+    @staticmethod
+    def run_args(job):
+        """
+        generate_ai_test arguments that continue a job
+        """
+        return {
+            'title': job['title'],
+            'description': job['description'],
+            'num_questions': job['num_questions'],
+            'question_types': job['question_types'],
+            'subject_area': job['subject_area'],
+            'created_by': job['created_by'],
+            'time_limit': job['time_limit'],
+            'job': job
+        }
+    
+    @staticmethod
+    def run(job):
+        """
+        Generate the job's test, starting after any checkpointed questions
+        """
+        return Test.generate_ai_test(**GenerationJob.run_args(job))
+    
+    @staticmethod
+    def summary(job):
+        """
+        The job as shown by the status endpoint: progress rather than question bodies
+        """
+        summary = {key: value for key, value in job.items() if key != 'questions'}
+        summary['questions_done'] = len(job.get('questions', []))
+        summary['resumable'] = job['status'] in GenerationJob.RESUMABLE or (
+            job['status'] == 'running' and job['lease_expires_at'] < datetime.utcnow())
+        return summary
+
+
+@trace_class
+class QuestionBank:
+    """
+    Questions from every generated and hand-written test, indexed by subject,
+    topic terms and type, so a new generation on a topic colleagues already
+    covered can reuse their questions instead of asking the LLM again.
+    
+    Questions are deduplicated by a hash of their type and normalized text.
+    `used_by` lists the teachers whose tests already hold a question; those
+    teachers are not offered it again.
+    """
+    COLLECTION = 'questions'
+    # (keys, options) of each index
+    INDEXES = (
+        ([('content_hash', 1)], {'unique': True}),
+        ([('subject', 1), ('type', 1), ('topic_terms', 1)], {}),
+    )
+    # Fields of a bank entry that matching needs
+    CANDIDATE_FIELDS = {'question': 1, 'topic_terms': 1, 'used_by': 1, 'content_hash': 1}
+    
+    _indexed_pid = None
+    
+    @staticmethod
+    def ensure_indexes():
+        """
+        Create the bank's indexes, once per process
+        """
+        if QuestionBank._indexed_pid == os.getpid():
+            return
+        for keys, options in QuestionBank.INDEXES:
+            db.create_index(QuestionBank.COLLECTION, keys, **options)
+        QuestionBank._indexed_pid = os.getpid()
+    
+    @staticmethod
+    def topic_terms(text):
+        """
+        Normalized, order-free terms of a title: lowercase words without
+        stopwords, with regular English plurals made singular
+        """
+        terms = set()
+        for word in WORD_PATTERN.findall((text or '').lower()):
+            if len(word) < 3 or word in TOPIC_STOPWORDS:
+                continue
+            if len(word) > 4:
+                if word.endswith('ies'):
+                    word = word[:-3] + 'y'
+                elif word.endswith(('sses', 'ches', 'shes', 'xes')):
+                    word = word[:-2]
+                elif word.endswith('s') and not word.endswith(('ss', 'is', 'us')):
+                    word = word[:-1]
+            terms.add(word)
+        return sorted(terms)
+    
+    @staticmethod
+    def normalize_subject(subject_area):
+        return ' '.join(subject_area.lower().split()) if subject_area else None
+    
+    @staticmethod
+    def content_hash(question):
+        """
+        Identity of a question for duplicate detection: its type and its text,
+        ignoring case, punctuation and spacing
+        """
+        text = ' '.join(WORD_PATTERN.findall(str(question.get('text', '')).lower()))
+        if not text:
+            return None
+        return hashlib.sha256(f"{question.get('type', 'mcq')}:{text}".encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def complete(question):
+        """
+        Whether a generated question has everything a test needs from it, so
+        that half-parsed LLM output isn't offered to other teachers
+        """
+        if not isinstance(question, dict) or not str(question.get('text') or '').strip():
+            return False
+        if question.get('type', 'mcq') == 'paragraph':
+            return bool(str(question.get('model_answer') or '').strip())
+        options = question.get('options')
+        answer = question.get('correct_answer')
+        return (isinstance(options, list) and len(options) >= 2
+                and isinstance(answer, int) and not isinstance(answer, bool) and 0 <= answer < len(options))
+    
+    @staticmethod
+    def upsert(question, subject_area, title, created_by, source):
+        """
+        (query, update) that adds a question to the bank unless an identical
+        one is already there; None for questions without text
+        """
+        content_hash = QuestionBank.content_hash(question)
+        if content_hash is None:
+            return None
+        return {'content_hash': content_hash}, {'$setOnInsert': {
+            "question": question,
+            "type": question.get('type', 'mcq'),
+            "subject": QuestionBank.normalize_subject(subject_area),
+            "topic_terms": QuestionBank.topic_terms(title),
+            "content_hash": content_hash,
+            "source": source,  # 'ai' or 'teacher'
+            "created_by": created_by,
+            "used_by": [],
+            "created_at": datetime.utcnow()
+        }}
+    
+    @staticmethod
+    def upserts(questions, subject_area, title, created_by, source):
+        """
+        (query, update) for each question that has text
+        """
+        upserts = (QuestionBank.upsert(question, subject_area, title, created_by, source) for question in questions)
+        return [upsert for upsert in upserts if upsert is not None]
+    
+    @staticmethod
+    def add(questions, subject_area, title, created_by, source):
+        """
+        Store questions in the bank, skipping ones it already holds
+        
+        Returns:
+            int: Number of questions that were new to the bank
+        """
+        QuestionBank.ensure_indexes()
+        added = 0
+        for query, update in QuestionBank.upserts(questions, subject_area, title, created_by, source):
+            try:
+                result = db.update_one(QuestionBank.COLLECTION, query, update, upsert=True)
+            except DuplicateKeyError:
+                # A concurrent insert of the same question won the race
+                continue
+            if result.upserted_id is not None:
+                added += 1
+        return added
+    
+    @staticmethod
+    def match_query(subject_area, title, question_types, teacher_id):
+        """
+        Query for bank questions on the same subject sharing at least one topic
+        term, of the requested types, not yet used by this teacher; None when
+        the title has no usable terms
+        """
+        terms = QuestionBank.topic_terms(title)
+        if not terms:
+            return None
+        query = {
+            'subject': QuestionBank.normalize_subject(subject_area),
+            'type': {'$in': list(question_types)},
+            'topic_terms': {'$in': terms}
+        }
+        if teacher_id:
+            query['used_by'] = {'$ne': teacher_id}
+        return query
+    
+    @staticmethod
+    def pick(candidates, title, counts):
+        """
+        The candidates closest to the title (Jaccard similarity of topic terms,
+        at least settings.question_bank_min_similarity), least used first among
+        equals, up to `counts` (question type -> count) of each type
+        """
+        terms = set(QuestionBank.topic_terms(title))
+        scored = []
+        for entry in candidates:
+            entry_terms = set(entry.get('topic_terms', []))
+            similarity = len(terms & entry_terms) / len(terms | entry_terms)
+            if similarity >= settings.question_bank_min_similarity:
+                scored.append((-similarity, len(entry.get('used_by', [])), entry['content_hash'], entry['question']))
+        scored.sort(key=lambda item: item[:3])
+        left = dict(counts)
+        picked = []
+        for *_, question in scored:
+            question_type = question.get('type', 'mcq')
+            if left.get(question_type):
+                left[question_type] -= 1
+                picked.append(question)
+        return picked
+    
+    @staticmethod
+    def draw(subject_area, title, counts, teacher_id=None):
+        """
+        Matching questions this teacher hasn't used yet, up to `counts`
+        (question type -> count) of each type
+        """
+        query = QuestionBank.match_query(subject_area, title, [t for t, n in counts.items() if n > 0], teacher_id)
+        if query is None or not sum(counts.values()):
+            return []
+        QuestionBank.ensure_indexes()
+        candidates = db.find(QuestionBank.COLLECTION, query, QuestionBank.CANDIDATE_FIELDS,
+                             limit=settings.question_bank_candidates)
+        return QuestionBank.pick(candidates, title, counts)
+    
+    @staticmethod
+    def used_update(questions, teacher_id):
+        """
+        (query, update) recording that a teacher's test now holds these questions
+        """
+        hashes = [h for h in map(QuestionBank.content_hash, questions) if h]
+        return {'content_hash': {'$in': hashes}}, {'$addToSet': {'used_by': teacher_id}}
+    
+    @staticmethod
+    def mark_used(questions, teacher_id):
+        if not teacher_id or not questions:
+            return
+        query, update = QuestionBank.used_update(questions, teacher_id)
+        db.update_many(QuestionBank.COLLECTION, query, update)
+
+
+@trace_class
+class TestAttempt:
+    DEFERRED_FEEDBACK = "Grading of this answer was deferred and will be completed shortly."
+    BLANK_EVALUATION = {"score": 0, "feedback": "No answer provided."}
+    # How long a submission may hold its grading lease when no request deadline applies
+    DEFAULT_GRADING_LEASE_SECONDS = 210
+    ARCHIVE_COLLECTION = 'test_attempts_archive'
+    # Bulky fields moved out of the hot collection when an attempt is archived
+    ARCHIVED_FIELDS = ('answers', 'feedback', 'pregrades')
+    
+    _indexed_pid = None
+    _batcher = None
+    
+    @staticmethod
+    def insert_batcher():
+        """
+        Coalesces attempt inserts during an exam-start surge
+        """
+        if TestAttempt._batcher is None:
+            TestAttempt._batcher = InsertBatcher(lambda documents: db.insert_many('test_attempts', documents),
+                                                 settings.surge_batch_window_ms / 1000, settings.surge_batch_max)
+        return TestAttempt._batcher
+    
+    @staticmethod
+    def ensure_indexes():
+        """
+        Create the attempts' indexes, once per process
+        """
+        if TestAttempt._indexed_pid == os.getpid():
+            return
+        db.create_index('test_attempts', [('student_id', 1), ('test_id', 1)])
+        # Open attempts by test, to lock tests while students are taking them
+        db.create_index('test_attempts', [('test_id', 1)], partialFilterExpression={'is_completed': False})
+        # Open attempts by time limit, for the sweeper
+        db.create_index('test_attempts', [('due_at', 1)], partialFilterExpression={'is_completed': False})
+        # Abandoned attempts are deleted by MongoDB once their purge_at passes
+        db.create_index('test_attempts', [('purge_at', 1)], expireAfterSeconds=0,
+                        partialFilterExpression={'status': 'abandoned'})
+        TestAttempt._indexed_pid = os.getpid()
+    
+    @staticmethod
+    def create(test_id, student_id, answers=None, time_limit=None, batched=False, test_version=None):
+        """
+        Create a new test attempt; with a time limit (minutes) it is closed by
+        the sweeper once that runs out. `batched` shares one insert_many with
+        the attempts created at about the same time. `test_version` is the
+        version of the test the student was served, which answers are mapped
+        back against at submit.
+        """
+        if answers is None:
+            answers = []
+        
+        TestAttempt.ensure_indexes()
+        now = datetime.utcnow()
+        attempt = {
+            "test_id": test_id,
+            "student_id": student_id,
+            "answers": answers,
+            "score": 0,
+            "question_scores": [],  # Individual question scores
+            "feedback": [],         # Feedback for each question
+            "status": "in_progress",  # then 'grading' while a submission is graded, then 'completed'
+            "shuffle_seed": random.getrandbits(32) if settings.shuffle_questions else None,
+            "test_version": test_version,
+            "is_completed": False,
+            "started_at": now,
+            "due_at": now + timedelta(minutes=time_limit) if time_limit else None,
+            "completed_at": None
+        }
+        
+        if batched:
+            attempt['_id'] = str(TestAttempt.insert_batcher().insert(attempt))
+        else:
+            result = db.insert_one('test_attempts', attempt)
+            attempt['_id'] = str(result.inserted_id)
+        return attempt
+    
+    @staticmethod
+    def permutation(seed, questions):
+        """
+        How an attempt with this seed sees the questions: the original index of
+        the question served at each position, and for each question (by
+        original index) the original index of each served option. Derived from
+        the seed alone, so an attempt stores a few bytes rather than its own
+        copy of the test.
+        
+        Returns:
+            tuple: (order, option_orders), or None if the attempt isn't shuffled
+        """
+        if seed is None:
+            return None
+        rng = random.Random(seed)
+        order = list(range(len(questions)))
+        rng.shuffle(order)
+        option_orders = []
+        for question in questions:
+            options = list(range(len(question.get('options') or []))) if question.get('type', 'mcq') == 'mcq' else []
+            rng.shuffle(options)
+            option_orders.append(options)
+        return order, option_orders
+    
+    @staticmethod
+    def shuffled_questions(questions, seed):
+        """
+        The questions in the order, and with the options in the order, an
+        attempt with this seed is served them
+        """
+        permutation = TestAttempt.permutation(seed, questions)
+        if permutation is None:
+            return questions
+        order, option_orders = permutation
+        served = []
+        for i in order:
+            question = questions[i]
+            if option_orders[i]:
+                question = dict(question, options=[question['options'][k] for k in option_orders[i]])
+            served.append(question)
+        return served
+    
+    @staticmethod
+    def original_answer(permutation, position, answer):
+        """
+        Map the answer to the question served at `position` back to the test:
+        returns (original question index, answer in terms of the original options)
+        """
+        order, option_orders = permutation
+        i = order[position]
+        options = option_orders[i]
+        if options and isinstance(answer, int) and not isinstance(answer, bool) and 0 <= answer < len(options):
+            answer = options[answer]
+        return i, answer
+    
+    @staticmethod
+    def check_test_version(attempt, test):
+        """
+        Make sure the test still exists at the version the attempt was served:
+        the served order and options are derived from the questions, so after
+        an edit answers would map to the wrong questions. Attempts from before
+        versions were recorded aren't checked.
+        
+        Raises:
+            TestNotFound: The test was deleted
+            AttemptOutdated: The test changed since the attempt started
+        """
+        if not test:
+            raise TestNotFound()
+        served = attempt.get('test_version')
+        if served is not None and test.get('version', 0) != served:
+            raise AttemptOutdated()
+    
+    @staticmethod
+    def has_open_attempts(test_id):
+        """
+        Whether any student is still taking the test under a time limit.
+        Those attempts are always closed, by the student or the sweeper, so
+        the lock they hold is released. An attempt without a time limit may
+        stay open forever and doesn't lock the test; if the test changes,
+        its submit is refused with AttemptOutdated instead.
+        """
+        TestAttempt.ensure_indexes()
+        return db.find_one('test_attempts', {
+            'test_id': test_id,
+            'is_completed': False,
+            'status': {'$ne': 'abandoned'},
+            'due_at': {'$ne': None}
+        }, {'_id': 1}) is not None
+    
+    @staticmethod
+    def unshuffled_answers(answers, questions, seed):
+        """
+        Answers given in the order the attempt was served, put back in the test's order
+        """
+        permutation = TestAttempt.permutation(seed, questions)
+        if permutation is None:
+            return answers
+        original = [None] * len(questions)
+        for position, answer in enumerate(answers[:len(questions)]):
+            i, answer = TestAttempt.original_answer(permutation, position, answer)
+            original[i] = answer
+        return original
+    
+    @staticmethod
+    def evaluate_paragraph_answer(student_answer, question, priority='grading'):
+        """
+        Use Mistral API to evaluate a paragraph answer against a model answer
+        
+        Args:
+            student_answer (str): The student's written response
+            question (dict): Question object containing model answer and max score
+            priority (str): LLM scheduler class; 'batch' for regrading nobody is waiting on
+            
+        Returns:
+            dict: Evaluation results with score and feedback
+        """
+        # If student didn't answer, return 0 with feedback
+        if TestAttempt.is_blank(student_answer):
+            return dict(TestAttempt.BLANK_EVALUATION)
+        
+        prompt, instructions = TestAttempt.grading_prompt(student_answer, question)
+        
+        try:
+            mistral = MistralAPI(call_site='grading', priority=priority)
+            response = mistral.get_response(prompt, instructions)
+            return TestAttempt.parse_evaluation(response, question)
+            
+        except DeadlineExceeded:
+            raise
+        except CircuitOpenError as e:
+            return TestAttempt.unavailable_evaluation(student_answer, question, e)
+        except Exception as e:
+            return TestAttempt.failed_evaluation(e)
+    
+    @staticmethod
+    def is_blank(student_answer):
+        return not student_answer or student_answer.strip() == ""
+    
+    @staticmethod
+    def failed_evaluation(error):
+        """
+        Fallback evaluation when grading an answer failed
+        """
+        logger.warning("Error evaluating paragraph answer: %s", error)
+        return {
+            "score": 0,
+            "feedback": f"Error evaluating answer: {str(error)[:100]}"
+        }
+    
+    @staticmethod
+    def grading_prompt(student_answer, question, record=True):
+        """
+        Prompt and instructions asking the LLM to grade one paragraph answer.
+        Long essays and model answers are cut down to their token budgets.
+        
+        Args:
+            record (bool): Report the prompt size to metrics; False when it's only hashed
+            
+        Returns:
+            tuple: (prompt, instructions)
+        """
+        return prompts.GRADING.render(
+            record=record,
+            question=prompts.normalize(question['text']),
+            model_answer=prompts.normalize(question.get('model_answer', "")),
+            keywords=', '.join(question.get('keywords', [])),
+            student_answer=prompts.normalize(student_answer, paragraphs=True),
+            # Default max score is 10 if not specified
+            max_score=question.get('max_score', 10),
+        )
+    
+    @staticmethod
+    def parse_evaluation(response, question):
+        """
+        Score and feedback from a grading reply, with the score clamped to the question's maximum
+        
+        Raises:
+            json.JSONDecodeError: If the reply holds no valid JSON object
+        """
+        max_score = question.get('max_score', 10)
+        
+        # Extract JSON from response
+        # Try to extract JSON object if embedded in text
+        json_match = JSON_OBJECT_PATTERN.search(response)
+        repaired = False
+        if json_match:
+            repaired = json_match.group(0) != response.strip()
+            response = json_match.group(0)
+        
+        try:
+            evaluation = json.loads(response)
+        except json.JSONDecodeError:
+            metrics.LLM_JSON_PARSE_FAILURES.labels('grading', 'failed').inc()
+            raise
+        if repaired:
+            metrics.LLM_JSON_PARSE_FAILURES.labels('grading', 'repaired').inc()
+        
+        # Ensure score is within bounds
+        score = min(max(float(evaluation.get("score", 0)), 0), max_score)
+        
+        return {
+            "score": score,
+            "feedback": evaluation.get("feedback", "")
+        }
+    
+    @staticmethod
+    def unavailable_evaluation(student_answer, question, error):
+        """
+        What a paragraph answer gets while the circuit breaker keeps the LLM out
+        """
+        if settings.llm_fallback_grader == "keywords":
+            return TestAttempt.evaluate_by_keywords(student_answer, question)
+        logger.warning("Skipping paragraph evaluation: %s", error)
+        return {
+            "score": 0,
+            "feedback": "AI grading is temporarily unavailable. This answer was not evaluated."
+        }
+    
+    @staticmethod
+    def evaluate_by_keywords(student_answer, question):
+        """
+        Provisional grade from keyword coverage, used when the LLM is unavailable
+        
+        Args:
+            student_answer (str): The student's written response
+            question (dict): Question object containing keywords and max score
+            
+        Returns:
+            dict: Evaluation results with score and feedback
+        """
+        max_score = question.get('max_score', 10)
+        keywords = question.get('keywords', [])
+        answer_text = student_answer.lower()
+        
+        if not keywords:
+            return {
+                "score": 0,
+                "feedback": "AI grading is temporarily unavailable. This answer was not evaluated."
+            }
+        
+        matched = [keyword for keyword in keywords if keyword.lower() in answer_text]
+        score = round(max_score * len(matched) / len(keywords), 1)
+        missing = [keyword for keyword in keywords if keyword not in matched]
+        
+        feedback = f"Provisional score based on key concepts covered ({len(matched)}/{len(keywords)}); AI grading was unavailable."
+        if missing:
+            feedback += f" Concepts not found: {', '.join(missing)}."
+        
+        return {
+            "score": score,
+            "feedback": feedback
+        }
+    
+    @staticmethod
+    def autosave(attempt_id, answers, grace_seconds=None):
+        """
+        Store some answers of an attempt in progress, each into its own slot of
+        the answers list
+        
+        Args:
+            answers (dict): Question index -> answer
+            grace_seconds (float): If given, only save while the attempt's time
+                limit hasn't run out by more than this
+            
+        Returns:
+            bool: False if the attempt doesn't exist, is already completed or
+            is out of time
+        """
+        now = datetime.utcnow()
+        update = {f'answers.{i}': answer for i, answer in answers.items()}
+        update['autosaved_at'] = now
+        query = {'_id': ObjectId(attempt_id), 'is_completed': False}
+        if grace_seconds is not None:
+            query.update(TestAttempt.on_time_query(now, grace_seconds))
+        result = db.update_one('test_attempts', query, {'$set': update})
+        return result.matched_count == 1
+    
+    @staticmethod
+    def on_time_query(now, grace_seconds):
+        """
+        Matches attempts without a time limit, or whose time limit ran out no
+        more than `grace_seconds` ago
+        """
+        return {'$or': [{'due_at': None}, {'due_at': {'$gte': now - timedelta(seconds=grace_seconds)}}]}
+    
+    @staticmethod
+    def out_of_time(attempt, grace_seconds):
+        """
+        Whether the attempt's time limit ran out more than `grace_seconds` ago
+        """
+        due_at = attempt.get('due_at')
+        return due_at is not None and due_at < datetime.utcnow() - timedelta(seconds=grace_seconds)
+    
+    @staticmethod
+    def answer_digest(answer):
+        return hashlib.sha256(json.dumps(answer).encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def grading_key(student_answer, question):
+        """
+        Hash of everything the grade depends on: the answer and the question as
+        the grader sees them, so an edited question invalidates its pre-grades too
+        """
+        prompt, instructions = TestAttempt.grading_prompt(student_answer, question, record=False)
+        return hashlib.sha256(f"{prompt}\0{instructions}".encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def pregrade(attempt_id, index, digest):
+        """
+        Grade autosaved paragraph answer `index` ahead of submission, if it is
+        still the one with this digest. Failures raise: a missing pre-grade
+        just means the answer is graded at submit.
+        
+        Returns:
+            str: 'graded', 'cached' (already pre-graded) or 'stale' (answer
+            changed, attempt submitted, or question gone)
+        """
+        attempt = TestAttempt.get_by_id(attempt_id)
+        if not attempt or attempt['is_completed']:
+            return 'stale'
+        answers = attempt.get('answers', [])
+        if index >= len(answers) or TestAttempt.answer_digest(answers[index]) != digest:
+            return 'stale'
+        
+        test = Test.get_by_id(attempt['test_id'])
+        if not test or index >= len(test['questions']):
+            return 'stale'
+        answer, question = answers[index], test['questions'][index]
+        
+        key = TestAttempt.grading_key(answer, question)
+        if attempt.get('pregrades', {}).get(str(index), {}).get('key') == key:
+            return 'cached'
+        
+        prompt, instructions = TestAttempt.grading_prompt(answer, question)
+        mistral = MistralAPI(call_site='pregrading')
+        evaluation = TestAttempt.parse_evaluation(mistral.get_response(prompt, instructions), question)
+        
+        db.update_one('test_attempts', {'_id': ObjectId(attempt_id), 'is_completed': False},
+                      {'$set': {f'pregrades.{index}': {'key': key, **evaluation}}})
+        return 'graded'
+    
+    @staticmethod
+    def pregraded_evaluation(attempt, i, answer, question):
+        """
+        The background pre-grade of answer `i`, if it was made for exactly this
+        answer and question; otherwise None
+        """
+        if not isinstance(answer, str) or not answer.strip():
+            return None
+        pregrade = attempt.get('pregrades', {}).get(str(i))
+        if not pregrade or pregrade['key'] != TestAttempt.grading_key(answer, question):
+            metrics.PREGRADE_REUSE.labels('miss').inc()
+            return None
+        metrics.PREGRADE_REUSE.labels('hit').inc()
+        return {"score": pregrade['score'], "feedback": pregrade['feedback']}
+    
+    @staticmethod
+    def claim_query(attempt_id, now, grace_seconds=None):
+        """
+        Matches the attempt only while a submission may start grading it: not
+        completed or abandoned, and not being graded unless that grading's
+        lease ran out. With `grace_seconds`, also only while the time limit
+        hasn't run out by more than that; the sweeper claims without it.
+        """
+        query = {
+            '_id': ObjectId(attempt_id),
+            'is_completed': False,
+            '$or': [
+                {'status': {'$nin': ['grading', 'abandoned']}},
+                {'status': 'grading', 'grading_lease_expires_at': {'$lt': now}}
+            ]
+        }
+        if grace_seconds is not None:
+            query['$and'] = [TestAttempt.on_time_query(now, grace_seconds)]
+        return query
+    
+    @staticmethod
+    def claim_update(now, idempotency_key):
+        return {
+            '$set': {
+                'status': 'grading',
+                'submission_token': uuid.uuid4().hex,
+                'submission_key': idempotency_key,
+                'grading_started_at': now,
+                'grading_lease_expires_at': lease_expiry(now, TestAttempt.DEFAULT_GRADING_LEASE_SECONDS)
+            },
+            '$inc': {'grading_runs': 1}
+        }
+    
+    @staticmethod
+    def claim_submission(attempt_id, idempotency_key=None, grace_seconds=None):
+        """
+        Atomically move the attempt to 'grading' for this submission, so that
+        duplicate submissions can't start a second grading run
+        
+        Args:
+            grace_seconds (float): If given, a submission this long after the
+                time limit ran out can't claim the attempt
+        
+        Returns:
+            dict: The claimed attempt, holding the `submission_token` that the
+            final write must present, or None if it can't be claimed
+        """
+        now = datetime.utcnow()
+        try:
+            query = TestAttempt.claim_query(attempt_id, now, grace_seconds)
+        except Exception:
+            return None
+        attempt = db.find_one_and_update('test_attempts', query, TestAttempt.claim_update(now, idempotency_key))
+        if attempt:
+            attempt['_id'] = str(attempt['_id'])
+        return attempt
+    
+    @staticmethod
+    def release_submission(attempt_id, token):
+        """
+        Give up a claim after grading failed, so the student can submit again
+        """
+        db.update_one('test_attempts', {'_id': ObjectId(attempt_id), 'submission_token': token},
+                      TestAttempt.release_update())
+    
+    @staticmethod
+    def release_update():
+        return {'$set': {
+            'status': 'in_progress',
+            'submission_token': None,
+            'grading_lease_expires_at': None
+        }}
+    
+    @staticmethod
+    def wait_for_grading(attempt_id, poll_seconds=0.5, max_wait_seconds=30):
+        """
+        Wait while another request grades the attempt, up to `max_wait_seconds`
+        and within this request's deadline
+        
+        Returns:
+            dict: The attempt, completed unless the wait ran out first
+        """
+        give_up = TestAttempt.wait_until(max_wait_seconds)
+        while True:
+            attempt = TestAttempt.get_by_id(attempt_id)
+            if TestAttempt.done_waiting(attempt, give_up, poll_seconds):
+                return attempt
+            time.sleep(poll_seconds)
+    
+    @staticmethod
+    def wait_until(max_wait_seconds):
+        """
+        Monotonic time to stop waiting for another grading at, within the request deadline
+        """
+        left = deadline.remaining()
+        return time.monotonic() + (min(max_wait_seconds, left - 1) if left is not None else max_wait_seconds)
+    
+    @staticmethod
+    def done_waiting(attempt, give_up, poll_seconds):
+        """
+        Whether to stop waiting on the attempt: its grading finished or was
+        abandoned, or another poll would run past `give_up`
+        """
+        return (not attempt or attempt.get('status') != 'grading'
+                or attempt['grading_lease_expires_at'] < datetime.utcnow()
+                or time.monotonic() + poll_seconds > give_up)
+    
+    @staticmethod
+    def finish_submission(attempt_id, update_data, token=None):
+        """
+        Store the graded submission. With a token, only if this submission
+        still holds the grading lease; a run that lost its lease to a retry
+        leaves the result to that retry.
+        """
+        result = db.update_one('test_attempts', TestAttempt.finish_query(attempt_id, token), {'$set': update_data})
+        TestAttempt.check_finished(result, attempt_id)
+        return TestAttempt.get_by_id(attempt_id)
+    
+    @staticmethod
+    def finish_query(attempt_id, token):
+        query = {'_id': ObjectId(attempt_id)}
+        if token:
+            query['submission_token'] = token
+        return query
+    
+    @staticmethod
+    def check_finished(result, attempt_id):
+        if not result.matched_count:
+            logger.warning("Submission of attempt %s lost its grading lease; result discarded", attempt_id)
+    
+    @staticmethod
+    def submit_with_evaluation(attempt_id, answers, attempt=None, in_test_order=False):
+        """
+        Submit a test attempt with AI evaluation of paragraph answers
+        
+        Args:
+            attempt_id (str): The test attempt ID
+            answers (list): List of student answers
+            attempt (dict): The attempt as returned by claim_submission; read if omitted
+            in_test_order (bool): Answers are in the test's order (as saved)
+                rather than the order the attempt was served
+            
+        Returns:
+            dict: Updated attempt with scores and feedback
+        """
+        # Get attempt and test data
+        token = attempt and attempt.get('submission_token')  # Only a claimed submission holds one
+        if attempt is None:
+            attempt = TestAttempt.get_by_id(attempt_id)
+        if not attempt:
+            raise Exception("Test attempt not found")
+            
+        test = Test.get_by_id(attempt['test_id'])
+        TestAttempt.check_test_version(attempt, test)
+            
+        # Calculate scores and provide feedback
+        questions = test['questions']
+        if not in_test_order:
+            answers = TestAttempt.unshuffled_answers(answers, questions, attempt.get('shuffle_seed'))
+        evaluations, to_grade = TestAttempt.grading_plan(attempt, answers, questions)
+        graded = [TestAttempt._evaluate_or_defer(answer, question) for _, _, answer, question in to_grade]
+        
+        # Update the attempt with scores and feedback
+        update_data = TestAttempt.graded_update(answers, questions, evaluations, to_grade, graded)
+        
+        return TestAttempt.finish_submission(attempt_id, update_data, token)
+    
+    @staticmethod
+    def _evaluate_or_defer(answer, question):
+        """
+        Grade one paragraph answer, or None if the request ran out of time first
+        """
+        try:
+            deadline.check()
+            return TestAttempt.evaluate_paragraph_answer(answer, question)
+        except DeadlineExceeded:
+            return None
+    
+    @staticmethod
+    def grading_plan(attempt, answers, questions):
+        """
+        Score every answer that doesn't need the LLM: multiple choice ones,
+        and paragraph ones with a pre-grade made for exactly that answer
+        
+        Returns:
+            tuple: (evaluations, to_grade). `evaluations` holds one entry per
+            scored answer, None for each paragraph answer still to be graded;
+            `to_grade` lists those as (position in evaluations, question
+            index, answer, question).
+        """
+        evaluations = []
+        to_grade = []
+        # Answers beyond the last question are ignored
+        for i, answer in enumerate(answers[:len(questions)]):
+            question = questions[i]
+            question_type = question.get('type', 'mcq')  # Default to mcq for backward compatibility
+            
+            if question_type == 'mcq':
+                evaluations.append(TestAttempt.evaluate_mcq_answer(answer, question))
+            elif question_type == 'paragraph':
+                # Reuse the background pre-grade if the answer hasn't changed since
+                evaluation = TestAttempt.pregraded_evaluation(attempt, i, answer, question)
+                if evaluation is None:
+                    to_grade.append((len(evaluations), i, answer, question))
+                evaluations.append(evaluation)
+        return evaluations, to_grade
+    
+    @staticmethod
+    def graded_update(answers, questions, evaluations, to_grade, graded):
+        """
+        Fields to $set on an attempt once the answers in `to_grade` have been
+        graded; `graded` holds their evaluations, None for each one the
+        request deadline deferred
+        """
+        pending_questions = []  # Paragraph answers left ungraded when the deadline hit
+        for (position, i, _, _), evaluation in zip(to_grade, graded):
+            if evaluation is None:
+                pending_questions.append(i)
+                evaluation = {"score": 0, "feedback": TestAttempt.DEFERRED_FEEDBACK}
+            evaluations[position] = evaluation
+        
+        question_scores = [evaluation['score'] for evaluation in evaluations]
+        feedback = [evaluation['feedback'] for evaluation in evaluations]
+        return TestAttempt.submission_update(answers, questions, question_scores, feedback, pending_questions)
+    
+    @staticmethod
+    def evaluate_mcq_answer(answer, question):
+        """
+        One point for the correct option, none otherwise
+        """
+        correct = (answer == question.get('correct_answer'))
+        return {
+            "score": 1 if correct else 0,
+            "feedback": "Correct" if correct else "Incorrect"
+        }
+    
+    @staticmethod
+    def submission_update(answers, questions, question_scores, feedback, pending_questions):
+        """
+        Fields to $set on an attempt once its answers have been scored
+        """
+        return {
+            'answers': answers,
+            'question_scores': question_scores,
+            'feedback': feedback,
+            'score': TestAttempt.overall_score(questions, question_scores, pending_questions),
+            'grading_status': 'partial' if pending_questions else 'complete',
+            'pending_questions': pending_questions,
+            'status': 'completed',
+            'grading_lease_expires_at': None,
+            'is_completed': True,
+            'completed_at': datetime.utcnow()
+        }
+    
+    @staticmethod
+    def claim_pending(attempt_id):
+        """
+        Atomically take over grading an attempt's deferred answers, so that
+        two grade-pending requests can't grade them twice or overwrite each
+        other's scores; a claim whose lease ran out may be taken over
+        
+        Returns:
+            dict: The claimed attempt, holding the `pending_token` that the
+            final write must present, or None if it can't be claimed
+        """
+        now = datetime.utcnow()
+        try:
+            query = {
+                '_id': ObjectId(attempt_id),
+                'grading_status': 'partial',
+                '$or': [
+                    {'pending_lease_expires_at': None},
+                    {'pending_lease_expires_at': {'$lt': now}}
+                ]
+            }
+        except Exception:
+            return None
+        attempt = db.find_one_and_update('test_attempts', query, {'$set': {
+            'pending_token': uuid.uuid4().hex,
+            'pending_lease_expires_at': lease_expiry(now, TestAttempt.DEFAULT_GRADING_LEASE_SECONDS)
+        }})
+        if attempt:
+            attempt['_id'] = str(attempt['_id'])
+        return attempt
+    
+    @staticmethod
+    def release_pending(attempt_id, token, update_data=None):
+        """
+        Give up a grade-pending claim, storing `update_data` with it if this
+        run still holds the claim
+        
+        Returns:
+            bool: False if the claim was lost to another run
+        """
+        update = dict(update_data or {}, pending_token=None, pending_lease_expires_at=None)
+        result = db.update_one('test_attempts', {'_id': ObjectId(attempt_id), 'pending_token': token}, {'$set': update})
+        return result.matched_count == 1
+    
+    @staticmethod
+    def grade_pending(attempt_id):
+        """
+        Grade the paragraph answers that were deferred when a submission ran out of time
+        
+        Args:
+            attempt_id (str): The test attempt ID
+            
+        Returns:
+            dict: Updated attempt; still 'partial' if the deadline hit again.
+            None if another request is grading its answers.
+        """
+        attempt = TestAttempt.claim_pending(attempt_id)
+        if not attempt:
+            return None
+        token = attempt['pending_token']
+        
+        try:
+            test = Test.get_by_id(attempt['test_id'])
+            if not test:
+                raise Exception("Test not found")
             
-        db.update_one('test_attempts', {'_id': ObjectId(attempt_id)}, {'$set': update_data})
-        return TestAttempt.get_by_id(attempt_id)
\ No newline at end of file
+            questions = test['questions']
+            question_scores = attempt.get('question_scores', [])
+            feedback = attempt.get('feedback', [])
+            still_pending = []
+            
+            for i in attempt.get('pending_questions', []):
+                try:
+                    deadline.check()
+                    evaluation = TestAttempt.evaluate_paragraph_answer(attempt['answers'][i], questions[i], priority='batch')
+                except DeadlineExceeded:
+                    still_pending.append(i)
+                    continue
+                question_scores[i] = evaluation['score']
+                feedback[i] = evaluation['feedback']
+        except Exception:
+            TestAttempt.release_pending(attempt_id, token)
+            raise
+        
+        if not TestAttempt.release_pending(attempt_id, token, {
+            'question_scores': question_scores,
+            'feedback': feedback,
+            'score': TestAttempt.overall_score(questions, question_scores, still_pending),
+            'grading_status': 'partial' if still_pending else 'complete',
+            'pending_questions': still_pending
+        }):
+            logger.warning("Grading pending answers of attempt %s lost its lease; result discarded", attempt_id)
+        return TestAttempt.get_by_id(attempt_id)
+    
+    @staticmethod
+    def overall_score(questions, question_scores, pending_questions=()):
+        """
+        Percentage score over the graded questions; pending ones are left out
+        """
+        total_possible_points = 0
+        total_earned_points = 0
+        
+        for i, points in enumerate(question_scores):
+            if i in pending_questions:
+                continue
+            question = questions[i]
+            if question.get('type', 'mcq') == 'paragraph':
+                total_possible_points += question.get('max_score', 10)
+            else:
+                total_possible_points += 1
+            total_earned_points += points
+        
+        # Calculate overall percentage score
+        return (total_earned_points / total_possible_points * 100) if total_possible_points > 0 else 0
+    
+    @staticmethod
+    def expired_query(now, grace_seconds):
+        """
+        Open attempts whose time limit ran out more than `grace_seconds` ago,
+        unless a submission is grading them under a live lease
+        """
+        return {
+            'is_completed': False,
+            'due_at': {'$lt': now - timedelta(seconds=grace_seconds)},
+            '$or': [
+                {'status': 'in_progress'},
+                {'status': 'grading', 'grading_lease_expires_at': {'$lt': now}}
+            ],
+            # Attempts that failed to close wait out their backoff
+            '$and': [{'$or': [{'next_sweep_at': None}, {'next_sweep_at': {'$lte': now}}]}]
+        }
+    
+    @staticmethod
+    def find_expired(grace_seconds, limit=100):
+        """
+        Expired attempts to close, the longest overdue first
+        """
+        TestAttempt.ensure_indexes()
+        return db.find('test_attempts', TestAttempt.expired_query(datetime.utcnow(), grace_seconds),
+                       {'answers': 1, 'status': 1, 'sweep_failures': 1}, sort=[('due_at', 1)], limit=limit)
+    
+    @staticmethod
+    def defer_sweep(attempt_id, delay_seconds):
+        """
+        Leave an attempt that failed to close alone for `delay_seconds`, so
+        it doesn't take up every sweep while whatever broke it is fixed
+        """
+        db.update_one('test_attempts', {'_id': ObjectId(attempt_id)}, {
+            '$set': {'next_sweep_at': datetime.utcnow() + timedelta(seconds=delay_seconds)},
+            '$inc': {'sweep_failures': 1}
+        })
+    
+    @staticmethod
+    def abandon_update(now, retention_days):
+        return {'$set': {
+            'status': 'abandoned',
+            'abandoned_at': now,
+            'purge_at': now + timedelta(days=retention_days)
+        }}
+    
+    @staticmethod
+    def expire(attempt, retention_days):
+        """
+        Close an attempt whose time ran out: submit whatever answers were
+        autosaved, or, if there are none, mark it abandoned so it is hidden
+        from the student's attempts and purged after `retention_days`
+        
+        Returns:
+            str: 'submitted', 'abandoned' or 'skipped' (another request or
+            worker got to it first)
+        """
+        attempt_id = str(attempt['_id'])
+        answers = attempt.get('answers') or []
+        if not any(answer is not None and answer != '' for answer in answers):
+            now = datetime.utcnow()
+            query = TestAttempt.claim_query(attempt_id, now)
+            result = db.update_one('test_attempts', query, TestAttempt.abandon_update(now, retention_days))
+            return 'abandoned' if result.modified_count else 'skipped'
+        
+        claimed = TestAttempt.claim_submission(attempt_id)
+        if not claimed:
+            return 'skipped'
+        try:
+            # Autosave stores answers in the test's order
+            TestAttempt.submit_with_evaluation(attempt_id, claimed.get('answers') or [], claimed, in_test_order=True)
+        except (AttemptOutdated, TestNotFound):
+            # The saved answers can't be graded against a changed or deleted
+            # test, and never will be
+            update = TestAttempt.abandon_update(datetime.utcnow(), retention_days)
+            update['$set'].update({'submission_token': None, 'grading_lease_expires_at': None})
+            result = db.update_one('test_attempts', {
+                '_id': ObjectId(attempt_id),
+                'submission_token': claimed['submission_token']
+            }, update)
+            return 'abandoned' if result.modified_count else 'skipped'
+        except Exception:
+            TestAttempt.release_submission(attempt_id, claimed['submission_token'])
+            raise
+        return 'submitted'
+    
+    @staticmethod
+    def find_archivable(older_than_days, limit=500):
+        """
+        Completed, fully graded attempts finished more than `older_than_days` ago
+        and not archived yet
+        """
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        return db.find('test_attempts', {
+            'is_completed': True,
+            'completed_at': {'$lt': cutoff},
+            'grading_status': {'$ne': 'partial'},
+            'archived': {'$ne': True}
+        }, limit=limit)
+    
+    @staticmethod
+    def archive(attempt):
+        """
+        Move the bulky fields of a completed attempt into the archive
+        collection, compressed, leaving the scores and timestamps in
+        `test_attempts` as its summary. Safe to repeat: the archive copy is
+        written first, and the hot document only loses its fields once that
+        copy exists.
+        
+        Returns:
+            int: Compressed size in bytes, or 0 if the attempt was already archived
+        """
+        fields = {field: attempt[field] for field in TestAttempt.ARCHIVED_FIELDS if field in attempt}
+        # BSON rather than JSON keeps every stored type as it was
+        data = zlib.compress(bson.encode(fields))
+        now = datetime.utcnow()
+        db.update_one(TestAttempt.ARCHIVE_COLLECTION, {'_id': attempt['_id']}, {'$set': {
+            'data': bson.Binary(data),
+            'student_id': attempt.get('student_id'),
+            'test_id': attempt.get('test_id'),
+            'archived_at': now
+        }}, upsert=True)
+        result = db.update_one('test_attempts', {'_id': attempt['_id'], 'archived': {'$ne': True}}, {
+            '$set': {'archived': True, 'archived_at': now},
+            '$unset': {field: '' for field in fields}
+        })
+        return len(data) if result.modified_count else 0
+    
+    @staticmethod
+    def rehydrate(attempt, archived):
+        """
+        Put an archived attempt's fields back from its archive document
+        """
+        if archived:
+            attempt.update(bson.decode(zlib.decompress(archived['data'])))
+        return attempt
+    
+    @staticmethod
+    def get_by_id(attempt_id, projection=None):
+        """
+        Get attempt by ID, optionally only the fields in `projection`. Archived
+        attempts are returned whole, read back from the archive; with a
+        projection only if it includes `archived`.
+        """
+        try:
+            attempt = db.find_one('test_attempts', {'_id': ObjectId(attempt_id)}, projection)
+            if attempt:
+                if attempt.get('archived'):
+                    archived = db.find_one(TestAttempt.ARCHIVE_COLLECTION, {'_id': attempt['_id']})
+                    TestAttempt.rehydrate(attempt, archived)
+                attempt['_id'] = str(attempt['_id'])
+            return attempt
+        except Exception:
+            return None
+    
+    @staticmethod
+    def get_by_student_and_test(student_id, test_id):
+        """
+        Get attempts by a student for a specific test
+        """
+        return db.find('test_attempts', {'student_id': student_id, 'test_id': test_id, 'status': {'$ne': 'abandoned'}})
+    
+    @staticmethod
+    def get_by_student(student_id):
+        """
+        Get all attempts by a student
+        """
+        return db.find('test_attempts', {'student_id': student_id, 'status': {'$ne': 'abandoned'}})
+    
+    @staticmethod
+    def update(attempt_id, update_data):
+        """
+        Update attempt information
+        """
+        db.update_one('test_attempts', {'_id': ObjectId(attempt_id)}, {'$set': TestAttempt.stamped(update_data)})
+        return TestAttempt.get_by_id(attempt_id)
+    
+    @staticmethod
+    def stamped(update_data):
+        """
+        `update_data` with `completed_at` set if it completes the attempt
+        """
+        if 'is_completed' in update_data and update_data['is_completed']:
+            update_data['completed_at'] = datetime.utcnow()
+        return update_data
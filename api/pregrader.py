@@ -0,0 +1,119 @@
+"""
+Speculative grading of autosaved paragraph answers while an exam is still
+running, so most of the LLM work is done before students press submit.
+"""
+import os
+import heapq
+import itertools
+import threading
+import time
+import metrics
+from models import TestAttempt
+from settings import settings
+from tracing import get_logger
+
+logger = get_logger('pregrader')
+
+
+class Pregrader:
+    """
+    Grades an autosaved paragraph answer once it has gone `debounce_seconds`
+    without changing, and stores the grade on the attempt for submit to reuse.
+
+    Best effort by design: it runs in `workers` daemon threads of this worker
+    process, at the LLM scheduler's 'batch' priority, and keeps at most
+    `max_pending` answers waiting. An answer that is never pre-graded (queue
+    full, process restarted, LLM error) is simply graded at submit.
+    """
+    def __init__(self, debounce_seconds=20, workers=2, max_pending=10000):
+        self.debounce_seconds = debounce_seconds
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self._cond = threading.Condition()
+        self._heap = []     # (due, seq, attempt_id, index, digest)
+        self._latest = {}   # (attempt_id, index) -> digest of the newest save
+        self._seq = itertools.count()
+        self._pid = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            debounce_seconds=settings.pregrade_debounce_seconds,
+            workers=settings.pregrade_workers,
+            max_pending=settings.pregrade_max_pending,
+        )
+
+    def schedule(self, attempt_id, index, answer):
+        """
+        Note a newly saved answer; it is graded if nothing replaces it within
+        the debounce period
+        """
+        key = (attempt_id, index)
+        digest = TestAttempt.answer_digest(answer)
+        with self._cond:
+            self._start()
+            if self._latest.get(key) == digest:
+                return  # Unchanged since the last save: keep its place in line
+            if len(self._heap) >= self.max_pending:
+                metrics.PREGRADE_OUTCOMES.labels('dropped').inc()
+                return
+            self._latest[key] = digest
+            heapq.heappush(self._heap, (time.monotonic() + self.debounce_seconds, next(self._seq),
+                                        attempt_id, index, digest))
+            self._cond.notify()
+
+    def _start(self):
+        # Threads don't survive a fork, so each worker process starts its own
+        if self._pid == os.getpid():
+            return
+        self._heap, self._latest = [], {}
+        for _ in range(self.workers):
+            threading.Thread(target=self._run, name='pregrader', daemon=True).start()
+        self._pid = os.getpid()
+
+    def _next(self):
+        """
+        Wait for the next answer whose debounce period is over and that no
+        later save has replaced
+        """
+        with self._cond:
+            while True:
+                wait = None
+                if self._heap:
+                    due, _, attempt_id, index, digest = self._heap[0]
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self._heap)
+                        key = (attempt_id, index)
+                        if self._latest.get(key) != digest:
+                            continue
+                        del self._latest[key]
+                        return attempt_id, index, digest
+                self._cond.wait(wait)
+
+    def _run(self):
+        while True:
+            attempt_id, index, digest = self._next()
+            try:
+                outcome = TestAttempt.pregrade(attempt_id, index, digest)
+            except Exception as e:
+                logger.warning("Pre-grading answer %s of attempt %s failed: %s", index, attempt_id, e)
+                outcome = 'failed'
+            metrics.PREGRADE_OUTCOMES.labels(outcome).inc()
+
+
+_pregrader = None
+_pregrader_lock = threading.Lock()
+
+
+def get_pregrader():
+    """
+    The process-wide pre-grader
+    """
+    global _pregrader
+    if _pregrader is None:
+        with _pregrader_lock:
+            if _pregrader is None:
+                _pregrader = Pregrader.from_settings()
+    return _pregrader
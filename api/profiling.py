@@ -0,0 +1,171 @@
+import os
+import re
+import sys
+import time
+import random
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, jsonify, send_from_directory, abort
+from settings import settings
+from tracing import get_logger
+
+logger = get_logger('profiling')
+
+PROFILE_NAME = re.compile(r'^[\w.-]+\.(pstats|collapsed)$')
+UNSAFE_NAME_CHARS = re.compile(r'[^\w.-]')
+
+
+class StackSampler:
+    """
+    Samples one thread's call stack at a fixed interval and counts identical
+    stacks, producing the "collapsed" format flame graph tools read
+    """
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+
+class Profiler:
+    """
+    Opt-in per-request profiling for a Flask app.
+
+    A request is profiled when PROFILING_ENABLED is set and it either carries
+    an `X-Profile: 1` header or is picked by PROFILE_SAMPLE_RATE. Profiles are
+    written to PROFILE_DIR, keeping the newest PROFILE_KEEP files. When
+    profiling is disabled no request hooks are installed at all.
+    """
+    def __init__(self, directory, mode='cprofile', sample_rate=0.0, keep=50, sample_interval=0.005):
+        self.directory = directory
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            directory=settings.profile_dir,
+            mode=settings.profile_mode,
+            sample_rate=settings.profile_sample_rate,
+            keep=settings.profile_keep,
+        )
+
+    def init_app(self, app):
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        if request.headers.get('X-Profile') != '1' and random.random() >= self.sample_rate:
+            return
+        if self.mode == 'sample':
+            sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            sampler.start()
+            g.profiler = sampler
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+            g.profiler = profile
+        g.profile_started = time.perf_counter()
+
+    def _finish(self, exc=None):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        elapsed_ms = int((time.perf_counter() - g.pop('profile_started')) * 1000)
+        endpoint = request.endpoint or 'unmatched'
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        # The request id can come from the client: keep it to characters
+        # PROFILE_NAME accepts, so it can't leave the directory or escape rotation
+        request_id = UNSAFE_NAME_CHARS.sub('_', str(g.get('request_id', 'request')))[:64]
+        base = f"{stamp}_{UNSAFE_NAME_CHARS.sub('_', endpoint)}_{elapsed_ms}ms_{request_id}"
+
+        try:
+            if isinstance(profiler, StackSampler):
+                counts = profiler.stop()
+                with open(os.path.join(self.directory, base + '.collapsed'), 'w') as f:
+                    for stack, count in counts.items():
+                        f.write(f"{stack} {count}\n")
+            else:
+                profiler.disable()
+                pstats.Stats(profiler).dump_stats(os.path.join(self.directory, base + '.pstats'))
+            self._rotate()
+        except OSError as e:
+            logger.warning("Could not write profile %s: %s", base, e)
+
+    def _rotate(self):
+        with self._lock:
+            files = sorted(self.list_profiles(), key=lambda p: p['created_at'])
+            for old in files[:max(0, len(files) - self.keep)]:
+                try:
+                    os.remove(os.path.join(self.directory, old['name']))
+                except OSError:
+                    pass
+
+    def list_profiles(self):
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not PROFILE_NAME.match(name):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            profiles.append({
+                "name": name,
+                "size": stat.st_size,
+                "created_at": datetime.utcfromtimestamp(stat.st_mtime).isoformat() + 'Z'
+            })
+        return profiles
+
+
+def register(app):
+    """
+    Install the profiler on `app` if PROFILING_ENABLED is set, and add the
+    admin endpoints to list and download captured profiles
+    """
+    profiler = Profiler.from_settings()
+    if settings.profiling_enabled:
+        profiler.init_app(app)
+        logger.info("Request profiling enabled (%s), writing to %s", profiler.mode, profiler.directory)
+
+    @app.route('/api/admin/profiles', methods=['GET'])
+    def list_profiles():
+        # In a real app, check if user is admin first
+        profiles = sorted(profiler.list_profiles(), key=lambda p: p['created_at'], reverse=True)
+        return jsonify({"profiles": profiles}), 200
+
+    @app.route('/api/admin/profiles/<name>', methods=['GET'])
+    def download_profile(name):
+        # In a real app, check if user is admin first
+        if not PROFILE_NAME.match(name):
+            abort(404)
+        return send_from_directory(profiler.directory, name, as_attachment=True)
+
+    return profiler
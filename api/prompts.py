@@ -0,0 +1,232 @@
+"""
+Building LLM prompts from versioned templates, within a token budget.
+
+LLM latency grows with prompt length, so templates are stored without the
+indentation they'd carry as inline f-strings, user-supplied fields have their
+whitespace collapsed, and fields that can run long (essays, model answers,
+test descriptions) are cut down to a per-field token budget before they're
+filled in.
+"""
+import re
+import textwrap
+import metrics
+from settings import settings
+
+# A rough 4 characters per token for English text; close enough for budgets
+# and metrics without loading a tokenizer
+CHARS_PER_TOKEN = 4
+
+_SPACES = re.compile(r'[ \t\r\f\v]+')
+_BLANK_LINES = re.compile(r'\n\s*\n\s*')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def estimate_tokens(text):
+    """
+    Approximate number of tokens in `text`
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def normalize(text, paragraphs=False):
+    """
+    Collapse runs of whitespace to single spaces. With `paragraphs`, paragraph
+    breaks (blank lines) are kept as one newline.
+    """
+    text = str(text or '').strip()
+    if not paragraphs:
+        return _WHITESPACE.sub(' ', text)
+    return '\n'.join(_WHITESPACE.sub(' ', p) for p in _BLANK_LINES.split(text))
+
+
+def truncate(text, max_tokens, tail=0.0):
+    """
+    Cut `text` down to about `max_tokens`, at word boundaries, marking the cut.
+    A `tail` fraction of the budget goes to the end of the text, so the
+    conclusion of an essay survives as well as its opening.
+
+    Returns:
+        tuple: (text, whether it was cut)
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if max_tokens <= 0 or len(text) <= max_chars:
+        return text, False
+
+    tail_chars = int(max_chars * tail)
+    head = text[:max_chars - tail_chars].rsplit(' ', 1)[0]
+    end = text[len(text) - tail_chars:].split(' ', 1)[-1] if tail_chars else ''
+    omitted = len(text[len(head):len(text) - len(end)].split())
+    return f"{head} [... {omitted} words omitted ...] {end}".rstrip(), True
+
+
+class Template:
+    """
+    A prompt and its instructions, with `str.format` fields.
+
+    Bump `version` whenever the wording changes: it's recorded with every
+    prompt-size metric so changes can be compared, and it changes the
+    rendered prompt, so cached grades from the old wording aren't reused.
+    """
+    def __init__(self, name, version, prompt, instructions, budgets=None, tails=None):
+        self.name = name
+        self.version = version
+        self.prompt = self._compact(prompt)
+        self.instructions = self._compact(instructions)
+        self.budgets = budgets or {}   # field -> settings attribute holding its token budget
+        self.tails = tails or {}       # field -> fraction of its budget kept from the end
+
+    @staticmethod
+    def _compact(text):
+        # Drop indentation and trailing spaces, and keep at most one blank line
+        lines = [line.strip() for line in textwrap.dedent(text).strip().splitlines()]
+        return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+    def render(self, record=True, **fields):
+        """
+        Fill in the template, cutting budgeted fields down to size
+
+        Args:
+            record (bool): Report the prompt size to metrics; False when the
+                prompt is only rendered to be hashed
+
+        Returns:
+            tuple: (prompt, instructions)
+        """
+        for field, setting in self.budgets.items():
+            fields[field], cut = truncate(fields[field], getattr(settings, setting), self.tails.get(field, 0.0))
+            if cut and record:
+                metrics.PROMPT_FIELD_TRUNCATIONS.labels(self.name, field).inc()
+
+        prompt = self.prompt.format(**fields)
+        instructions = self.instructions.format(**fields)
+        if record:
+            metrics.PROMPT_TOKENS.labels(self.name, str(self.version)).observe(
+                estimate_tokens(prompt) + estimate_tokens(instructions))
+        return prompt, instructions
+
+
+GRADING = Template(
+    'grading', 2,
+    prompt="""
+        Question: {question}
+
+        Model answer: {model_answer}
+
+        Important keywords/concepts: {keywords}
+
+        Student answer: {student_answer}
+
+        Evaluate the student's answer against the model answer and assign a score out of {max_score} points.
+        Consider:
+        1. Content accuracy and completeness
+        2. Inclusion of the key concepts listed above
+        3. Clarity of explanation
+    """,
+    instructions="""
+        You are an objective educator evaluating student responses. Provide your evaluation as a JSON object with these fields:
+        1. "score": A number from 0 to {max_score}
+        2. "feedback": Constructive feedback explaining the score with specific strengths and areas for improvement
+
+        Example:
+        {{"score": 7, "feedback": "Good explanation of key concepts X and Y. Mentioned most key terms. Could improve by elaborating on Z and connecting concepts more clearly."}}
+    """,
+    budgets={'model_answer': 'prompt_model_answer_max_tokens', 'student_answer': 'prompt_essay_max_tokens'},
+    tails={'student_answer': 0.25},
+)
+
+# What to generate, filled into GENERATION's {question_types}
+MCQ_ONLY = ("Generate EXACTLY {num_questions} multiple choice questions. DO NOT include any paragraph or "
+            "essay questions. You MUST create {num_questions} questions, not more or less.")
+PARAGRAPH_ONLY = Template._compact("""
+    Generate EXACTLY {num_questions} paragraph/essay questions. DO NOT include any multiple choice questions.
+    You MUST create EXACTLY {num_questions} questions, not more or less.
+    Each paragraph question MUST include:
+    1. A detailed question text that requires an essay response
+    2. A comprehensive model answer (3-4 paragraphs) for grading
+    3. A list of 5-8 important keywords/concepts that should be included in a good answer
+""")
+MIXED = Template._compact("""
+    Generate EXACTLY {num_questions} questions with this specific distribution:
+    - {mcq_count} multiple choice questions
+    - {para_count} paragraph/essay questions
+    You MUST create exactly this number of questions with this exact distribution.
+
+    For each paragraph question, include:
+    1. A detailed question text that requires an essay response
+    2. A comprehensive model answer (3-4 paragraphs) for grading
+    3. A list of 5-8 important keywords/concepts that should be included in a good answer
+""")
+
+GENERATION = Template(
+    'generation', 2,
+    prompt="""
+        Create a test on the topic: {title}
+        {context}
+        Description: {description}
+
+        {question_types}
+
+        For multiple choice questions, include:
+        1. The question text
+        2. Four possible answer options
+        3. The index of the correct answer (0-3)
+
+        For paragraph questions, include:
+        1. The question text
+        2. A model answer that would receive full marks
+        3. A list of keywords/concepts that should be included in a good answer
+
+        Format your response as a valid JSON array of questions with proper formatting.
+        Ensure all JSON is correctly formatted with no trailing commas or syntax errors.
+    """,
+    instructions="""
+        You are a professional educator creating test content. Generate well-formed questions in valid JSON format.
+        Each question should have:
+        1. 'text' (string): The question text
+        2. 'type' (string): Either 'mcq' or 'paragraph'
+        3. For MCQ type:
+        - 'options' (array of strings): Four answer choices
+        - 'correct_answer' (number): Index (0-3) of correct option
+        4. For paragraph type:
+        - 'model_answer' (string): Example of a complete, correct answer
+        - 'keywords' (array of strings): Important concepts that should be included
+        - 'max_score' (number): Maximum points for the question (default: 10)
+
+        IMPORTANT: Your response must be valid JSON with proper formatting. Double-check for syntax errors, especially:
+        - Make sure all strings are properly quoted with double quotes
+        - All properties and string values need to be enclosed in double quotes
+        - No trailing commas in arrays or objects
+        - Correct use of brackets and braces
+    """,
+    budgets={'description': 'prompt_description_max_tokens'},
+)
+
+STAGED_QUESTION = Template(
+    'staged_question', 2,
+    prompt="""
+        Create ONE detailed paragraph/essay question about {title}.
+        {context}
+        Description: {description}
+
+        Make this question #{number} in a series of {num_questions} questions on this topic.
+
+        The question should:
+        1. Be well-formed and challenging
+        2. Require a well-structured essay response
+        3. Be suitable for an educational assessment
+
+        Format as JSON with these fields:
+        - text: question text
+        - type: "paragraph"
+        - model_answer: 3-4 paragraph comprehensive answer
+        - keywords: 5-8 key concepts
+        - max_score: 10
+    """,
+    instructions="""
+        You are creating ONE paragraph question in valid JSON format:
+        {{"text": "The detailed question text", "type": "paragraph", "model_answer": "A comprehensive model answer (3-4 paragraphs)", "keywords": ["keyword1", "keyword2", "keyword3", "keyword4", "keyword5"], "max_score": 10}}
+
+        Ensure proper JSON formatting with double quotes, no trailing commas, and proper use of brackets.
+    """,
+    budgets={'description': 'prompt_description_max_tokens'},
+)
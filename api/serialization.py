@@ -0,0 +1,60 @@
+"""
+JSON encoding for API responses, backed by orjson.
+
+Documents can be returned as they come from MongoDB: ObjectId is written as
+its hex string, so models don't convert each document before handing it to
+a controller. Dates keep the HTTP-date format Flask's own provider writes
+(e.g. "Mon, 05 Jan 2026 09:30:00 GMT"), which clients already parse.
+"""
+import decimal
+from datetime import date
+import orjson
+from bson import ObjectId
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+# Dates go through _default rather than orjson's ISO 8601 encoding
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    # Only called for types orjson can't (or is told not to) encode itself
+    if isinstance(obj, date):
+        # Naive datetimes are read as UTC, which is how they are stored
+        return http_date(obj)
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """
+    Encode `obj` as UTF-8 JSON bytes
+    """
+    return orjson.dumps(obj, default=_default, option=OPTIONS)
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider for `jsonify`, `request.get_json` and `app.json`
+    """
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand the bytes straight to the response rather than via a str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
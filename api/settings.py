@@ -0,0 +1,208 @@
+import os
+from dotenv import load_dotenv
+
+
+class ConfigError(Exception):
+    """
+    Raised at startup when the environment holds invalid settings
+    """
+
+
+_TRUE = ("1", "true", "yes", "on")
+_FALSE = ("0", "false", "no", "off", "")
+
+
+class Settings:
+    """
+    Every setting the API reads, loaded once per process from the environment
+    (and .env). Modules read `settings.<name>` instead of calling os.getenv, so
+    nothing on a request path touches the environment or the filesystem.
+    """
+    def __init__(self, env):
+        self._env = env
+        self._errors = []
+
+        # MongoDB
+        self.mongodb_uri = self._str("MONGODB_URI", "mongodb://localhost:27017/")
+        self.mongodb_max_pool_size = self._int("MONGODB_MAX_POOL_SIZE", None)
+        self.mongodb_min_pool_size = self._int("MONGODB_MIN_POOL_SIZE", None)
+        self.mongodb_connect_timeout_ms = self._int("MONGODB_CONNECT_TIMEOUT_MS", None)
+        self.mongodb_socket_timeout_ms = self._int("MONGODB_SOCKET_TIMEOUT_MS", None)
+        self.mongodb_server_selection_timeout_ms = self._int("MONGODB_SERVER_SELECTION_TIMEOUT_MS", None)
+        self.mongodb_wait_queue_timeout_ms = self._int("MONGODB_WAIT_QUEUE_TIMEOUT_MS", None)
+
+        # Mistral LLM backend
+        self.mistral_api_url = self._str("MISTRAL_API_URL", None)
+        self.mistral_transport = self._choice("MISTRAL_TRANSPORT", "auto", ("auto", "post", "get"))
+        self.mistral_gzip_requests = self._bool("MISTRAL_GZIP_REQUESTS", False)
+        self.mistral_gzip_min_bytes = self._int("MISTRAL_GZIP_MIN_BYTES", 4096)
+        self.mistral_async_max_connections = self._int("MISTRAL_ASYNC_MAX_CONNECTIONS", 1000)
+        self.mistral_endpoint_failures = self._int("MISTRAL_ENDPOINT_FAILURES", 3)
+        self.mistral_endpoint_down_seconds = self._float("MISTRAL_ENDPOINT_DOWN_SECONDS", 30)
+        self.mistral_health_check_seconds = self._float("MISTRAL_HEALTH_CHECK_SECONDS", 10)
+        self.mistral_health_check_path = self._str("MISTRAL_HEALTH_CHECK_PATH", "/")
+        self.mistral_hedge_percentile = self._rate("MISTRAL_HEDGE_PERCENTILE", 0)
+        self.breaker_window_seconds = self._float("MISTRAL_BREAKER_WINDOW_SECONDS", 120)
+        self.breaker_min_calls = self._int("MISTRAL_BREAKER_MIN_CALLS", 5)
+        self.breaker_failure_rate = self._rate("MISTRAL_BREAKER_FAILURE_RATE", 0.5)
+        self.breaker_slow_call_seconds = self._float("MISTRAL_BREAKER_SLOW_CALL_SECONDS", 60)
+        self.breaker_slow_call_rate = self._rate("MISTRAL_BREAKER_SLOW_CALL_RATE", 0.8)
+        self.breaker_open_seconds = self._float("MISTRAL_BREAKER_OPEN_SECONDS", 30)
+        self.llm_fallback_grader = self._choice("LLM_FALLBACK_GRADER", "none", ("none", "keywords"))
+        self.llm_max_concurrency = self._int("LLM_MAX_CONCURRENCY", 32)
+        self.llm_priority_weights = self._weights(
+            "LLM_PRIORITY_WEIGHTS", {"grading": 8, "ask": 4, "generation": 2, "batch": 1})
+
+        # Token budgets for long fields in LLM prompts (0 disables the cut)
+        self.prompt_essay_max_tokens = self._int("PROMPT_ESSAY_MAX_TOKENS", 1500)
+        self.prompt_model_answer_max_tokens = self._int("PROMPT_MODEL_ANSWER_MAX_TOKENS", 800)
+        self.prompt_description_max_tokens = self._int("PROMPT_DESCRIPTION_MAX_TOKENS", 300)
+
+        # Admission control for AI test generation, per worker process
+        self.generation_max_in_flight = self._int("GENERATION_MAX_IN_FLIGHT", 4)
+        self.generation_max_queue = self._int("GENERATION_MAX_QUEUE", 16)
+        self.generation_max_wait_seconds = self._float("GENERATION_MAX_WAIT_SECONDS", 60)
+        self.generation_teacher_rate_per_minute = self._float("GENERATION_TEACHER_RATE_PER_MINUTE", 2)
+        self.generation_teacher_burst = self._int("GENERATION_TEACHER_BURST", 3)
+
+        # Background pre-grading of autosaved answers, per worker process
+        self.pregrade_enabled = self._bool("PREGRADE_ENABLED", True)
+        self.pregrade_debounce_seconds = self._float("PREGRADE_DEBOUNCE_SECONDS", 20)
+        self.pregrade_workers = self._int("PREGRADE_WORKERS", 2)
+        self.pregrade_max_pending = self._int("PREGRADE_MAX_PENDING", 10000)
+
+        # Closing attempts past their time limit, per worker process (0 disables the sweeper)
+        self.attempt_sweep_interval_seconds = self._float("ATTEMPT_SWEEP_INTERVAL_SECONDS", 60)
+        self.attempt_grace_seconds = self._float("ATTEMPT_GRACE_SECONDS", 120)
+        self.abandoned_attempt_retention_days = self._float("ABANDONED_ATTEMPT_RETENTION_DAYS", 7)
+
+        # Completed attempts older than this move to the archive collection (archive-attempts job)
+        self.archive_after_days = self._float("ARCHIVE_AFTER_DAYS", 180)
+        self.archive_batch_size = self._int("ARCHIVE_BATCH_SIZE", 500)
+
+        # Exam-start surge mode: tests are cached ahead of a scheduled start and
+        # attempt inserts coalesced while it lasts
+        self.surge_warm_ahead_seconds = self._float("SURGE_WARM_AHEAD_SECONDS", 300)
+        self.surge_duration_seconds = self._float("SURGE_DURATION_SECONDS", 600)
+        self.surge_poll_seconds = self._float("SURGE_POLL_SECONDS", 30)
+        self.surge_batch_window_ms = self._float("SURGE_BATCH_WINDOW_MS", 5)
+        self.surge_batch_max = self._int("SURGE_BATCH_MAX", 200)
+
+        # Serve each attempt its own question and option order
+        self.shuffle_questions = self._bool("SHUFFLE_QUESTIONS", True)
+
+        # Question bank reused by AI test generation
+        self.question_bank_enabled = self._bool("QUESTION_BANK_ENABLED", True)
+        self.question_bank_min_similarity = self._rate("QUESTION_BANK_MIN_SIMILARITY", 0.5)
+        self.question_bank_candidates = self._int("QUESTION_BANK_CANDIDATES", 200)
+
+        # Observability
+        self.log_level = self._choice("LOG_LEVEL", "INFO", ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"), upper=True)
+        self.tracing_enabled = self._bool("TRACING_ENABLED", True)
+        self.trace_sample_rate = self._rate("TRACE_SAMPLE_RATE", 0.01)
+        self.trace_slow_ms = self._float("TRACE_SLOW_MS", 1000)
+        self.prometheus_multiproc_dir = self._str("PROMETHEUS_MULTIPROC_DIR", None)
+        self.profiling_enabled = self._bool("PROFILING_ENABLED", False)
+        self.profile_dir = self._str("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+        self.profile_mode = self._choice("PROFILE_MODE", "cprofile", ("cprofile", "sample"))
+        self.profile_sample_rate = self._rate("PROFILE_SAMPLE_RATE", 0.0)
+        self.profile_keep = self._int("PROFILE_KEEP", 50)
+
+        # ASGI server (asgi.py): threads serving the synchronous Flask routes
+        self.asgi_wsgi_threads = self._int("ASGI_WSGI_THREADS", 8)
+
+        # Development server
+        self.port = self._int("PORT", 5000)
+
+        if self._errors:
+            raise ConfigError("Invalid configuration: " + "; ".join(self._errors))
+
+    @classmethod
+    def from_env(cls):
+        """
+        Read .env into the environment (existing variables win) and build settings
+        """
+        load_dotenv()
+        return cls(os.environ)
+
+    def validate(self):
+        """
+        Checks that only matter for a server that is about to take traffic
+        """
+        if not self.mistral_api_url:
+            raise ConfigError("MISTRAL_API_URL is not set in the environment or .env file")
+
+    def _raw(self, name):
+        value = self._env.get(name)
+        return value.strip() if value is not None else None
+
+    def _str(self, name, default):
+        return self._raw(name) or default
+
+    def _parse(self, name, default, convert, expected):
+        raw = self._raw(name)
+        if raw is None or raw == "":
+            return default
+        try:
+            return convert(raw)
+        except ValueError:
+            self._errors.append(f"{name} must be {expected}, got {raw!r}")
+            return default
+
+    def _int(self, name, default):
+        return self._parse(name, default, int, "an integer")
+
+    def _float(self, name, default):
+        return self._parse(name, default, float, "a number")
+
+    def _rate(self, name, default):
+        value = self._float(name, default)
+        if not 0 <= value <= 1:
+            self._errors.append(f"{name} must be between 0 and 1, got {value}")
+            return default
+        return value
+
+    def _bool(self, name, default):
+        raw = self._raw(name)
+        if raw is None:
+            return default
+        if raw.lower() in _TRUE:
+            return True
+        if raw.lower() in _FALSE:
+            return False
+        self._errors.append(f"{name} must be true or false, got {raw!r}")
+        return default
+
+    def _weights(self, name, default):
+        """
+        "key=weight,..." pairs overriding some or all of `default`'s keys
+        """
+        raw = self._raw(name)
+        if not raw:
+            return dict(default)
+        weights = dict(default)
+        for pair in raw.split(","):
+            key, _, value = pair.partition("=")
+            key = key.strip().lower()
+            try:
+                weight = float(value)
+            except ValueError:
+                weight = 0
+            if key not in default or weight <= 0:
+                self._errors.append(f"{name} must be positive weights for {', '.join(default)}, got {pair.strip()!r}")
+                continue
+            weights[key] = weight
+        return weights
+
+    def _choice(self, name, default, choices, upper=False):
+        raw = self._raw(name)
+        if not raw:
+            return default
+        value = raw.upper() if upper else raw.lower()
+        if value not in choices:
+            self._errors.append(f"{name} must be one of {', '.join(choices)}, got {raw!r}")
+            return default
+        return value
+
+
+settings = Settings.from_env()
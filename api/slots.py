@@ -0,0 +1,209 @@
+"""
+Concurrency limits with a wait queue, usable both from worker threads (the
+Flask routes) and from coroutines (asgi.py). Subclasses decide who waits,
+who is turned away and in which order waiters get a slot.
+"""
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+import deadline
+
+
+class Waiter:
+    __slots__ = ('key', 'enqueued_at', 'granted', 'notify', 'tag')
+
+    def __init__(self, key, notify):
+        self.key = key
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.notify = notify
+        self.tag = None   # ordering data owned by the subclass
+
+
+class SlotGate:
+    """
+    Lets at most `max_in_flight` callers hold a slot at once; the rest wait,
+    for at most `max_wait_seconds` (None: no limit) or what is left of the
+    request deadline, whichever is shorter.
+
+    Subclasses implement _enqueue, _dequeue, _remove and _on_timeout, and may
+    override the other _on_* hooks. Every hook except _on_timeout runs with
+    the lock held.
+    """
+    def __init__(self, max_in_flight, max_wait_seconds=None):
+        self.max_in_flight = max_in_flight
+        self.max_wait_seconds = max_wait_seconds
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+
+    @contextmanager
+    def slot(self, key):
+        """
+        Hold a slot for the duration of the block, waiting for one if needed
+        """
+        event = threading.Event()
+        waiter = self._admit(key, event.set)
+        if waiter is not None and not event.wait(self._wait_timeout()):
+            self._give_up(waiter)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(started)
+
+    @asynccontextmanager
+    async def async_slot(self, key):
+        """
+        slot() for coroutines: waits on the event loop instead of blocking a thread
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+
+        waiter = self._admit(key, lambda: loop.call_soon_threadsafe(resolve))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(future, self._wait_timeout())
+            except asyncio.TimeoutError:
+                self._give_up(waiter)
+            except asyncio.CancelledError:
+                if self._abandon(waiter):
+                    self._release(time.monotonic())
+                raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(started)
+
+    def try_slot(self, key):
+        """
+        Take a slot only if one is free right now and nobody is waiting for
+        one. Returns a handle to pass to release_slot, or None.
+        """
+        with self._lock:
+            if self._in_flight >= self.max_in_flight or self._queued:
+                return None
+            self._in_flight += 1
+            self._on_granted(key, 0.0)
+            self._publish()
+            return time.monotonic()
+
+    def release_slot(self, handle):
+        self._release(handle)
+
+    def _wait_timeout(self):
+        left = deadline.remaining()
+        if left is None:
+            return self.max_wait_seconds
+        return left if self.max_wait_seconds is None else min(self.max_wait_seconds, left)
+
+    def _admit(self, key, notify):
+        """
+        Take a slot now (returns None) or join the queue (returns the waiter)
+        """
+        with self._lock:
+            self._on_arrival(key)
+
+            if self._in_flight < self.max_in_flight and not self._queued:
+                self._in_flight += 1
+                self._on_granted(key, 0.0)
+                self._publish()
+                return None
+
+            self._on_queue(key)
+            waiter = Waiter(key, notify)
+            self._enqueue(waiter)
+            self._queued += 1
+            self._publish()
+            return waiter
+
+    def _give_up(self, waiter):
+        """
+        Called when a wait timed out; keeps the slot if it was granted meanwhile
+        """
+        if not self._abandon(waiter):
+            self._on_timeout(waiter)
+
+    def _abandon(self, waiter):
+        """
+        Take a waiter out of the queue. Returns True if it had already been
+        granted a slot, which the caller then owns.
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+            if self._remove(waiter):
+                self._queued -= 1
+                self._on_abandoned(waiter)
+                self._publish()
+            return False
+
+    def _release(self, started):
+        with self._lock:
+            self._in_flight -= 1
+            self._on_released(time.monotonic() - started)
+            self._dispatch()
+            self._publish()
+
+    def _dispatch(self):
+        while self._in_flight < self.max_in_flight:
+            waiter = self._dequeue()
+            if waiter is None:
+                break
+            self._queued -= 1
+            self._in_flight += 1
+            waiter.granted = True
+            self._on_granted(waiter.key, time.monotonic() - waiter.enqueued_at)
+            waiter.notify()
+
+    def _enqueue(self, waiter):
+        raise NotImplementedError
+
+    def _dequeue(self):
+        """
+        The next waiter to get a slot, removed from the queue, or None
+        """
+        raise NotImplementedError
+
+    def _remove(self, waiter):
+        """
+        Drop a waiter from the queue; False if it was not there
+        """
+        raise NotImplementedError
+
+    def _on_timeout(self, waiter):
+        """
+        Must raise: the caller gave up waiting without a slot
+        """
+        raise NotImplementedError
+
+    def _on_arrival(self, key):
+        """
+        May raise to turn a caller away before it takes or waits for a slot
+        """
+
+    def _on_queue(self, key):
+        """
+        May raise to turn a caller away instead of queueing it
+        """
+
+    def _on_granted(self, key, waited):
+        pass
+
+    def _on_abandoned(self, waiter):
+        pass
+
+    def _on_released(self, held):
+        pass
+
+    def _publish(self):
+        """
+        Export current in-flight and queue figures, e.g. to gauges
+        """
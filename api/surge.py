@@ -0,0 +1,112 @@
+"""
+Exam-start surge mode. When a teacher schedules a test as an exam, every
+worker caches the students' copy of it shortly before the start, so the
+wave of start requests doesn't read the test from MongoDB each time, and
+coalesces the attempt inserts of that wave (see batching.InsertBatcher).
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from models import Test
+from settings import settings
+from tracing import get_logger
+
+logger = get_logger('surge')
+
+
+class SurgeCache:
+    """
+    Students' copies (without correct answers) of the tests in surge mode:
+    from `warm_ahead_seconds` before their exam starts until their surge
+    ends. Refreshed from MongoDB every `poll_seconds` by a thread in each
+    worker process, which also picks up edits made during the surge; a test
+    found edited in between is reloaded on its own with `reload`.
+    """
+    def __init__(self, warm_ahead_seconds=300, poll_seconds=30):
+        self.warm_ahead_seconds = warm_ahead_seconds
+        self.poll_seconds = poll_seconds
+
+        self._tests = {}   # test_id -> (students' copy, surge_until); replaced whole on refresh
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(warm_ahead_seconds=settings.surge_warm_ahead_seconds, poll_seconds=settings.surge_poll_seconds)
+
+    def get(self, test_id):
+        """
+        The cached students' copy of the test if it is in surge mode, otherwise None
+        """
+        entry = self._tests.get(test_id)
+        if entry is None or entry[1] <= datetime.utcnow():
+            return None
+        return entry[0]
+
+    def reload(self, test_id):
+        """
+        Replace one test's entry with its current copy from MongoDB
+        
+        Returns:
+            dict: The new students' copy, or None if the test is gone or no
+            longer in surge mode
+        """
+        test = Test.get_by_id(test_id)
+        now = datetime.utcnow()
+        tests = dict(self._tests)
+        if test and test.get('surge_until') and test['surge_until'] > now:
+            copy = Test.without_answers(test)
+            tests[test_id] = (copy, test['surge_until'])
+        else:
+            copy = None
+            tests.pop(test_id, None)
+        self._tests = tests
+        return copy
+
+    def refresh(self):
+        now = datetime.utcnow()
+        tests = Test.find_surging(now, now + timedelta(seconds=self.warm_ahead_seconds))
+        self._tests = {
+            str(test['_id']): (Test.without_answers(dict(test, _id=str(test['_id']))), test['surge_until'])
+            for test in tests
+        }
+        return len(self._tests)
+
+    def start(self):
+        """
+        Start refreshing in the background, once per process
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            # Threads don't survive a fork, so each worker process starts its own
+            if self._pid == os.getpid():
+                return
+            self._tests = {}
+            threading.Thread(target=self._run, name='surge-cache', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Refreshing the surge cache failed: %s", e)
+            time.sleep(self.poll_seconds)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_surge_cache():
+    """
+    The process-wide surge cache
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SurgeCache.from_settings()
+    return _cache
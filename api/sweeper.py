@@ -0,0 +1,129 @@
+"""
+Server-side enforcement of test time limits: attempts left open past their
+time limit are closed in the background.
+"""
+import os
+import random
+import threading
+import time
+import deadline
+import metrics
+from models import TestAttempt
+from settings import settings
+from tracing import get_logger
+
+logger = get_logger('sweeper')
+
+
+class AttemptSweeper:
+    """
+    Every `interval_seconds`, closes the attempts whose time limit ran out
+    more than `grace_seconds` ago. Autosaved answers are submitted and graded
+    like a normal submission; attempts with nothing saved are marked
+    abandoned, hidden from the student's attempts and deleted by a TTL index
+    after `retention_days`.
+
+    Each worker process runs its own sweeper thread. Closing an attempt goes
+    through the same atomic claim as a submission, so sweepers in different
+    processes never close one twice. An attempt that fails to close is retried
+    after a backoff that doubles with each failure, up to `max_backoff_seconds`.
+    """
+    # Time budget for grading one expired attempt, as for a submit request
+    grading_seconds = 180
+    max_backoff_seconds = 6 * 3600
+
+    def __init__(self, interval_seconds=60, grace_seconds=120, retention_days=7, batch_size=100):
+        self.interval_seconds = interval_seconds
+        self.grace_seconds = grace_seconds
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            interval_seconds=settings.attempt_sweep_interval_seconds,
+            grace_seconds=settings.attempt_grace_seconds,
+            retention_days=settings.abandoned_attempt_retention_days,
+        )
+
+    def start(self):
+        """
+        Start sweeping in the background, once per process; a no-op if disabled
+        """
+        if self.interval_seconds <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            # Threads don't survive a fork, so each worker process starts its own
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='attempt-sweeper', daemon=True).start()
+            self._pid = os.getpid()
+
+    def sweep(self):
+        """
+        Close expired attempts, one batch at a time until none are left
+
+        Returns:
+            dict: How many attempts ended up with each outcome
+        """
+        counts = {}
+        while True:
+            attempts = TestAttempt.find_expired(self.grace_seconds, self.batch_size)
+            outcomes = [self._expire(attempt) for attempt in attempts]
+            for outcome in outcomes:
+                counts[outcome] = counts.get(outcome, 0) + 1
+            # Failed attempts are deferred, so a batch of nothing but
+            # failures means something is wrong beyond single attempts
+            if len(attempts) < self.batch_size or all(outcome == 'failed' for outcome in outcomes):
+                return counts
+
+    def _expire(self, attempt):
+        deadline.set_deadline(self.grading_seconds)
+        try:
+            outcome = TestAttempt.expire(attempt, self.retention_days)
+        except Exception as e:
+            failures = attempt.get('sweep_failures', 0) + 1
+            # The interval is 0 when sweeps run from cron
+            delay = min(max(self.interval_seconds, 60) * 2 ** (failures - 1), self.max_backoff_seconds)
+            logger.warning("Closing expired attempt %s failed (%s times, next try in %ss): %s",
+                           attempt['_id'], failures, delay, e)
+            outcome = 'failed'
+            try:
+                TestAttempt.defer_sweep(attempt['_id'], delay)
+            except Exception as defer_error:
+                logger.warning("Could not defer attempt %s: %s", attempt['_id'], defer_error)
+        finally:
+            deadline.clear_deadline()
+        metrics.ATTEMPTS_EXPIRED.labels(outcome).inc()
+        return outcome
+
+    def _run(self):
+        while True:
+            # Jitter keeps the workers' sweeps from lining up
+            time.sleep(self.interval_seconds * random.uniform(0.5, 1.5))
+            try:
+                counts = self.sweep()
+            except Exception as e:
+                logger.warning("Attempt sweep failed: %s", e)
+                continue
+            if counts:
+                logger.info("Closed expired attempts: %s", counts)
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def get_attempt_sweeper():
+    """
+    The process-wide attempt sweeper
+    """
+    global _sweeper
+    if _sweeper is None:
+        with _sweeper_lock:
+            if _sweeper is None:
+                _sweeper = AttemptSweeper.from_settings()
+    return _sweeper
@@ -0,0 +1,226 @@
+import sys
+import json
+import time
+import uuid
+import random
+import inspect
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from settings import settings
+
+# Limits how much a single request can add to the log, e.g. N+1 query loops
+MAX_SPANS_PER_TRACE = 500
+
+_trace = contextvars.ContextVar('trace', default=None)
+# The innermost open span. Kept per context rather than as a stack on the
+# trace, so concurrent asyncio tasks of one request each nest their own spans.
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, tagged with the current request id
+    """
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        trace = _trace.get()
+        if trace is not None:
+            entry["request_id"] = trace.request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None):
+    """
+    Send all application logs to stderr as JSON lines at LOG_LEVEL (default INFO)
+    """
+    level = (level or settings.log_level).upper()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger('ai_evaluator')
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    root.propagate = False
+
+
+def get_logger(name):
+    return logging.getLogger(f'ai_evaluator.{name}')
+
+
+logger = get_logger('trace')
+
+
+class Span:
+    __slots__ = ('name', 'parent', 'start', 'duration', 'attrs')
+
+    def __init__(self, name, parent, attrs):
+        self.name = name
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Trace:
+    def __init__(self, request_id, name, sampled):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.spans = []
+        self.dropped = 0
+        self.root = self.open(name, {}, None)
+
+    def open(self, name, attrs, parent):
+        span = Span(name, parent, attrs)
+        if len(self.spans) < MAX_SPANS_PER_TRACE:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+        return span
+
+    def close(self, span):
+        span.duration = time.perf_counter() - span.start
+
+    def to_dict(self):
+        index = {id(span): i for i, span in enumerate(self.spans)}
+        origin = self.root.start
+        return [
+            {
+                "name": span.name,
+                "parent": index.get(id(span.parent)),
+                "start_ms": round((span.start - origin) * 1000, 3),
+                "duration_ms": round(span.duration * 1000, 3) if span.duration is not None else None,
+                **span.attrs,
+            }
+            for span in self.spans
+        ]
+
+
+class _NullSpan:
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+_enabled = settings.tracing_enabled
+_sample_rate = settings.trace_sample_rate
+_slow_seconds = settings.trace_slow_ms / 1000
+
+
+def start_trace(name, request_id=None, force_sample=False):
+    """
+    Begin tracing the current request. It is logged when finished if it was
+    sampled (TRACE_SAMPLE_RATE, or forced) or ran slower than TRACE_SLOW_MS.
+    """
+    request_id = request_id or uuid.uuid4().hex
+    if not _enabled:
+        return request_id
+    sampled = force_sample or random.random() < _sample_rate
+    trace = Trace(request_id, name, sampled)
+    _trace.set(trace)
+    _current_span.set(trace.root)
+    return request_id
+
+
+def finish_trace(**attrs):
+    trace = _trace.get()
+    if trace is None:
+        return
+    _trace.set(None)
+    _current_span.set(None)
+    trace.root.set(**attrs)
+    trace.close(trace.root)
+    if trace.sampled or trace.root.duration >= _slow_seconds:
+        logger.info("trace", extra={"fields": {
+            "trace": trace.root.name,
+            "request_id": trace.request_id,
+            "duration_ms": round(trace.root.duration * 1000, 3),
+            "slow": trace.root.duration >= _slow_seconds,
+            "dropped_spans": trace.dropped,
+            "spans": trace.to_dict(),
+        }})
+
+
+def current_request_id():
+    trace = _trace.get()
+    return trace.request_id if trace else None
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time a block as a child of the current span. A no-op outside a trace.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield _NULL_SPAN
+        return
+    current = trace.open(name, attrs, _current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        trace.close(current)
+        _current_span.reset(token)
+
+
+def current_span():
+    """
+    The innermost open span, for attaching attributes from inside a traced function
+    """
+    if _trace.get() is None:
+        return _NULL_SPAN
+    return _current_span.get() or _NULL_SPAN
+
+
+def traced(name):
+    """
+    Decorator form of span() for functions and coroutine functions
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _trace.get() is None:
+                    return await func(*args, **kwargs)
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_class(cls):
+    """
+    Wrap every static method of a controller or model class in a span
+    named after it, e.g. "TestAttempt.submit_with_evaluation"
+    """
+    for attr, value in list(vars(cls).items()):
+        if isinstance(value, staticmethod) and not attr.startswith('__'):
+            setattr(cls, attr, staticmethod(traced(f"{cls.__name__}.{attr}")(value.__func__)))
+    return cls
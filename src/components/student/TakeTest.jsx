@@ -1,7 +1,9 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useParams, useNavigate } from "react-router-dom";
 import { studentService } from "../../services/api";
 
+const AUTOSAVE_DELAY_MS = 3000;
+
 const TakeTest = ({ userId }) => {
   const { testId } = useParams();
   const navigate = useNavigate();
@@ -13,6 +15,10 @@ const TakeTest = ({ userId }) => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState("");
   const [submitting, setSubmitting] = useState(false);
+  // Answers as last autosaved, to send only what changed
+  const savedAnswers = useRef([]);
+  // One key for every try at submitting this attempt
+  const submissionKey = useRef(crypto.randomUUID());
 
   useEffect(() => {
     startTest();
@@ -36,6 +42,31 @@ const TakeTest = ({ userId }) => {
     return () => clearInterval(timerId);
   }, [timeLeft, test]);
 
+  // Autosave answers a few seconds after the student stops changing them
+  useEffect(() => {
+    if (!attempt || submitting) return;
+
+    const timeoutId = setTimeout(async () => {
+      const changed = {};
+      answers.forEach((answer, index) => {
+        if (answer !== null && answer !== savedAnswers.current[index]) {
+          changed[index] = answer;
+        }
+      });
+      if (Object.keys(changed).length === 0) return;
+
+      try {
+        await studentService.saveAnswers(attempt._id, changed);
+        savedAnswers.current = [...answers];
+      } catch (err) {
+        // Not fatal: everything is sent again at submit
+        console.error("Failed to autosave answers:", err);
+      }
+    }, AUTOSAVE_DELAY_MS);
+
+    return () => clearTimeout(timeoutId);
+  }, [answers, attempt, submitting]);
+
   // Format time as mm:ss
   const formatTime = (seconds) => {
     const mins = Math.floor(seconds / 60);
@@ -104,8 +135,13 @@ const TakeTest = ({ userId }) => {
 
     try {
       setSubmitting(true);
-      const response = await studentService.submitTest(attempt._id, answers);
-      navigate(`/student/results/${response.attempt._id}`);
+      const response = await studentService.submitTest(
+        attempt._id,
+        answers,
+        submissionKey.current
+      );
+      // A repeated submit may come back (202) while the first is still being graded
+      navigate(`/student/results/${response.attempt?._id ?? attempt._id}`);
     } catch (err) {
       console.error("Failed to submit test:", err);
       setError(
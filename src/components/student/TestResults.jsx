@@ -18,13 +18,12 @@ const TestResults = ({ userId }) => {
     try {
       setLoading(true);
 
-      // First, get the attempt
-      const attempts = await studentService.getAttempts(userId);
-      const currentAttempt = attempts.attempts?.find(
-        (a) => a._id === attemptId
+      // First, get the attempt (in full, even once it has been archived)
+      const { attempt: currentAttempt } = await studentService.getAttempt(
+        attemptId
       );
 
-      if (!currentAttempt) {
+      if (!currentAttempt || currentAttempt.student_id !== userId) {
         throw new Error("Attempt not found");
       }
 
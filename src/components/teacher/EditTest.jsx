@@ -2,6 +2,22 @@ import { useState, useEffect } from "react";
 import { useParams, useNavigate } from "react-router-dom";
 import { teacherService } from "../../services/api";
 
+// Fields of `after` that differ from `before`; removed fields map to null
+const changedFields = (before, after) => {
+  const changes = {};
+  for (const [field, value] of Object.entries(after)) {
+    if (JSON.stringify(value) !== JSON.stringify(before[field])) {
+      changes[field] = value;
+    }
+  }
+  for (const field of Object.keys(before)) {
+    if (!(field in after)) {
+      changes[field] = null;
+    }
+  }
+  return changes;
+};
+
 const EditTest = ({ userId }) => {
   const { testId } = useParams();
   const navigate = useNavigate();
@@ -14,6 +30,8 @@ const EditTest = ({ userId }) => {
     time_limit: 60,
     questions: [],
   });
+  // The test as loaded, to send only what changed when saving
+  const [original, setOriginal] = useState(null);
 
   // Fetch the test data when component mounts
   useEffect(() => {
@@ -22,13 +40,18 @@ const EditTest = ({ userId }) => {
         setLoading(true);
         const response = await teacherService.getTest(testId);
 
-        // Initialize form with test data
+        // Initialize form with test data; each question remembers its
+        // index in the saved test
         setFormData({
           title: response.test.title,
           description: response.test.description,
           time_limit: response.test.time_limit,
-          questions: response.test.questions,
+          questions: response.test.questions.map((question, index) => ({
+            ...question,
+            _index: index,
+          })),
         });
+        setOriginal(JSON.parse(JSON.stringify(response.test)));
       } catch (err) {
         console.error("Failed to fetch test:", err);
         setError("Failed to load test data. Please try again later.");
@@ -152,7 +175,46 @@ const EditTest = ({ userId }) => {
     setSubmitting(true);
 
     try {
-      await teacherService.updateTest(testId, formData);
+      let { version } = original;
+
+      // Deleted questions first, from the back so earlier indices stay valid
+      const kept = formData.questions
+        .filter((question) => question._index !== undefined)
+        .map((question) => question._index);
+      const deleted = original.questions
+        .map((_, index) => index)
+        .filter((index) => !kept.includes(index))
+        .reverse();
+      for (const index of deleted) {
+        ({ version } = await teacherService.deleteQuestion(testId, index, version));
+      }
+
+      // Then new and changed questions, front to back
+      for (let i = 0; i < formData.questions.length; i++) {
+        const { _index, ...question } = formData.questions[i];
+        if (_index === undefined) {
+          ({ version } = await teacherService.addQuestion(testId, question, i, version));
+        } else {
+          const changes = changedFields(original.questions[_index], question);
+          if (Object.keys(changes).length > 0) {
+            ({ version } = await teacherService.updateQuestion(testId, i, changes, version));
+          }
+        }
+      }
+
+      const { title, description, time_limit } = formData;
+      if (
+        title !== original.title ||
+        description !== original.description ||
+        time_limit !== original.time_limit
+      ) {
+        await teacherService.updateTest(testId, {
+          title,
+          description,
+          time_limit,
+          version,
+        });
+      }
       navigate("/teacher/dashboard");
     } catch (err) {
       console.error("Failed to update test:", err);
@@ -77,6 +77,49 @@ export const teacherService = {
     return response.data;
   },
 
+  // Question-level edits: each sends the test version it was based on and
+  // returns the new one; a 409 means someone else changed the test meanwhile
+  addQuestion: async (testId, question, position, version) => {
+    const response = await api.post(`/tests/${testId}/questions`, {
+      question,
+      position,
+      version,
+    });
+    return response.data;
+  },
+
+  updateQuestion: async (testId, index, changes, version) => {
+    const response = await api.patch(`/tests/${testId}/questions/${index}`, {
+      question: changes,
+      version,
+    });
+    return response.data;
+  },
+
+  deleteQuestion: async (testId, index, version) => {
+    const response = await api.delete(`/tests/${testId}/questions/${index}`, {
+      params: { version },
+    });
+    return response.data;
+  },
+
+  reorderQuestions: async (testId, order, version) => {
+    const response = await api.put(`/tests/${testId}/questions/order`, {
+      order,
+      version,
+    });
+    return response.data;
+  },
+
+  // startsAt: ISO 8601 date and time, or null to clear the schedule
+  scheduleExam: async (testId, startsAt, surgeMinutes) => {
+    const response = await api.put(`/tests/${testId}/exam`, {
+      starts_at: startsAt,
+      ...(surgeMinutes ? { surge_minutes: surgeMinutes } : {}),
+    });
+    return response.data;
+  },
+
   deleteTest: async (testId) => {
     const response = await api.delete(`/tests/${testId}`);
     return response.data;
@@ -97,13 +140,30 @@ export const studentService = {
     return response.data;
   },
 
-  submitTest: async (attemptId, answers) => {
-    const response = await api.post(`/attempts/${attemptId}/submit`, {
+  // answers: { questionIndex: answer } for the answers that changed
+  saveAnswers: async (attemptId, answers) => {
+    const response = await api.patch(`/attempts/${attemptId}/answers`, {
       answers,
     });
     return response.data;
   },
 
+  // Retries of one submission must reuse its idempotency key, so the server
+  // returns the first submission's result instead of grading again
+  submitTest: async (attemptId, answers, idempotencyKey) => {
+    const response = await api.post(
+      `/attempts/${attemptId}/submit`,
+      { answers },
+      { headers: idempotencyKey ? { "Idempotency-Key": idempotencyKey } : {} }
+    );
+    return response.data;
+  },
+
+  getAttempt: async (attemptId) => {
+    const response = await api.get(`/attempts/${attemptId}`);
+    return response.data;
+  },
+
   getAttempts: async (studentId) => {
     const response = await api.get(`/students/${studentId}/attempts`);
     return response.data;